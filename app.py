@@ -12,6 +12,7 @@ st.set_page_config(
 from utils.auth import check_session, show_auth_page, logout
 from utils.ui import render_sidebar, load_custom_css
 from utils.db import supabase
+from utils.scheduler import start_scheduler
 
 # Import Pages
 from views.dashboard import show_dashboard
@@ -29,6 +30,7 @@ from views.admin import show_admin_page
 # 3. Styles & Session
 load_custom_css()
 check_session()
+start_scheduler()  # Автозапуск сканувань (лише з secrets SCHEDULER_ENABLED = true; один потік на сервер)
 
 # ==========================================
 # ГОЛОВНА ЛОГІКА (Як у вашому робочому коді)
@@ -0,0 +1,20 @@
+-- Налаштування автосканування запитів (utils/scheduler.py, вкладка автосканування у views/keywords.py).
+-- frequency — ключ FREQUENCY_HOURS; auto_models — UI-назви моделей (NULL = DEFAULT_AUTO_MODELS).
+-- Планувальник запускається лише з secrets SCHEDULER_ENABLED = true і лише для проектів
+-- status = 'active' з allow_cron = true.
+
+ALTER TABLE keywords
+    ADD COLUMN IF NOT EXISTS is_auto_scan boolean NOT NULL DEFAULT false,
+    ADD COLUMN IF NOT EXISTS frequency text NOT NULL DEFAULT 'weekly',
+    ADD COLUMN IF NOT EXISTS auto_models text[];
+
+ALTER TABLE keywords
+    DROP CONSTRAINT IF EXISTS keywords_frequency_check;
+ALTER TABLE keywords
+    ADD CONSTRAINT keywords_frequency_check
+    CHECK (frequency IN ('daily', 'every_3_days', 'weekly', 'monthly'));
+
+-- Вибірка планувальника: активні запити з автоскануванням
+CREATE INDEX IF NOT EXISTS keywords_auto_scan_idx
+    ON keywords (project_id)
+    WHERE is_auto_scan;
@@ -0,0 +1,13 @@
+-- Збагачення джерел (utils/urls.py): канонічний URL, хост, реєстрований домен (eTLD+1), хеш URL.
+-- Заповнюються фоновою задачею backfill_source_urls (сторінка джерел); рядки без url_hash
+-- дораховуються при завантаженні даних (utils.urls.enrich_sources).
+
+ALTER TABLE extracted_sources
+    ADD COLUMN IF NOT EXISTS canonical_url text,
+    ADD COLUMN IF NOT EXISTS host text,
+    ADD COLUMN IF NOT EXISTS registrable_domain text,
+    ADD COLUMN IF NOT EXISTS url_hash text;
+
+-- Пошук рядків без збагачення та групування за канонічним URL
+CREATE INDEX IF NOT EXISTS extracted_sources_url_hash_idx
+    ON extracted_sources (url_hash);
@@ -0,0 +1,115 @@
+import difflib
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# КАНОНІЧНІ НАЗВИ БРЕНДІВ ("Rozetka", "rozetka.ua", "ROZETKA UA" -> один бренд)
+# ==============================================================================
+
+# Доменні зони, які LLM дописує до назви бренду. Відкидаються лише після крапки:
+# "Rozetka.com.ua" -> "rozetka", але "Beauty Shop" чи "Moyo Online" лишаються як є
+BRAND_TLDS = {"ua", "com", "net", "org", "io", "biz", "info", "eu", "shop", "store", "online"}
+# Країна / зона окремим словом у кінці ("ROZETKA UA", "Rozetka com ua") — теж відкидається;
+# загальні слова ("shop", "online", "net") окремим словом лишаються частиною назви
+BRAND_COUNTRY_TOKENS = {"ua", "com", "eu"}
+
+# Мінімальна схожість для нечіткого збігу з відомим брендом (difflib ratio)
+FUZZY_CUTOFF = 0.88
+
+_NON_WORD = re.compile(r"[\W_]+")
+_TLD_SUFFIX = re.compile(r"(?<=\w)\.(?:%s)$" % "|".join(sorted(BRAND_TLDS)))
+
+
+@lru_cache(maxsize=100_000)
+def brand_key(name):
+    """
+    Ключ для порівняння: 'ROZETKA.com.ua' -> 'rozetka', 'ROZETKA UA' -> 'rozetka',
+    'Nova  Poshta!' -> 'nova poshta', 'Eva Shop' -> 'eva shop'.
+    """
+    s = str(name or "").casefold().strip()
+    for prefix in ("https://", "http://", "www."):
+        if s.startswith(prefix):
+            s = s[len(prefix):]
+    s = s.rstrip("/.")
+    while True:
+        stripped = _TLD_SUFFIX.sub("", s)
+        if stripped == s:
+            break
+        s = stripped
+    tokens = [t for t in _NON_WORD.split(s) if t]
+    while len(tokens) > 1 and tokens[-1] in BRAND_COUNTRY_TOKENS:
+        tokens.pop()
+    return " ".join(tokens)
+
+
+@lru_cache(maxsize=20_000)
+def _fuzzy_key(key, known):
+    """Найближчий відомий ключ або None. Викликається лише для нових назв, результат кешується."""
+    match = difflib.get_close_matches(key, known, n=1, cutoff=FUZZY_CUTOFF)
+    return match[0] if match else None
+
+
+def alias_index(aliases, brand_name=None):
+    """
+    {ключ: канонічна назва} з таблиці синонімів (alias, canonical_name) та назви нашого бренду.
+    Канонічна назва теж є власним синонімом.
+    """
+    index = {}
+    pairs = [] if aliases is None or aliases.empty else list(zip(aliases["alias"], aliases["canonical_name"]))
+    canonicals = [c for _, c in pairs if str(c or "").strip()]
+    if brand_name and str(brand_name).strip():
+        canonicals.append(str(brand_name).strip())
+    for canonical in canonicals:
+        index.setdefault(brand_key(canonical), canonical)
+    for alias, canonical in pairs:
+        if str(alias or "").strip() and str(canonical or "").strip():
+            index[brand_key(alias)] = canonical
+    index.pop("", None)
+    return index
+
+
+def canonical_brands(names, index, target_mask=None, brand_name=None):
+    """
+    Канонічний бренд для кожної згадки: DataFrame(brand_id, brand_canonical) з індексом names.
+
+    Кожна унікальна назва обробляється один раз: синонім -> канонічна назва, інакше
+    нечіткий збіг з відомими брендами, інакше нормалізований ключ. Назва групи без синоніма —
+    найчастіше написання. target_mask (прапорець is_my_brand) примусово відносить згадку до brand_name.
+    brand_id — щільні цілі коди (0..n-1), -1 для порожніх назв.
+    """
+    raw = names.fillna("").astype(str).str.strip()
+    known = tuple(sorted(index))
+
+    group_of = {}
+    for name in raw.unique():
+        key = brand_key(name)
+        if not key:
+            group_of[name] = None
+        elif key in index:
+            group_of[name] = "=" + index[key]
+        else:
+            match = _fuzzy_key(key, known) if known else None
+            group_of[name] = "=" + index[match] if match else key
+
+    groups = raw.map(group_of)
+    if target_mask is not None and brand_name:
+        groups = groups.where(~np.asarray(target_mask, dtype=bool), "=" + str(brand_name).strip())
+
+    codes, uniques = pd.factorize(groups)
+    display = pd.Series(uniques, dtype=object)
+    is_alias = display.str.startswith("=")
+    display[is_alias] = display[is_alias].str[1:]
+
+    # Для груп без синоніма — найчастіше написання
+    if (~is_alias).any():
+        pairs = pd.DataFrame({"code": codes, "raw": raw.to_numpy()})
+        pairs = pairs[pairs["code"] >= 0]
+        plain = pairs[~is_alias.to_numpy()[pairs["code"]]]
+        top = plain.value_counts().reset_index(name="n").drop_duplicates("code").set_index("code")["raw"]
+        display[top.index] = top.to_numpy()
+
+    canonical = np.where(codes >= 0, display.to_numpy()[np.maximum(codes, 0)], None)
+    return pd.DataFrame({"brand_id": codes, "brand_canonical": canonical}, index=names.index)
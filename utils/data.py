@@ -0,0 +1,944 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.db import supabase, fetch_in_chunks, fetch_tables_in_chunks
+from utils.transforms import SENTIMENT_SCORES, brand_target_mask, flag_mask, normalize_sentiment
+from utils.brands import alias_index, canonical_brands
+from utils.providers import providers_matching
+from utils.urls import enrich_sources
+
+# Як часто (сек) довантажувати нові скани в кеш проекту (інкрементально, дешево)
+CACHE_TTL_SECONDS = 60
+
+# Повне перезавантаження кешу проекту (страховка від змін поза застосунком)
+FULL_RELOAD_SECONDS = 3600
+
+# Скільки проектів тримати в пам'яті сервера (давно не відкриті витісняються, LRU)
+MAX_CACHED_PROJECTS = 20
+
+# Нові скани беремо з перекриттям: n8n може дописувати згадки вже після запису скану
+REFRESH_OVERLAP = pd.Timedelta(minutes=10)
+
+# Розмір порції scan_result_id для запитів .in_() (обмеження довжини URL)
+CHUNK_SIZE = 200
+
+# Скільки текстів відповідей LLM (raw_response) тримати в LRU-кеші сервера
+RESPONSE_CACHE_SIZE = 256
+
+# Розмір сторінки scan_results (PostgREST за замовчуванням віддає не більше 1000 рядків)
+SCAN_PAGE_SIZE = 1000
+
+KEYWORD_COLUMNS = ["id", "keyword_text"]
+SCAN_COLUMNS = ["id", "keyword_id", "provider", "created_at", "user_email"]
+MENTION_COLUMNS = ["id", "scan_result_id", "brand_name", "mention_count", "rank_position", "sentiment_score", "is_my_brand"]
+SOURCE_COLUMNS = ["id", "scan_result_id", "url", "domain", "mention_count", "is_official"]
+ASSET_COLUMNS = ["domain_or_url", "type"]
+ALIAS_COLUMNS = ["alias", "canonical_name"]
+
+SENTIMENT_COLUMNS = {"Позитивна": "pos", "Нейтральна": "neu", "Негативна": "neg"}
+SUMMARY_SUM_COLUMNS = ["total_mentions", "my_mentions", "rank_sum", "rank_cnt", "pos", "neu", "neg"]
+DAILY_KEYS = ["provider", "keyword_id", "day"]
+
+
+@st.cache_resource
+def _project_store():
+    """
+    Спільне (для всіх сесій) сховище завантажених даних проектів.
+    project_id -> {"project_id", "loaded_at", "full_loaded_at", "frames": dict[str, DataFrame], "derived", "watermark"}
+    Не більше MAX_CACHED_PROJECTS проектів (див. _remember).
+    """
+    return {"lock": threading.Lock(), "projects": OrderedDict(), "locks": {}}
+
+
+def _remember(store, project_id, entry):
+    """Записує entry у сховище як найсвіжіший; найдавніше відкриті проекти понад MAX_CACHED_PROJECTS витісняються."""
+    with store["lock"]:
+        store["projects"][project_id] = entry
+        store["projects"].move_to_end(project_id)
+        while len(store["projects"]) > MAX_CACHED_PROJECTS:
+            evicted, _ = store["projects"].popitem(last=False)
+            _drop_lock(store, evicted)
+
+
+def _touch(store, project_id):
+    """Позначає проект як щойно відкритий (для LRU)."""
+    with store["lock"]:
+        if project_id in store["projects"]:
+            store["projects"].move_to_end(project_id)
+
+
+def _drop_lock(store, project_id):
+    """Блокування проекту, якого вже немає в кеші (викликати під store["lock"]). Зайняте — лишається."""
+    lock = store.get("locks", {}).get(project_id)
+    if lock is not None and not lock.locked():
+        del store["locks"][project_id]
+
+
+def _project_lock(project_id):
+    store = _project_store()
+    with store["lock"]:
+        if project_id not in store["locks"]:
+            store["locks"][project_id] = threading.Lock()
+        return store["locks"][project_id]
+
+
+def _watermark(scans):
+    """Час найновішого скану в кеші (None, якщо сканів немає)."""
+    wm = scans["created_at"].max() if not scans.empty else None
+    return None if pd.isna(wm) else wm
+
+
+def _full_entry(project_id):
+    frames = _fetch_project_frames(project_id)
+    now = time.monotonic()
+    return {"project_id": project_id, "loaded_at": now, "full_loaded_at": now, "frames": frames,
+            "derived": {}, "watermark": _watermark(frames["scans"])}
+
+
+def _store_entry(project_id, ttl=CACHE_TTL_SECONDS):
+    """
+    Запис кешу проекту. Якщо TTL минув — довантажує лише нові скани (з watermark),
+    повністю перечитує проект лише раз на FULL_RELOAD_SECONDS або після invalidate_project_data().
+    """
+    store = _project_store()
+    entry = store["projects"].get(project_id)
+
+    if entry is None or time.monotonic() - entry["loaded_at"] > ttl:
+        # Один запит до БД на проект, навіть якщо сторінку відкрили кілька аналітиків
+        with _project_lock(project_id):
+            entry = store["projects"].get(project_id)
+            if entry is None or time.monotonic() - entry["loaded_at"] > ttl:
+                if entry is None or entry["watermark"] is None \
+                        or time.monotonic() - entry["full_loaded_at"] > FULL_RELOAD_SECONDS:
+                    entry = _full_entry(project_id)
+                else:
+                    entry = _refreshed_entry(project_id, entry)
+                _remember(store, project_id, entry)
+    else:
+        _touch(store, project_id)
+    return entry
+
+
+def _derived(entry, key, builder):
+    """
+    Похідна таблиця запису кешу entry (див. _store_entry), рахується один раз на завантаження даних проекту
+    (при інкрементальному оновленні — доповнюється, див. _refresh_derived).
+    builder(entry) має читати лише entry["frames"] / _derived(entry, ...) того ж запису:
+    інакше похідні масиви можуть не збігтися з frames за довжиною і порядком.
+    """
+    if key not in entry["derived"]:
+        value = builder(entry)
+        # Запис — під блокуванням проекту: _refreshed_entry саме читає entry["derived"]
+        with _project_lock(entry["project_id"]):
+            entry["derived"].setdefault(key, value)
+    return entry["derived"][key].copy()
+
+
+def invalidate_project_data(project_id):
+    """
+    Видаляє проект з кешу (наступне читання — повне). Викликати після видалень та змін Whitelist.
+    """
+    if not project_id:
+        return
+    for store in (_project_store(), _last_scans_store(), _summary_store()):
+        with store["lock"]:
+            store["projects"].pop(project_id, None)
+            _drop_lock(store, project_id)
+
+
+def mark_project_stale(project_id):
+    """Наступне читання довантажить нові скани (інкрементально). Викликати після запуску сканувань."""
+    for store in (_project_store(), _last_scans_store(), _summary_store()):
+        entry = store["projects"].get(project_id)
+        if entry is not None:
+            entry["loaded_at"] = float("-inf")
+
+
+def _frame(rows, columns):
+    """DataFrame з гарантованим набором колонок (навіть якщо рядків немає)."""
+    df = pd.DataFrame(rows) if rows else pd.DataFrame(columns=columns)
+    for col in columns:
+        if col not in df.columns:
+            df[col] = None
+    return df
+
+
+def _scan_query(project_id, columns, providers=None, start=None, end=None, count=None):
+    """Базовий запит scan_results проекту з необов'язковими фільтрами (start включно, end — ні)."""
+    q = supabase.table("scan_results").select(columns, count=count).eq("project_id", project_id)
+    if providers is not None:
+        q = q.in_("provider", list(providers))
+    if start:
+        q = q.gte("created_at", start)
+    if end:
+        q = q.lt("created_at", end)
+    return q
+
+
+def fetch_scan_page(project_id, columns=None, cursor=None, page_size=SCAN_PAGE_SIZE, ascending=False, **filters):
+    """
+    Одна сторінка scan_results з keyset-пагінацією по (created_at, id).
+
+    cursor — (created_at, id) останнього рядка попередньої сторінки (None = перша).
+    Повертає (rows, next_cursor); next_cursor = None, якщо сторінка остання.
+    Колонки мають містити created_at та id (None — SCAN_COLUMNS, без user_email у старих схемах).
+    """
+    if columns is None:
+        try:
+            return fetch_scan_page(project_id, ", ".join(SCAN_COLUMNS), cursor, page_size, ascending, **filters)
+        except Exception as e:
+            # Старі схеми без колонки user_email
+            if "user_email" not in str(e):
+                raise
+            columns = ", ".join(c for c in SCAN_COLUMNS if c != "user_email")
+
+    q = _scan_query(project_id, columns, **filters)
+    if cursor:
+        last_ts, last_id = cursor
+        op = "gt" if ascending else "lt"
+        q = q.or_(f'created_at.{op}."{last_ts}",and(created_at.eq."{last_ts}",id.{op}."{last_id}")')
+
+    rows = q.order("created_at", desc=not ascending)\
+        .order("id", desc=not ascending)\
+        .limit(page_size)\
+        .execute().data or []
+
+    next_cursor = (rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == page_size else None
+    return rows, next_cursor
+
+
+def iter_scan_pages(project_id, columns=None, page_size=SCAN_PAGE_SIZE, ascending=False, **filters):
+    """Потоково віддає сторінки scan_results (від найновіших), без обмеження на розмір історії."""
+    cursor = None
+    while True:
+        rows, cursor = fetch_scan_page(project_id, columns, cursor, page_size, ascending, **filters)
+        if rows:
+            yield rows
+        if cursor is None:
+            return
+
+
+def count_scans(project_id, **filters):
+    """Кількість сканувань проекту з тими ж фільтрами, що й fetch_scan_page."""
+    resp = _scan_query(project_id, "id", count="exact", **filters).limit(1).execute()
+    return resp.count or 0
+
+
+def _fetch_scans(project_id, **filters):
+    return [row for page in iter_scan_pages(project_id, **filters) for row in page]
+
+
+def _typed_scans(df):
+    df["created_at"] = pd.to_datetime(df["created_at"], utc=True, errors="coerce")
+    df["provider"] = df["provider"].fillna("").astype(str)
+    return df
+
+
+def _typed_mentions(df):
+    df["mention_count"] = pd.to_numeric(df["mention_count"], errors="coerce").fillna(0)
+    # Без позиції — NaN (не 0): середні позиції рахуються лише по реальних позиціях
+    df["rank_position"] = pd.to_numeric(df["rank_position"], errors="coerce")
+    df["brand_name"] = df["brand_name"].fillna("").astype(str)
+    df["sentiment_score"] = normalize_sentiment(df["sentiment_score"])
+    return df
+
+
+def _typed_sources(df):
+    df["mention_count"] = pd.to_numeric(df["mention_count"], errors="coerce").fillna(0)
+    df["url"] = df["url"].fillna("").astype(str)
+    # Канонічний URL / хост / реєстрований домен / хеш: збережені або пораховані тут один раз (utils.urls)
+    return enrich_sources(df)
+
+
+def _fetch_small_frames(project_id):
+    """Ключові слова, Whitelist та синоніми брендів (невеликі таблиці — завжди читаються повністю)."""
+    kw_resp = supabase.table("keywords").select(", ".join(KEYWORD_COLUMNS)).eq("project_id", project_id).execute()
+    keywords = _frame(kw_resp.data, KEYWORD_COLUMNS)
+
+    try:
+        oa_resp = supabase.table("official_assets").select(", ".join(ASSET_COLUMNS)).eq("project_id", project_id).execute()
+        assets = _frame(oa_resp.data, ASSET_COLUMNS)
+    except Exception:
+        assets = _frame([], ASSET_COLUMNS)
+
+    try:
+        al_resp = supabase.table("brand_aliases").select(", ".join(ALIAS_COLUMNS)).eq("project_id", project_id).execute()
+        aliases = _frame(al_resp.data, ALIAS_COLUMNS)
+    except Exception:
+        # Таблиці синонімів може ще не бути
+        aliases = _frame([], ALIAS_COLUMNS)
+
+    return {"keywords": keywords, "assets": assets, "aliases": aliases}
+
+
+def _fetch_scan_frames(project_id, **filters):
+    """Скани (з фільтрами fetch_scan_page) разом з їхніми згадками та джерелами."""
+    scans = _typed_scans(_frame(_fetch_scans(project_id, **filters), SCAN_COLUMNS))
+
+    # Згадки та джерела — паралельно, порціями по CHUNK_SIZE
+    rows = fetch_tables_in_chunks(
+        {"brand_mentions": "*", "extracted_sources": "*"},
+        "scan_result_id", scans["id"].tolist(), chunk_size=CHUNK_SIZE
+    )
+    mentions = _typed_mentions(_frame(rows["brand_mentions"], MENTION_COLUMNS))
+    sources = _typed_sources(_frame(rows["extracted_sources"], SOURCE_COLUMNS))
+
+    return {"scans": scans, "mentions": mentions, "sources": sources}
+
+
+def _fetch_project_frames(project_id):
+    return {**_fetch_small_frames(project_id), **_fetch_scan_frames(project_id)}
+
+
+# ==============================================================================
+# ІНКРЕМЕНТАЛЬНЕ ОНОВЛЕННЯ (watermark)
+# ==============================================================================
+def _splice(old, new, key, replaced_ids):
+    """Рядки old без replaced_ids + рядки new (нові — першими, як у сортуванні від найновіших)."""
+    kept = old[~old[key].isin(replaced_ids)]
+    if new.empty:
+        return kept.reset_index(drop=True)
+    if kept.empty:
+        return new.reset_index(drop=True)
+    return pd.concat([new, kept], ignore_index=True)
+
+
+def _refreshed_entry(project_id, entry):
+    """
+    Новий запис кешу: старі дані + скани, створені після watermark (з перекриттям REFRESH_OVERLAP).
+    Похідні таблиці оновлюються лише для змінених сканів (див. _refresh_derived).
+    """
+    since = (entry["watermark"] - REFRESH_OVERLAP).isoformat()
+    delta = _fetch_scan_frames(project_id, start=since)
+    old = entry["frames"]
+
+    # Скани з перекриття могли вже бути в кеші — замінюємо їх повністю (разом зі згадками)
+    replaced_ids = set(delta["scans"]["id"])
+    frames = {
+        **_fetch_small_frames(project_id),
+        "scans": _splice(old["scans"], delta["scans"], "id", replaced_ids),
+        "mentions": _splice(old["mentions"], delta["mentions"], "scan_result_id", replaced_ids),
+        "sources": _splice(old["sources"], delta["sources"], "scan_result_id", replaced_ids),
+    }
+
+    return {
+        "project_id": project_id,
+        "loaded_at": time.monotonic(),
+        "full_loaded_at": entry["full_loaded_at"],
+        "frames": frames,
+        "derived": _refresh_derived(entry["derived"], old, delta, replaced_ids),
+        "watermark": _watermark(frames["scans"]) or entry["watermark"],
+    }
+
+
+def _refresh_derived(derived, old_frames, delta, replaced_ids):
+    """
+    Оновлює збережені похідні таблиці лише для змінених сканів.
+    Ті, що не вміють оновлюватись інкрементально, відкидаються (перерахуються при потребі).
+    """
+    if not replaced_ids:
+        return dict(derived)
+
+    out = {}
+    kept_mentions = ~old_frames["mentions"]["scan_result_id"].isin(replaced_ids)
+
+    for key, value in derived.items():
+        kind, brand_name = key
+        if kind == "is_target":
+            # Порядок як у _splice: нові згадки, потім старі без замінених сканів
+            new_mask = brand_target_mask(delta["mentions"], brand_name)
+            out[key] = pd.concat([new_mask, value[kept_mentions.values]], ignore_index=True)
+        elif kind == "scan_summary":
+            new_rows = _build_scan_summary(delta, brand_name)
+            out[key] = _splice(value, new_rows, "id", replaced_ids)
+        elif kind == "source_counters":
+            # Віднімаємо внесок замінених сканів і додаємо їхні нові версії
+            removed = _count_sources(_source_rows(old_frames, replaced_ids))
+            added = _count_sources(_source_rows(delta))
+            out[key] = _merge_source_counters(value, removed, added)
+
+    for key, value in derived.items():
+        kind, brand_name = key
+        summary = out.get(("scan_summary", brand_name))
+        if kind == "daily_summary" and summary is not None:
+            # Перераховуємо лише ті (provider, keyword_id, day), яких торкнулись змінені скани
+            old_summary = derived[("scan_summary", brand_name)]
+            touched = pd.concat([
+                old_summary[old_summary["id"].isin(replaced_ids)],
+                summary[summary["id"].isin(replaced_ids)],
+            ])[DAILY_KEYS].drop_duplicates()
+            affected = summary.merge(touched, on=DAILY_KEYS, how="inner")
+            untouched = value.merge(touched, on=DAILY_KEYS, how="left", indicator=True)
+            untouched = untouched[untouched["_merge"] == "left_only"].drop(columns="_merge")
+            out[key] = pd.concat([untouched, _build_daily_summary(affected)], ignore_index=True)
+
+    return out
+
+
+def load_project_data(project_id, ttl=CACHE_TTL_SECONDS, brand_name=None):
+    """
+    Повертає дані проекту як dict DataFrame-ів:
+    keywords, scans, mentions, sources, assets.
+
+    Дані кешуються на рівні сервера (спільно для всіх сесій) на `ttl` секунд
+    або до виклику invalidate_project_data(). Кожен виклик повертає копії,
+    тому сторінки можуть вільно додавати свої колонки.
+
+    sentiment_score у mentions вже нормалізовано (Позитивна / Нейтральна / Негативна),
+    sources містить canonical_url, host, registrable_domain, url_hash (utils.urls).
+    Якщо передано brand_name, mentions отримує колонки is_target (utils.transforms)
+    та brand_id / brand_canonical (канонічний бренд, utils.brands).
+    """
+    # Один запис кешу на весь виклик: frames і похідні колонки — з одного завантаження
+    entry = _store_entry(project_id, ttl)
+    frames = {name: df.copy() for name, df in entry["frames"].items()}
+    if brand_name is not None:
+        frames["mentions"]["is_target"] = _is_target(entry, brand_name)
+        brands = _brand_ids(entry, brand_name)
+        frames["mentions"]["brand_id"] = brands["brand_id"].to_numpy()
+        frames["mentions"]["brand_canonical"] = brands["brand_canonical"].to_numpy()
+    return frames
+
+
+def _build_brand_ids(frames, brand_name):
+    mentions = frames["mentions"]
+    return canonical_brands(
+        mentions["brand_name"], alias_index(frames["aliases"], brand_name),
+        target_mask=flag_mask(mentions["is_my_brand"]), brand_name=brand_name
+    )
+
+
+def _is_target(entry, brand_name):
+    return _derived(entry, ("is_target", brand_name), lambda e: brand_target_mask(e["frames"]["mentions"], brand_name))
+
+
+def _brand_ids(entry, brand_name):
+    return _derived(entry, ("brand_ids", brand_name), lambda e: _build_brand_ids(e["frames"], brand_name))
+
+
+def _build_last_scans(frames):
+    scans = frames["scans"]
+    if scans.empty:
+        return pd.DataFrame(columns=["keyword_id", "provider", "last_scan_at"])
+    return scans.groupby(["keyword_id", "provider"], as_index=False, sort=False)["created_at"].max() \
+        .rename(columns={"created_at": "last_scan_at"})
+
+
+@st.cache_resource
+def _last_scans_store():
+    """project_id -> {"last": DataFrame, "watermark", "loaded_at"} (спільно для всіх сесій, LRU як _project_store)."""
+    return {"lock": threading.Lock(), "projects": OrderedDict()}
+
+
+def load_last_scans(project_id, ttl=CACHE_TTL_SECONDS):
+    """
+    Останній скан для кожної пари (keyword_id, provider): keyword_id, provider, last_scan_at.
+    Окремий легкий кеш без згадок і джерел: читаються лише id, keyword_id, provider, created_at,
+    після першого читання — лише скани, новіші за watermark (з перекриттям REFRESH_OVERLAP).
+    """
+    store = _last_scans_store()
+    entry = store["projects"].get(project_id)
+    if entry is not None and time.monotonic() - entry["loaded_at"] <= ttl:
+        _touch(store, project_id)
+        return entry["last"].copy()
+
+    start = None
+    if entry is not None and entry["watermark"] is not None:
+        start = (entry["watermark"] - REFRESH_OVERLAP).isoformat()
+    columns = ["id", "keyword_id", "provider", "created_at"]
+    rows = [row for page in iter_scan_pages(project_id, ", ".join(columns), start=start) for row in page]
+    last = _build_last_scans({"scans": _typed_scans(_frame(rows, columns))})
+    if entry is not None and not entry["last"].empty:
+        last = pd.concat([entry["last"], last], ignore_index=True)\
+            .groupby(["keyword_id", "provider"], as_index=False, sort=False)["last_scan_at"].max()
+
+    watermark = last["last_scan_at"].max() if not last.empty else None
+    _remember(store, project_id, {
+        "last": last,
+        "watermark": None if pd.isna(watermark) else watermark,
+        "loaded_at": time.monotonic(),
+    })
+    return last.copy()
+
+
+def load_providers(project_id):
+    """Усі сирі значення provider у сканах проекту (для фільтрів за UI-назвою, див. utils.providers)."""
+    return _derived(_store_entry(project_id), ("providers", None), lambda e: e["frames"]["scans"]["provider"].drop_duplicates().tolist())
+
+
+# ==============================================================================
+# ТЕКСТИ ВІДПОВІДЕЙ LLM (лениве завантаження)
+# ==============================================================================
+@st.cache_resource
+def _response_cache():
+    """LRU-кеш raw_response: scan_id -> текст (спільний для всіх сесій)."""
+    return {"lock": threading.Lock(), "items": OrderedDict()}
+
+
+def get_scan_responses(scan_ids):
+    """
+    Тексти відповідей для списку сканів: {scan_id: raw_response}.
+    Списки та агрегати raw_response не читають — лише цей виклик, для того, що реально показується.
+    Відсутні в кеші тексти довантажуються одним порційним запитом.
+    """
+    cache = _response_cache()
+    out, missing = {}, []
+    with cache["lock"]:
+        for scan_id in dict.fromkeys(scan_ids):
+            if scan_id in cache["items"]:
+                cache["items"].move_to_end(scan_id)
+                out[scan_id] = cache["items"][scan_id]
+            else:
+                missing.append(scan_id)
+
+    if missing:
+        rows = fetch_in_chunks("scan_results", "id", missing, columns="id, raw_response", chunk_size=CHUNK_SIZE)
+        fetched = {row["id"]: row.get("raw_response") or "" for row in rows}
+        out.update(fetched)
+        with cache["lock"]:
+            for scan_id, text in fetched.items():
+                cache["items"][scan_id] = text
+                cache["items"].move_to_end(scan_id)
+            while len(cache["items"]) > RESPONSE_CACHE_SIZE:
+                cache["items"].popitem(last=False)
+    return out
+
+
+def get_scan_response(scan_id):
+    """Текст відповіді LLM одного скану (з LRU-кешу)."""
+    return get_scan_responses([scan_id]).get(scan_id, "")
+
+
+# ==============================================================================
+# АГРЕГАТИ (матеріалізовані зведення для дашборду)
+# ==============================================================================
+def _build_scan_summary(frames, brand_name):
+    scans = frames["scans"]
+    mentions = frames["mentions"]
+    cols = ["id", "keyword_id", "provider", "created_at", "day"] + SUMMARY_SUM_COLUMNS
+    if scans.empty or mentions.empty:
+        return pd.DataFrame(columns=cols)
+
+    is_target = brand_target_mask(mentions, brand_name)
+    sentiment = mentions["sentiment_score"]
+    ranked = is_target & (mentions["rank_position"] > 0)
+
+    m = pd.DataFrame({
+        "scan_result_id": mentions["scan_result_id"],
+        "total_mentions": mentions["mention_count"],
+        "my_mentions": mentions["mention_count"].where(is_target, 0),
+        "rank_sum": mentions["rank_position"].where(ranked, 0),
+        "rank_cnt": ranked.astype(int),
+    })
+    for label, col in SENTIMENT_COLUMNS.items():
+        m[col] = (is_target & (sentiment == label)).astype(int)
+
+    per_scan = m.groupby("scan_result_id", sort=False)[SUMMARY_SUM_COLUMNS].sum()
+
+    # inner: скани без жодної згадки не потрапляють у зведення (як і раніше)
+    summary = scans[["id", "keyword_id", "provider", "created_at"]].merge(
+        per_scan, left_on="id", right_index=True, how="inner"
+    )
+    summary["day"] = summary["created_at"].dt.floor("D")
+    return summary[cols].reset_index(drop=True)
+
+
+def _build_daily_summary(summary):
+    if summary.empty:
+        return pd.DataFrame(columns=DAILY_KEYS + ["scans"] + SUMMARY_SUM_COLUMNS)
+    summary = summary.assign(scans=1)
+    return summary.groupby(DAILY_KEYS, as_index=False)[["scans"] + SUMMARY_SUM_COLUMNS].sum()
+
+
+def _scan_summary(entry, brand_name):
+    return _derived(entry, ("scan_summary", brand_name), lambda e: _build_scan_summary(e["frames"], brand_name))
+
+
+def _fresh_entry(project_id, ttl=CACHE_TTL_SECONDS):
+    """Запис повного кешу проекту, якщо він уже в пам'яті й не застарів (без звернення до БД), інакше None."""
+    entry = _project_store()["projects"].get(project_id)
+    if entry is not None and time.monotonic() - entry["loaded_at"] <= ttl:
+        return entry
+    return None
+
+
+def load_scan_summary(project_id, brand_name):
+    """
+    Зведення по кожному скану (одна строка = один scan_result):
+    total_mentions, my_mentions, rank_sum / rank_cnt (позиції бренду > 0),
+    pos / neu / neg (кількість згадок бренду за тональністю).
+    Якщо повні дані проекту вже в кеші — з них, інакше з легкого кешу (_summary_entry).
+    """
+    entry = _fresh_entry(project_id)
+    if entry is not None:
+        return _scan_summary(entry, brand_name)
+    return _summary_entry(project_id, brand_name)["summaries"][brand_name].copy()
+
+
+def load_daily_summary(project_id, brand_name):
+    """Зведення по (provider, keyword_id, day) — для графіків динаміки."""
+    entry = _fresh_entry(project_id)
+    if entry is not None:
+        return _derived(
+            entry, ("daily_summary", brand_name),
+            lambda e: _build_daily_summary(_scan_summary(e, brand_name))
+        )
+    entry = _summary_entry(project_id, brand_name)
+    if brand_name not in entry["daily"]:
+        entry["daily"][brand_name] = _build_daily_summary(entry["summaries"][brand_name])
+    return entry["daily"][brand_name].copy()
+
+
+# ==============================================================================
+# ЛЕГКИЙ КЕШ ЗВЕДЕНЬ (KPI та динаміка дашборду без повного завантаження проекту)
+# Читаються лише колонки сканів і згадок, потрібні для зведення; джерела не читаються,
+# згадки в пам'яті не зберігаються — лише одна числова строка на скан.
+# ==============================================================================
+SUMMARY_SCAN_COLUMNS = ["id", "keyword_id", "provider", "created_at"]
+SUMMARY_MENTION_COLUMNS = ["scan_result_id", "brand_name", "mention_count", "rank_position", "sentiment_score", "is_my_brand"]
+
+
+@st.cache_resource
+def _summary_store():
+    """
+    project_id -> {"summaries": {brand_name: DataFrame}, "daily", "watermark", "loaded_at", "full_loaded_at"}
+    (спільно для всіх сесій, LRU як _project_store).
+    """
+    return {"lock": threading.Lock(), "projects": OrderedDict()}
+
+
+def _fetch_summary_frames(project_id, **filters):
+    """Скани та згадки (лише колонки для зведення) з фільтрами fetch_scan_page."""
+    rows = [row for page in iter_scan_pages(project_id, ", ".join(SUMMARY_SCAN_COLUMNS), **filters) for row in page]
+    scans = _typed_scans(_frame(rows, SUMMARY_SCAN_COLUMNS))
+    mentions = fetch_in_chunks(
+        "brand_mentions", "scan_result_id", scans["id"].tolist(),
+        columns=", ".join(SUMMARY_MENTION_COLUMNS), chunk_size=CHUNK_SIZE
+    )
+    return {"scans": scans, "mentions": _typed_mentions(_frame(mentions, SUMMARY_MENTION_COLUMNS))}
+
+
+def _summary_entry(project_id, brand_name, ttl=CACHE_TTL_SECONDS):
+    """
+    Запис легкого кешу зі зведенням для brand_name. Як і повний кеш: після TTL довантажує
+    лише нові скани (з перекриттям REFRESH_OVERLAP), повністю перечитує раз на FULL_RELOAD_SECONDS.
+    """
+    store = _summary_store()
+    entry = store["projects"].get(project_id)
+    now = time.monotonic()
+    if entry is not None and brand_name in entry["summaries"] and now - entry["loaded_at"] <= ttl:
+        _touch(store, project_id)
+        return entry
+
+    if entry is None or brand_name not in entry["summaries"] or entry["watermark"] is None \
+            or now - entry["full_loaded_at"] > FULL_RELOAD_SECONDS:
+        frames = _fetch_summary_frames(project_id)
+        brands = set(entry["summaries"]) | {brand_name} if entry is not None else {brand_name}
+        summaries = {b: _build_scan_summary(frames, b) for b in brands}
+        watermark = _watermark(frames["scans"])
+        full_loaded_at = now
+    else:
+        # Скани з перекриття могли вже бути у зведенні — замінюємо їхні строки
+        delta = _fetch_summary_frames(project_id, start=(entry["watermark"] - REFRESH_OVERLAP).isoformat())
+        replaced_ids = set(delta["scans"]["id"])
+        summaries = {
+            b: _splice(old, _build_scan_summary(delta, b), "id", replaced_ids)
+            for b, old in entry["summaries"].items()
+        }
+        watermark = _watermark(delta["scans"]) or entry["watermark"]
+        full_loaded_at = entry["full_loaded_at"]
+
+    entry = {"summaries": summaries, "daily": {}, "watermark": watermark,
+             "loaded_at": now, "full_loaded_at": full_loaded_at}
+    _remember(store, project_id, entry)
+    return entry
+
+
+# ==============================================================================
+# КОНКУРЕНТИ: зведення по брендах за один прохід (коди замість рядків)
+# ==============================================================================
+COMPETITOR_COLUMNS = [
+    "brand_name", "Display_Name", "Mentions", "Avg_Rank", "Avg_Sentiment_Num", "Is_My_Brand",
+    "Neg_Pct", "Neu_Pct", "Pos_Pct", "Тональність_Str", "Presence_Pct",
+    "Mention_Count", "Keywords", "Dominant_Sentiment", "First_Seen",
+]
+# Порядок колонок гістограми тональності
+_SENTIMENT_ORDER = ["Негативна", "Нейтральна", "Позитивна"]
+
+
+def _build_competitor_summary(entry, brand_name, providers, keyword_ids):
+    frames = entry["frames"]
+    scans = frames["scans"]
+    mentions = frames["mentions"]
+
+    # Фільтр сканів: провайдер — одна з обраних UI-назв (utils/providers.py), запит — з обраних (None = всі)
+    scan_ok = pd.Series(providers is None, index=scans.index)
+    if providers:
+        allowed = providers_matching(scans["provider"].unique(), providers)
+        scan_ok = scans["provider"].isin(allowed)
+    if keyword_ids is not None:
+        scan_ok &= scans["keyword_id"].isin(keyword_ids)
+    in_filter = mentions["scan_result_id"].isin(scans.loc[scan_ok, "id"]).to_numpy()
+    m = mentions[in_filter]
+
+    # Канонічні бренди (синоніми зведено, наш бренд — під офіційною назвою): цілочисельні коди
+    brand_ids = _brand_ids(entry, brand_name)
+    brand_codes = brand_ids["brand_id"].to_numpy()[in_filter]
+    valid = brand_codes >= 0
+    if not valid.any():
+        return pd.DataFrame(columns=COMPETITOR_COLUMNS)
+
+    codes = brand_codes[valid]
+    brands = brand_ids.drop_duplicates("brand_id").set_index("brand_id")["brand_canonical"].sort_index()
+    brands = brands[brands.index >= 0]
+    n = len(brands)
+    is_target = _is_target(entry, brand_name).to_numpy()[in_filter]
+    scan_codes, scan_ids = pd.factorize(m["scan_result_id"].to_numpy()[valid])
+    rank = pd.to_numeric(m["rank_position"], errors="coerce").to_numpy()[valid]
+    has_rank = ~np.isnan(rank)
+    sent = pd.Categorical(m["sentiment_score"].to_numpy()[valid], categories=_SENTIMENT_ORDER).codes
+    sent = np.where(sent < 0, 1, sent)  # невідома тональність = нейтральна
+    # Запит і час скану кожної згадки
+    scan_rows = scans.set_index("id").reindex(scan_ids)
+    kw_codes = pd.factorize(scan_rows["keyword_id"].fillna("").astype(str))[0][scan_codes]
+    scan_times = scan_rows["created_at"].to_numpy()[scan_codes]
+
+    mentions_cnt = np.bincount(codes, minlength=n)
+    rank_cnt = np.bincount(codes[has_rank], minlength=n)
+    rank_sum = np.bincount(codes[has_rank], weights=rank[has_rank], minlength=n)
+    hist = np.bincount(codes * 3 + sent, minlength=n * 3).reshape(n, 3)
+    # Присутність: у скількох відфільтрованих сканах бренд згадано хоча б раз
+    pairs = np.unique(codes.astype(np.int64) * len(scan_ids) + scan_codes)
+    presence = np.bincount(pairs // len(scan_ids), minlength=n)
+    my_brand = np.bincount(codes, weights=is_target[valid], minlength=n) > 0
+    kw_pairs = np.unique(codes.astype(np.int64) * (kw_codes.max() + 1) + kw_codes)
+    keywords_cnt = np.bincount(kw_pairs // (kw_codes.max() + 1), minlength=n)
+    first_seen = pd.Series(scan_times).groupby(codes).min().reindex(range(n))
+
+    total = hist.sum(axis=1)
+    pct = (hist * 100 // np.maximum(total, 1)[:, None]).astype(int)
+    scores = np.array([SENTIMENT_SCORES[s] for s in _SENTIMENT_ORDER])
+
+    out = pd.DataFrame({
+        "brand_name": brands.astype(str).to_numpy(),
+        "Mentions": mentions_cnt,
+        "Avg_Rank": np.divide(rank_sum, rank_cnt, out=np.full(n, np.nan), where=rank_cnt > 0),
+        "Avg_Sentiment_Num": hist @ scores / np.maximum(total, 1),
+        "Is_My_Brand": my_brand,
+        "Neg_Pct": pct[:, 0],
+        "Neu_Pct": pct[:, 1],
+        "Pos_Pct": pct[:, 2],
+        "Presence_Pct": presence * 100 / scan_ok.sum(),
+        "Mention_Count": np.bincount(codes, weights=m["mention_count"].to_numpy()[valid], minlength=n),
+        "Keywords": keywords_cnt,
+        "Dominant_Sentiment": np.array(_SENTIMENT_ORDER)[hist.argmax(axis=1)],
+        "First_Seen": first_seen.to_numpy(),
+    })
+    out["Тональність_Str"] = "🔴 " + out["Neg_Pct"].astype(str) + "%   ⚪ " + out["Neu_Pct"].astype(str) \
+        + "%   🟢 " + out["Pos_Pct"].astype(str) + "%"
+    out["Display_Name"] = out["brand_name"].where(out["brand_name"] != brand_name, "🟢 " + out["brand_name"])
+    out = out[out["Mentions"] > 0]
+    return out.sort_values("brand_name", ignore_index=True)[COMPETITOR_COLUMNS]
+
+
+def load_competitor_summary(project_id, brand_name, providers=None, keyword_ids=None):
+    """
+    Зведення по брендах (одна строка = один бренд) для обраних моделей і запитів (None = всі):
+    Mentions, Avg_Rank, Avg_Sentiment_Num, Neg/Neu/Pos_Pct, Presence_Pct (% сканів зі згадкою), Display_Name,
+    Mention_Count (сума mention_count), Keywords (запитів зі згадкою), Dominant_Sentiment, First_Seen.
+    Кешується для кожної комбінації фільтрів до оновлення даних проекту.
+    """
+    providers = None if providers is None else tuple(sorted(providers))
+    keyword_ids = None if keyword_ids is None else tuple(sorted(keyword_ids))
+    return _derived(
+        _store_entry(project_id), ("competitor_summary", (brand_name, providers, keyword_ids)),
+        lambda e: _build_competitor_summary(e, brand_name, providers, keyword_ids)
+    )
+
+
+# ==============================================================================
+# ЗАПИТИ: зведення по кожному запиту (поточний зріз) за один прохід
+# ==============================================================================
+KEYWORD_SUMMARY_WINDOW = pd.Timedelta(hours=24)
+KEYWORD_SUMMARY_COLUMNS = ["keyword_id", "my_mentions", "sov", "rank", "sentiment",
+                           "top_competitor", "top_competitor_mentions", "official_sources"]
+
+
+def _build_keyword_summary(entry, brand_name):
+    frames = entry["frames"]
+    scans = frames["scans"]
+    mentions = frames["mentions"]
+    if scans.empty or mentions.empty:
+        return pd.DataFrame(columns=KEYWORD_SUMMARY_COLUMNS)
+
+    is_target = _is_target(entry, brand_name)
+    brands = _brand_ids(entry, brand_name)
+    target = is_target.to_numpy(dtype=bool)
+    ranked = target & (mentions["rank_position"] > 0).to_numpy()
+    m = pd.DataFrame({
+        "scan_result_id": mentions["scan_result_id"].to_numpy(),
+        "brand": brands["brand_canonical"].to_numpy(),
+        "is_target": target,
+        "total": mentions["mention_count"].to_numpy(),
+        "my_mentions": np.where(target, mentions["mention_count"], 0),
+        "rank_sum": np.where(ranked, mentions["rank_position"], 0),
+        "rank_cnt": ranked.astype(int),
+    })
+    for label in _SENTIMENT_ORDER:
+        m[label] = (target & (mentions["sentiment_score"] == label).to_numpy()).astype(int)
+    m = m.merge(scans[["id", "keyword_id", "created_at"]], left_on="scan_result_id", right_on="id", how="inner")
+    if m.empty:
+        return pd.DataFrame(columns=KEYWORD_SUMMARY_COLUMNS)
+
+    # Поточний зріз кожного запиту: згадки за 24 години до його останнього скану
+    latest = m.groupby("keyword_id", sort=False)["created_at"].transform("max")
+    m = m[m["created_at"] >= latest - KEYWORD_SUMMARY_WINDOW]
+
+    sums = ["total", "my_mentions", "rank_sum", "rank_cnt"] + _SENTIMENT_ORDER
+    out = m.groupby("keyword_id")[sums].sum()
+    out["sov"] = np.where(out["total"] > 0, out["my_mentions"] * 100 / out["total"].where(out["total"] > 0, 1), 0)
+    out["rank"] = np.where(out["rank_cnt"] > 0, out["rank_sum"] / out["rank_cnt"].clip(lower=1), 0)
+    # Домінуюча тональність бренду (при рівності — перша за алфавітом, як mode())
+    hist = out[_SENTIMENT_ORDER].to_numpy()
+    out["sentiment"] = np.where(hist.sum(axis=1) > 0, np.array(_SENTIMENT_ORDER, dtype=object)[hist.argmax(axis=1)], "—")
+
+    # Топ конкурент запиту: максимум згадок, при рівності — перший за назвою
+    comp = m[~m["is_target"] & m["brand"].notna()]
+    comp = comp.groupby(["keyword_id", "brand"], as_index=False)["total"].sum()
+    comp = comp.sort_values(["keyword_id", "total", "brand"], ascending=[True, False, True]).drop_duplicates("keyword_id")
+    comp = comp.set_index("keyword_id")
+    out["top_competitor"] = comp["brand"].reindex(out.index).fillna("—")
+    out["top_competitor_mentions"] = comp["total"].reindex(out.index).fillna(0)
+
+    # Офіційні джерела в сканах поточного зрізу
+    sources = frames["sources"]
+    if not sources.empty and "is_official" in sources.columns:
+        official = sources.loc[flag_mask(sources["is_official"]), "scan_result_id"]
+        scan_kw = m.drop_duplicates("scan_result_id").set_index("scan_result_id")["keyword_id"]
+        out["official_sources"] = official.map(scan_kw).dropna().value_counts().reindex(out.index, fill_value=0)
+    else:
+        out["official_sources"] = 0
+
+    return out.reset_index()[KEYWORD_SUMMARY_COLUMNS]
+
+
+def load_keyword_summary(project_id, brand_name):
+    """
+    Зведення по запитах (одна строка = один запит зі згадками) за останні 24 години від його останнього скану:
+    my_mentions, sov, rank (середня позиція бренду), sentiment (домінуюча), top_competitor (+ згадок),
+    official_sources. Рахується одним проходом по кешу проекту.
+    """
+    return _derived(
+        _store_entry(project_id), ("keyword_summary", brand_name),
+        lambda e: _build_keyword_summary(e, brand_name)
+    )
+
+
+# ==============================================================================
+# ДЖЕРЕЛА: лічильники доменів (домен, тип, провайдер, запит) з інкрементальним оновленням
+# та топ посилань для вкладки посилань
+# ==============================================================================
+SOURCE_COUNTER_KEYS = ["domain", "is_official", "provider", "keyword_id"]
+SOURCE_COUNTER_COLUMNS = SOURCE_COUNTER_KEYS + ["mentions", "rows", "first_seen", "last_seen"]
+LINK_COUNTER_KEYS = ["url", "domain", "is_official", "provider"]
+LINK_COUNTER_COLUMNS = LINK_COUNTER_KEYS + ["mentions"]
+LINK_TOP_N = 500   # посилань (за сумою згадок) у вкладці посилань
+
+
+def _source_rows(frames, scan_ids=None):
+    """Джерела з ключами лічильників і датою скану (scan_ids — лише джерела цих сканів)."""
+    sources = frames["sources"]
+    if scan_ids is not None:
+        sources = sources[sources["scan_result_id"].isin(scan_ids)]
+    # Домен ренкінгу — реєстрований домен (eTLD+1, utils.urls): shop.rozetka.com.ua і rozetka.com.ua — один рядок
+    domain = sources["registrable_domain"].where(
+        sources["registrable_domain"].fillna("").astype(str).str.strip() != "", sources["domain"]
+    )
+    rows = pd.DataFrame({
+        "scan_result_id": sources["scan_result_id"].to_numpy(),
+        "domain": domain.fillna("").replace("", "unknown").to_numpy(),
+        "url": sources["canonical_url"].to_numpy(),
+        "is_official": flag_mask(sources["is_official"]).to_numpy(),
+        "mention_count": sources["mention_count"].to_numpy(),
+    })
+    return rows.merge(
+        frames["scans"][["id", "provider", "keyword_id", "created_at"]],
+        left_on="scan_result_id", right_on="id", how="inner"
+    )
+
+
+def _count_sources(rows):
+    if rows.empty:
+        return pd.DataFrame(columns=SOURCE_COUNTER_COLUMNS)
+    return rows.groupby(SOURCE_COUNTER_KEYS, sort=False, dropna=False).agg(
+        mentions=("mention_count", "sum"),
+        rows=("mention_count", "size"),
+        first_seen=("created_at", "min"),
+        last_seen=("created_at", "max"),
+    ).reset_index()
+
+
+def _merge_source_counters(counters, removed, added):
+    """
+    counters - removed + added. first_seen / last_seen — min / max: джерела скану
+    лише дописуються (n8n), тому межі від повторно завантажених сканів не зсуваються.
+    """
+    merged = pd.concat([counters, added], ignore_index=True)
+    if merged.empty:
+        return pd.DataFrame(columns=SOURCE_COUNTER_COLUMNS)
+    merged = merged.groupby(SOURCE_COUNTER_KEYS, sort=False, dropna=False).agg(
+        mentions=("mentions", "sum"), rows=("rows", "sum"),
+        first_seen=("first_seen", "min"), last_seen=("last_seen", "max"),
+    )
+    if not removed.empty:
+        sub = removed.set_index(SOURCE_COUNTER_KEYS)[["mentions", "rows"]].reindex(merged.index, fill_value=0)
+        merged[["mentions", "rows"]] -= sub
+    return merged[merged["rows"] > 0].reset_index()[SOURCE_COUNTER_COLUMNS]
+
+
+def load_source_counters(project_id):
+    """
+    Лічильники доменів проекту: одна строка = (domain, is_official, provider, keyword_id) з
+    mentions (сума mention_count), rows (кількість джерел), first_seen / last_seen (дата скану).
+    Після появи нових сканів оновлюються інкрементально (див. _refresh_derived).
+    """
+    return _derived(_store_entry(project_id), ("source_counters", None), lambda e: _count_sources(_source_rows(e["frames"])))
+
+
+def _build_link_counters(rows, keyword_ids, official, search, top_n):
+    if keyword_ids is not None:
+        rows = rows[rows["keyword_id"].isin(keyword_ids)]
+    if official is not None:
+        rows = rows[rows["is_official"] == official]
+    if search:
+        rows = rows[rows["url"].astype(str).str.contains(search, case=False, regex=False)]
+    if rows.empty:
+        return pd.DataFrame(columns=LINK_COUNTER_COLUMNS)
+    # Топ top_n посилань за сумою згадок (при рівності — за URL)
+    totals = rows.groupby("url", dropna=False)["mention_count"].sum().sort_index()
+    top = totals.sort_values(ascending=False, kind="stable").index[:top_n]
+    rows = rows[rows["url"].isin(top)]
+    return rows.groupby(LINK_COUNTER_KEYS, sort=False, dropna=False)["mention_count"].sum()\
+        .rename("mentions").reset_index()[LINK_COUNTER_COLUMNS]
+
+
+def load_link_counters(project_id, keyword_ids=None, official=None, search="", top_n=LINK_TOP_N):
+    """
+    Топ top_n посилань (канонічний URL) для обраних запитів і типу (None = всі):
+    одна строка = (url, domain, is_official, provider) з mentions.
+    Без пошуку кешується для кожної комбінації фільтрів до оновлення даних проекту;
+    пошук по URL рахується по всіх джерелах і не кешується.
+    """
+    keyword_ids = None if keyword_ids is None else tuple(sorted(keyword_ids))
+    entry = _store_entry(project_id)
+    if search:
+        return _build_link_counters(_source_rows(entry["frames"]), keyword_ids, official, search, top_n)
+    return _derived(
+        entry, ("link_counters", (keyword_ids, official, top_n)),
+        lambda e: _build_link_counters(_source_rows(e["frames"]), keyword_ids, official, "", top_n)
+    )
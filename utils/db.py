@@ -1,3 +1,6 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 from supabase import create_client, Client
 
@@ -15,3 +18,67 @@ def init_supabase() -> Client:
 
 # Create the global supabase object
 supabase = init_supabase()
+
+
+# ==============================================================================
+# ПАРАЛЕЛЬНЕ ЧИТАННЯ ПОРЦІЯМИ
+# ==============================================================================
+FETCH_CHUNK_SIZE = 200   # ID в одному .in_() (обмеження довжини URL)
+FETCH_PAGE_SIZE = 1000   # PostgREST за замовчуванням віддає не більше 1000 рядків
+FETCH_WORKERS = 6        # Одночасних запитів до Supabase на один виклик
+FETCH_RETRIES = 2        # Повторів для кожної порції при помилці
+
+
+def _fetch_chunk(table, columns, column, chunk, retries):
+    """Одна порція: всі сторінки .range() для `column in chunk`, з повторами."""
+    for attempt in range(retries + 1):
+        try:
+            rows = []
+            offset = 0
+            while True:
+                resp = supabase.table(table)\
+                    .select(columns)\
+                    .in_(column, chunk)\
+                    .order("id")\
+                    .range(offset, offset + FETCH_PAGE_SIZE - 1)\
+                    .execute()
+                page = resp.data or []
+                rows.extend(page)
+                if len(page) < FETCH_PAGE_SIZE:
+                    return rows
+                offset += FETCH_PAGE_SIZE
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * (2 ** attempt))
+
+
+def fetch_tables_in_chunks(tables, column, values, chunk_size=FETCH_CHUNK_SIZE, max_workers=FETCH_WORKERS, retries=FETCH_RETRIES):
+    """
+    Читає кілька таблиць за списком значень `column` (напр. scan_result_id)
+    паралельно на обмеженому пулі потоків.
+
+    tables: {"brand_mentions": "*", "extracted_sources": "url, is_official"}
+    Повертає {table: rows}; порядок рядків детермінований (у порядку порцій).
+    """
+    values = list(values)
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    if not chunks:
+        return {table: [] for table in tables}
+
+    jobs = [(table, cols, chunk) for table, cols in tables.items() for chunk in chunks]
+    workers = max(1, min(max_workers, len(jobs)))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # map() повертає результати в порядку jobs, незалежно від часу відповіді
+        results = list(pool.map(lambda job: _fetch_chunk(job[0], job[1], column, job[2], retries), jobs))
+
+    out = {table: [] for table in tables}
+    for (table, _, _), rows in zip(jobs, results):
+        out[table].extend(rows)
+    return out
+
+
+def fetch_in_chunks(table, column, values, columns="*", **kwargs):
+    """Те саме, що fetch_tables_in_chunks, для однієї таблиці. Повертає список рядків."""
+    return fetch_tables_in_chunks({table: columns}, column, values, **kwargs)[table]
@@ -0,0 +1,86 @@
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+# ==============================================================================
+# ОФІЦІЙНІ ДОМЕНИ (Whitelist): скомпільований індекс суфіксів домену
+# ==============================================================================
+
+
+def _strip_www(host):
+    return host[4:] if host.startswith("www.") else host
+
+
+def normalize_asset(entry):
+    """'https://www.Facebook.com/rozetka/' -> ('facebook.com', 'rozetka')."""
+    s = str(entry or "").strip().lower()
+    for prefix in ("https://", "http://"):
+        if s.startswith(prefix):
+            s = s[len(prefix):]
+    host, _, path = s.partition("/")
+    return _strip_www(host.split(":")[0]), path.strip("/")
+
+
+def split_url(url):
+    """URL -> (host без www., шлях без слешів по краях), все в нижньому регістрі."""
+    s = str(url or "").strip().lower()
+    if not s:
+        return "", ""
+    if "://" not in s:
+        s = "//" + s
+    try:
+        parts = urlsplit(s)
+        return _strip_www(parts.hostname or ""), parts.path.strip("/")
+    except ValueError:
+        return "", ""
+
+
+@lru_cache(maxsize=64)
+def _compile(entries):
+    """
+    Індекс: суфікс хоста -> [(префікс шляху, запис Whitelist)].
+    Будується один раз для кожного набору записів (кеш за кортежем записів).
+    """
+    index = {}
+    for entry in entries:
+        host, path = normalize_asset(entry)
+        if host:
+            index.setdefault(host, []).append((path, entry))
+    # Довші шляхи перевіряємо першими (найточніший збіг)
+    for rules in index.values():
+        rules.sort(key=lambda r: len(r[0]), reverse=True)
+    return index
+
+
+def compile_whitelist(whitelist):
+    """Скомпільований індекс для списку domain_or_url (порядок і дублікати не важливі)."""
+    entries = tuple(sorted({str(d).strip() for d in (whitelist or []) if str(d).strip()}))
+    return _compile(entries)
+
+
+def match_official(url, index):
+    """
+    Запис Whitelist, якому відповідає URL, або None.
+    'rozetka.com.ua' покриває rozetka.com.ua та всі піддомени (але не notrozetka.com.ua),
+    'facebook.com/rozetka' — лише сторінки з цим шляхом.
+    """
+    if not index:
+        return None
+    host, path = split_url(url)
+    labels = host.split(".")
+    # Від повного хоста до коротших суфіксів: m.shop.rozetka.com.ua -> shop.rozetka.com.ua -> ...
+    for i in range(len(labels)):
+        rules = index.get(".".join(labels[i:]))
+        if not rules:
+            continue
+        for prefix, entry in rules:
+            if not prefix or path == prefix or path.startswith(prefix + "/"):
+                return entry
+    return None
+
+
+def official_entries(urls, whitelist):
+    """Series: запис Whitelist для кожного URL (None — зовнішній). Кожен унікальний URL перевіряється один раз."""
+    index = compile_whitelist(whitelist)
+    urls = urls.fillna("").astype(str)
+    matched = {u: match_official(u, index) for u in urls.unique()}
+    return urls.map(matched)
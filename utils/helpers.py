@@ -1,4 +1,10 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
 import plotly.graph_objects as go
+import streamlit as st
 
 # Словник з підказками
 METRIC_TOOLTIPS = {
@@ -10,11 +16,71 @@ METRIC_TOOLTIPS = {
     "domain": "Відсоток запитів з клікабельним посиланням на ваш домен.",
 }
 
-def get_donut_chart(value, color="#00C896"):
+# Кеш графіків: скільки готових фігур тримати (спільно для всіх сесій)
+FIGURE_CACHE_SIZE = 128
+
+# Довгі часові ряди: не більше стількох точок на лінію (далі — тижні / місяці)
+MAX_SERIES_POINTS = 120
+SERIES_BUCKETS = ["D", "W-MON", "MS"]
+
+
+@st.cache_resource
+def _figure_cache():
+    return {"lock": threading.Lock(), "figures": OrderedDict()}
+
+
+def _fingerprint(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        columns = repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name)
+        return columns.encode() + pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes()
+    return repr(value).encode()
+
+
+def cached_figure(name, builder, *args):
     """
-    Генерує простий донат-чарт для метрик.
+    Фігура Plotly з кешу: ключ — назва + хеш вхідних агрегатів (числа, кортежі, DataFrame).
+    builder(*args) викликається лише коли дані змінились. Фігура спільна — не змінюйте її після отримання.
     """
-    value = float(value) if value else 0.0
+    digest = hashlib.blake2b(name.encode(), digest_size=16)
+    for arg in args:
+        digest.update(_fingerprint(arg))
+    key = digest.hexdigest()
+
+    cache = _figure_cache()
+    with cache["lock"]:
+        fig = cache["figures"].get(key)
+        if fig is not None:
+            cache["figures"].move_to_end(key)
+            return fig
+
+    fig = builder(*args)
+    with cache["lock"]:
+        cache["figures"][key] = fig
+        while len(cache["figures"]) > FIGURE_CACHE_SIZE:
+            cache["figures"].popitem(last=False)
+    return fig
+
+
+def bucket_series(df, date_col, by, sum_cols, max_points=MAX_SERIES_POINTS):
+    """
+    Агрегує часовий ряд до днів / тижнів / місяців — найдрібніший крок, за якого точок не більше max_points.
+    Сумує sum_cols у межах (крок, by). Відношення (SOV тощо) рахуйте вже після агрегації.
+    """
+    if df.empty:
+        return df
+    span_days = (df[date_col].max() - df[date_col].min()).days + 1
+    freq = SERIES_BUCKETS[-1]
+    for candidate, days in zip(SERIES_BUCKETS, [1, 7, 30]):
+        if span_days / days <= max_points:
+            freq = candidate
+            break
+    if freq == "D":
+        return df.groupby([date_col, by], as_index=False)[sum_cols].sum()
+    grouper = pd.Grouper(key=date_col, freq=freq, label="left", closed="left")
+    return df.groupby([grouper, by])[sum_cols].sum().reset_index()
+
+
+def _build_donut_chart(value, color):
     remaining = max(0, 100 - value)
     fig = go.Figure(
         data=[
@@ -45,3 +111,11 @@ def get_donut_chart(value, color="#00C896"):
         ],
     )
     return fig
+
+
+def get_donut_chart(value, color="#00C896"):
+    """
+    Генерує простий донат-чарт для метрик (з кешу, якщо значення не змінилось).
+    """
+    value = float(value) if value else 0.0
+    return cached_figure("donut", _build_donut_chart, value, color)
@@ -0,0 +1,181 @@
+import csv
+import hashlib
+import io
+import itertools
+import re
+
+import requests
+from openpyxl import load_workbook
+
+from utils.db import supabase, fetch_in_chunks
+
+# ==============================================================================
+# ПОТОКОВИЙ ІМПОРТ ЗАПИТІВ (Excel / CSV / Google Sheets)
+# Файл читається рядок за рядком, дублікати відсіюються за хешем,
+# запис у базу — пакетами. Без st.* викликів (прогрес — через on_progress).
+# ==============================================================================
+
+IMPORT_BATCH_SIZE = 500          # Рядків в одному insert
+IMPORT_DOWNLOAD_TIMEOUT = 60     # Таймаут завантаження файлу за посиланням
+KEYWORD_COLUMN_NAMES = {"keyword", "keywords", "запит", "запити", "query"}
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_keyword(text):
+    """Запит без зайвих пробілів ('  купити   квитки ' -> 'купити квитки')."""
+    if text is None:
+        return ""
+    return _SPACES.sub(" ", str(text)).strip()
+
+
+def keyword_hash(text):
+    """Ключ для пошуку дублікатів: 8 байт хешу від нормалізованого запиту без урахування регістру."""
+    return hashlib.blake2b(normalize_keyword(text).casefold().encode("utf-8"), digest_size=8).digest()
+
+
+def existing_keyword_hashes(project_id):
+    """Хеші всіх запитів проекту (з пагінацією — без обмеження 1000 рядків)."""
+    rows = fetch_in_chunks("keywords", "project_id", [project_id], columns="id, keyword_text")
+    return {keyword_hash(r["keyword_text"]) for r in rows}
+
+
+def _pick_column(header):
+    """Індекс колонки з запитами: за назвою (keyword / запит ...), інакше перша."""
+    names = [str(h or "").strip().lower() for h in header]
+    for i, name in enumerate(names):
+        if name in KEYWORD_COLUMN_NAMES:
+            return i
+    return 0
+
+
+def _iter_column(rows):
+    """Значення колонки з запитами з ітератора рядків (перший рядок — заголовок)."""
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    col = _pick_column(header)
+    for row in rows:
+        if row and len(row) > col:
+            yield row[col]
+
+
+def iter_xlsx_keywords(fileobj):
+    """Запити з першого аркуша .xlsx (openpyxl read-only: аркуш не завантажується в пам'ять цілком)."""
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from _iter_column(wb.worksheets[0].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def iter_csv_keywords(fileobj, encoding="utf-8-sig"):
+    """Запити з CSV (бінарний або текстовий потік, зокрема без перемотування), рядок за рядком."""
+    if not isinstance(fileobj, io.TextIOBase):
+        fileobj = io.TextIOWrapper(fileobj, encoding=encoding, newline="")
+    sample = fileobj.read(4096)
+    if fileobj.seekable():
+        fileobj.seek(0)
+        lines = fileobj
+    else:
+        # Потік HTTP: прочитаний зразок (дочитаний до кінця рядка) + решта потоку
+        lines = itertools.chain(io.StringIO(sample + fileobj.readline()), fileobj)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    yield from _iter_column(csv.reader(lines, dialect))
+
+
+def iter_file_keywords(uploaded_file):
+    """Запити з завантаженого файлу (.xlsx або .csv)."""
+    if uploaded_file.name.lower().endswith(".csv"):
+        return iter_csv_keywords(uploaded_file)
+    return iter_xlsx_keywords(uploaded_file)
+
+
+def iter_url_keywords(url):
+    """Запити за посиланням: Google Sheets (експорт у CSV), .csv або .xlsx."""
+    url = url.strip()
+    is_xlsx = False
+    if "docs.google.com" in url:
+        match = re.search(r"/d/([a-zA-Z0-9-_]+)", url)
+        if not match:
+            raise ValueError("Не вдалося визначити ID Google Sheets")
+        url = f"https://docs.google.com/spreadsheets/d/{match.group(1)}/export?format=csv"
+    elif url.lower().endswith(".xlsx"):
+        is_xlsx = True
+    elif not url.lower().endswith(".csv"):
+        raise ValueError("Підтримуються Google Sheets, .csv та .xlsx")
+
+    resp = requests.get(url, stream=True, timeout=IMPORT_DOWNLOAD_TIMEOUT)
+    resp.raise_for_status()
+    if is_xlsx:
+        # openpyxl потребує файл з довільним доступом
+        return iter_xlsx_keywords(io.BytesIO(resp.content))
+    # Кодування — завжди UTF-8 (requests для text/csv без charset підставляє ISO-8859-1),
+    # CSV-парсер читає сирий потік, тож поля в лапках з переносами рядків не розриваються
+    resp.raw.decode_content = True
+    resp.raw.auto_close = False   # інакше потік закривається на EOF під читанням TextIOWrapper
+    return iter_csv_keywords(resp.raw, encoding="utf-8-sig")
+
+
+def iter_new_keywords(values, seen_hashes):
+    """
+    Нормалізовані запити без порожніх і дублікатів (у файлі та серед seen_hashes).
+    seen_hashes доповнюється на ходу. Повертає пари (запит, чи новий).
+    """
+    for value in values:
+        kw = normalize_keyword(value)
+        if not kw:
+            continue
+        h = keyword_hash(kw)
+        if h in seen_hashes:
+            yield kw, False
+        else:
+            seen_hashes.add(h)
+            yield kw, True
+
+
+def insert_keywords(project_id, keywords, batch_size=IMPORT_BATCH_SIZE):
+    """Пакетний insert у keywords (без дедуплікації)."""
+    for i in range(0, len(keywords), batch_size):
+        batch = keywords[i:i + batch_size]
+        supabase.table("keywords").insert(
+            [{"project_id": project_id, "keyword_text": kw, "is_active": True} for kw in batch]
+        ).execute()
+
+
+def import_keywords(project_id, values, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+    """
+    Імпорт потоку значень у проект: нормалізація, відсів дублікатів (файл + наявні запити),
+    запис пакетами по batch_size.
+    on_progress(read, inserted) викликається після кожного пакету.
+    Повертає {"read", "inserted", "duplicates", "keywords"} (keywords — додані запити).
+    """
+    seen = existing_keyword_hashes(project_id)
+    added, batch = [], []
+    read = duplicates = 0
+
+    def flush():
+        insert_keywords(project_id, batch, batch_size)
+        added.extend(batch)
+        batch.clear()
+        if on_progress:
+            on_progress(read, len(added))
+
+    for kw, is_new in iter_new_keywords(values, seen):
+        read += 1
+        if not is_new:
+            duplicates += 1
+            continue
+        batch.append(kw)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    elif on_progress:
+        on_progress(read, len(added))
+
+    return {"read": read, "inserted": len(added), "duplicates": duplicates, "keywords": added}
@@ -0,0 +1,178 @@
+import json
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils.local_store import local_db
+
+# ==============================================================================
+# ФОНОВІ ЗАДАЧІ (звіти, рекомендації, чат)
+# Довгі виклики n8n виконуються в пулі потоків, а не в потоці сторінки.
+# Статус і результат зберігаються в локальній SQLite (utils/local_store.py).
+# ==============================================================================
+
+JOB_WORKERS = 4          # Одночасних фонових задач на сервер
+JOB_POLL_SECONDS = 3     # Як часто панель задач оновлює статус
+
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+JOB_STATUS_UI = {
+    "queued": "⏳ В черзі",
+    "running": "⚙️ Виконується",
+    "done": "✅ Готово",
+    "error": "❌ Помилка",
+}
+
+_JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    project_id TEXT,
+    user_id TEXT,
+    title TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_project_idx ON jobs (project_id, created_at);
+"""
+
+# Старт процесу: незавершені задачі, створені раніше, належать попередньому процесу (перезапуск)
+_PROCESS_STARTED_AT = time.time()
+
+
+@st.cache_resource
+def _job_pool():
+    """
+    Пул воркерів (один на процес). Задачі, що не завершились до перезапуску сервера, позначаються помилкою.
+    Після "Clear cache" пул створюється заново, але задачі цього процесу не чіпаються — їхні потоки працюють далі.
+    """
+    with local_db(_JOBS_SCHEMA) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'error', error = ?, finished_at = ? "
+            "WHERE status IN ('queued', 'running') AND created_at < ?",
+            ("Перервано перезапуском сервера", time.time(), _PROCESS_STARTED_AT)
+        )
+    return ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="virshi-job")
+
+
+def _update_job(job_id, **fields):
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    with local_db(_JOBS_SCHEMA) as conn:
+        conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _run_job(job_id, func, args, kwargs):
+    _update_job(job_id, status="running", started_at=time.time())
+    try:
+        result = func(*args, **kwargs)
+        _update_job(job_id, status="done", result=json.dumps(result, ensure_ascii=False, default=str), finished_at=time.time())
+    except Exception as e:
+        print(f"Job {job_id} failed: {traceback.format_exc()}")
+        _update_job(job_id, status="error", error=str(e), finished_at=time.time())
+
+
+def enqueue_job(kind, func, *args, project_id=None, user_id=None, title="", **kwargs):
+    """
+    Ставить func(*args, **kwargs) у чергу. Повертає job_id.
+    func виконується у фоновому потоці: без st.* викликів, результат — JSON-сумісний.
+    """
+    job_id = str(uuid.uuid4())
+    # Пул — до запису задачі: при першому створенні він позначає незавершені задачі як перервані
+    pool = _job_pool()
+    with local_db(_JOBS_SCHEMA) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, project_id, user_id, title, status, created_at) VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, kind, project_id, user_id, title, time.time())
+        )
+    pool.submit(_run_job, job_id, func, args, kwargs)
+    return job_id
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job.get("result") else None
+    return job
+
+
+def get_job(job_id):
+    """Задача за ID (dict з status, result, error ...) або None."""
+    if not job_id:
+        return None
+    with local_db(_JOBS_SCHEMA) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(project_id=None, kinds=None, limit=10):
+    """Останні задачі проекту (новіші першими)."""
+    sql = "SELECT * FROM jobs WHERE 1 = 1"
+    params = []
+    if project_id:
+        sql += " AND project_id = ?"
+        params.append(project_id)
+    if kinds:
+        sql += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+        params.extend(kinds)
+    sql += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    with local_db(_JOBS_SCHEMA) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [_row_to_job(r) for r in rows]
+
+
+def _render_jobs(jobs):
+    with st.container(border=True):
+        st.markdown("##### 🗂️ Фонові задачі")
+        for job in jobs:
+            c_title, c_status, c_time = st.columns([3, 1.2, 1])
+            c_title.markdown(f"**{job['title'] or job['kind']}**")
+            c_status.markdown(JOB_STATUS_UI.get(job["status"], job["status"]))
+
+            end = job["finished_at"] or time.time()
+            start = job["started_at"] or job["created_at"]
+            c_time.caption(f"{int(end - start)} с")
+
+            if job["status"] == "error" and job["error"]:
+                st.caption(f"⚠️ {job['error']}")
+
+            # Результат, який не вдалося зберегти в БД — віддаємо файлом, щоб не втратити
+            result = job["result"] if isinstance(job["result"], dict) else {}
+            if job["status"] == "done" and result.get("html"):
+                st.caption(f"⚠️ Не збережено в БД: {result.get('save_error', '')}")
+                st.download_button(
+                    "📥 Завантажити",
+                    result["html"],
+                    file_name=result.get("file_name", f"{job['kind']}.html"),
+                    mime="text/html",
+                    key=f"job_dl_{job['id']}"
+                )
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _live_jobs_panel(project_id, kinds, limit):
+    jobs = list_jobs(project_id, kinds, limit)
+    _render_jobs(jobs)
+    if not any(job["status"] in JOB_ACTIVE_STATUSES for job in jobs):
+        # Усе завершилось: повний перезапуск сторінки — панель стає статичною, нові результати видно одразу
+        st.rerun()
+
+
+def render_jobs_panel(project_id, kinds=None, limit=5):
+    """
+    Панель фонових задач проекту. Поки є незавершені задачі — оновлюється сама кожні JOB_POLL_SECONDS
+    (не перезапускаючи сторінку), без них — не опитує базу.
+    """
+    jobs = list_jobs(project_id, kinds, limit)
+    if not jobs:
+        return
+    if any(job["status"] in JOB_ACTIVE_STATUSES for job in jobs):
+        _live_jobs_panel(project_id, kinds, limit)
+    else:
+        _render_jobs(jobs)
@@ -0,0 +1,43 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import streamlit as st
+
+# Локальна SQLite-база сервера (черга задач, журнали). Не для даних клієнтів — вони в Supabase.
+DEFAULT_LOCAL_DB_PATH = "virshi_local.sqlite3"
+
+_schema_lock = threading.Lock()
+_schemas_ready = set()
+
+
+@lru_cache(maxsize=1)
+def local_db_path():
+    try:
+        return st.secrets.get("LOCAL_DB_PATH", DEFAULT_LOCAL_DB_PATH)
+    except Exception:
+        # secrets.toml відсутній
+        return DEFAULT_LOCAL_DB_PATH
+
+
+@contextmanager
+def local_db(schema=None):
+    """
+    З'єднання з локальною базою (окреме на кожен виклик — безпечно з будь-якого потоку).
+    schema — DDL (CREATE TABLE IF NOT EXISTS ...), виконується один раз за процес.
+    Коміт при успішному виході з блоку.
+    """
+    conn = sqlite3.connect(local_db_path(), timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        if schema and schema not in _schemas_ready:
+            with _schema_lock:
+                if schema not in _schemas_ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(schema)
+                    _schemas_ready.add(schema)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
@@ -1,6 +1,14 @@
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
-from utils.db import supabase # Потрібно для перевірки лімітів
+from utils.db import supabase, FETCH_CHUNK_SIZE, FETCH_PAGE_SIZE # Потрібно для перевірки лімітів
+from utils.data import mark_project_stale
+from utils.local_store import local_db
+from utils.providers import DISPATCH_MODELS
 
 # 🔴 ПРОДАКШН N8N ВЕБХУКИ
 N8N_GEN_URL = "https://virshi.app.n8n.cloud/webhook/webhook/generate-prompts"
@@ -36,20 +44,340 @@ def n8n_generate_prompts(brand: str, domain: str, industry: str, products: str):
         st.error(f"Помилка з'єднання з N8N: {e}")
         return []
 
-def n8n_trigger_analysis(project_id, keywords, brand_name, models=None):
+# ==============================================================================
+# ПАКЕТНИЙ ЗАПУСК СКАНУВАНЬ
+# ==============================================================================
+N8N_HEADERS = {"virshi-auth": "hi@virshi.ai2025"}
+
+DISPATCH_BATCH_SIZE = 20   # Запитів в одному виклику вебхука
+DISPATCH_WORKERS = 4       # Одночасних викликів n8n
+DISPATCH_RETRIES = 2       # Повторів на пакет (мережа, 429, 5xx)
+DISPATCH_BACKOFF = 1.0     # Секунд перед першим повтором (далі x2)
+DISPATCH_TIMEOUT = 60
+DISPATCH_DEDUP_WINDOW = 600      # Секунд: повторна відправка тієї ж пари (запит, модель) у вікні пропускається
+DISPATCH_LEDGER_KEEP = 86400     # Скільки зберігати записи журналу відправок
+DISPATCH_MULTI_MODEL = False     # Один виклик на пакет для всіх моделей — лише для вебхуків з N8N_MULTI_MODEL_URLS
+
+# Журнал відправок (локальна SQLite): захист від подвійних кліків і повторних rerun-ів
+_LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dispatch_ledger (
+    key TEXT PRIMARY KEY,
+    project_id TEXT,
+    keyword TEXT,
+    provider TEXT,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dispatch_ledger_created_idx ON dispatch_ledger (created_at);
+"""
+
+
+@st.cache_resource
+def _n8n_session():
+    """Спільна HTTP-сесія з пулом з'єднань (keep-alive замість нового TLS на кожен виклик)."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DISPATCH_WORKERS, pool_maxsize=DISPATCH_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(N8N_HEADERS)
+    return session
+
+
+def _post_with_retry(url, payload, retries=DISPATCH_RETRIES, timeout=DISPATCH_TIMEOUT):
+    """POST з повторами та експоненційною паузою. Повертає (ok, текст помилки, JSON відповіді або None)."""
+    error = ""
+    for attempt in range(retries + 1):
+        try:
+            response = _n8n_session().post(url, json=payload, timeout=timeout)
+            if response.status_code == 200:
+                try:
+                    return True, "", response.json()
+                except ValueError:
+                    return True, "", None
+            error = f"{response.status_code} - {response.text[:300]}"
+            # Помилки клієнта (крім 429) повтор не виправить
+            if response.status_code < 500 and response.status_code != 429:
+                return False, error, None
+        except requests.RequestException as e:
+            error = str(e)
+        if attempt < retries:
+            time.sleep(DISPATCH_BACKOFF * (2 ** attempt))
+    return False, error, None
+
+
+_ACK_OK = {"ok", "true", "accepted", "queued", "started", "success"}
+
+
+def _parse_model_acks(data, tech_ids):
     """
-    Відправляє запит на n8n для аналізу.
-    ВЕРСІЯ: TRIAL LOGIC UPDATE.
+    Підтвердження по моделях з відповіді n8n: {tech_id: (ok, error)} або None, якщо їх немає.
+    Формати: {"models": {"gpt-4o": true | "ok" | {"ok": true, "error": ""}}}
+    або [{"provider": "gpt-4o", "ok": true}, ...] (також як {"results": [...]} чи [{"models": {...}}]).
+    """
+    if isinstance(data, list) and len(data) == 1 and isinstance(data[0], dict) and "models" in data[0]:
+        data = data[0]  # n8n часто загортає відповідь у масив
+    items = None
+    if isinstance(data, dict):
+        if isinstance(data.get("models"), dict):
+            items = list(data["models"].items())
+        elif isinstance(data.get("results"), list):
+            data = data["results"]
+    if items is None and isinstance(data, list):
+        items = [(d.get("provider") or d.get("model"), d) for d in data if isinstance(d, dict)]
+
+    acks = {}
+    for tech, ack in items or []:
+        if tech not in tech_ids:
+            continue
+        if isinstance(ack, dict):
+            ok = bool(ack.get("ok", str(ack.get("status", "")).lower() in _ACK_OK))
+            acks[tech] = (ok, "" if ok else str(ack.get("error") or ack.get("status") or "rejected"))
+        else:
+            ok = ack is True or str(ack).lower() in _ACK_OK
+            acks[tech] = (ok, "" if ok else str(ack))
+    return acks or None
+
+
+def multi_model_enabled(target_url):
+    """
+    Чи приймає вебхук кілька моделей в одному виклику ("models").
+    Вмикається явно: secrets N8N_MULTI_MODEL_URLS = ["https://.../run-analysis_prod", ...].
+    """
+    return target_url in (st.secrets.get("N8N_MULTI_MODEL_URLS") or [])
+
+
+def dispatch_key(project_id, keyword, provider):
+    """Ключ ідемпотентності: (проект, запит без регістру/пробілів по краях, провайдер)."""
+    raw = f"{project_id}|{str(keyword).strip().casefold()}|{provider}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _claim_dispatches(items, window):
+    """
+    Резервує ключі в журналі (в одній транзакції — атомарно між потоками й сесіями).
+    Ключ зайнятий, якщо його зарезервовано менше ніж window секунд тому (ковзне вікно:
+    подвійний клік на межі хвилин теж ловиться). Старіші записи ключа замінюються.
+    items: [(key, project_id, keyword, provider)]. Повертає ключі, які вже були зарезервовані (дублікати).
+    """
+    now = time.time()
+    duplicates = set()
+    with local_db(_LEDGER_SCHEMA) as conn:
+        conn.execute("DELETE FROM dispatch_ledger WHERE created_at < ?", (now - max(window, DISPATCH_LEDGER_KEEP),))
+        for key, project_id, keyword, provider in items:
+            conn.execute("DELETE FROM dispatch_ledger WHERE key = ? AND created_at <= ?", (key, now - window))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO dispatch_ledger (key, project_id, keyword, provider, status, created_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?)",
+                (key, project_id, keyword, provider, now)
+            )
+            if cur.rowcount == 0:
+                duplicates.add(key)
+    return duplicates
+
+
+def _settle_dispatches(sent_keys, failed_keys):
+    """Успішні позначаються відправленими; невдалі та невідправлені видаляються, щоб їх можна було повторити."""
+    with local_db(_LEDGER_SCHEMA) as conn:
+        conn.executemany("UPDATE dispatch_ledger SET status = 'sent' WHERE key = ?", [(k,) for k in sent_keys])
+        conn.executemany("DELETE FROM dispatch_ledger WHERE key = ?", [(k,) for k in failed_keys])
+
+
+def dispatch_scans(project_id, keywords, brand_name, models, user_email, official_assets,
+                   target_url=N8N_ANALYZE_URL, batch_size=DISPATCH_BATCH_SIZE,
+                   max_workers=DISPATCH_WORKERS, on_progress=None, dedup_window=DISPATCH_DEDUP_WINDOW,
+                   multi_model=DISPATCH_MULTI_MODEL):
+    """
+    Відправляє сканування пакетами. Пакети йдуть паралельно (не більше max_workers одночасно) через спільну сесію.
+
+    multi_model=False (типово): (пакет запитів x модель) = один виклик.
+    multi_model=True — лише для вебхуків, що обробляють "models" (див. multi_model_enabled): один виклик
+    на пакет з усіма моделями. Відповідь 200 означає, що прийнято всі моделі; якщо вебхук повертає
+    підтвердження по моделях, відхилені позначаються помилкою (без повторної відправки).
+
+    Без Streamlit UI — можна викликати з фонових задач.
+    on_progress(done, total) викликається після кожного пакету (у потоці, що викликав функцію).
+
+    Пари (запит, модель), вже відправлені в межах dedup_window секунд, пропускаються
+    (журнал dispatch_ledger); dedup_window=None вимикає перевірку. Зарезервовані, але не підтверджені
+    пари (помилка, виняток, rerun Streamlit з on_progress) знімаються з журналу в будь-якому разі.
+
+    Повертає статус по кожному елементу:
+    [{"keyword": str, "model": str, "ok": bool, "error": str, "skipped": bool}, ...]
+    skipped=True — дублікат, вже відправлений раніше (ok=True, повторного виклику не було).
+    """
+    keywords = list(keywords)
+    results = []
+
+    # Ідемпотентність: резервуємо ключі до відправки, дублікати відкидаємо
+    keys = {}
+    if dedup_window:
+        for ui_model_name in models:
+            tech_model_id = DISPATCH_MODELS.get(ui_model_name, ui_model_name)
+            for kw in keywords:
+                keys[(kw, ui_model_name)] = dispatch_key(project_id, kw, tech_model_id)
+        claims = {}
+        for (kw, m), key in keys.items():
+            claims.setdefault(key, (key, project_id, kw, DISPATCH_MODELS.get(m, m)))
+        duplicates = _claim_dispatches(list(claims.values()), dedup_window)
+    else:
+        duplicates = set()
+    claimed = set(keys.values()) - duplicates
+
+    try:
+        # Які моделі ще потрібні кожному запиту (після відсіву дублікатів)
+        needed = [[] for _ in keywords]
+        for ui_model_name in models:
+            seen = set()
+            for i, kw in enumerate(keywords):
+                if dedup_window:
+                    key = keys[(kw, ui_model_name)]
+                    if key in duplicates or key in seen:
+                        results.append({"keyword": kw, "model": ui_model_name, "ok": True, "error": "", "skipped": True})
+                        continue
+                    seen.add(key)
+                needed[i].append(ui_model_name)
+
+        # Запити з однаковим набором моделей — в спільні пакети
+        groups = {}
+        for kw, kw_models in zip(keywords, needed):
+            if kw_models:
+                groups.setdefault(tuple(kw_models), []).append(kw)
+
+        jobs = []
+        for group_models, group_kws in groups.items():
+            for i in range(0, len(group_kws), batch_size):
+                batch = group_kws[i:i + batch_size]
+                if multi_model and len(group_models) > 1:
+                    jobs.append((list(group_models), batch))
+                else:
+                    jobs.extend(([m], batch) for m in group_models)
+
+        if not jobs:
+            return results
+
+        def payload(job_models, batch):
+            tech_ids = [DISPATCH_MODELS.get(m, m) for m in job_models]
+            return {
+                "project_id": project_id,
+                "keywords": batch,
+                "brand_name": brand_name,
+                "user_email": user_email,
+                "provider": tech_ids[0],
+                "models": tech_ids,
+                "official_assets": official_assets
+            }
+
+        def add(batch, model, ok, error):
+            results.extend({"keyword": kw, "model": model, "ok": ok, "error": error, "skipped": False} for kw in batch)
+
+        total = len(jobs)
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+            futures = {pool.submit(_post_with_retry, target_url, payload(m, b)): (m, b) for m, b in jobs}
+            for future in as_completed(futures):
+                job_models, batch = futures[future]
+                try:
+                    ok, error, data = future.result()
+                except Exception as e:
+                    ok, error, data = False, str(e), None
+
+                # Без підтверджень по моделях (або моделі в них немає) — прийнято разом з викликом
+                acks = _parse_model_acks(data, {DISPATCH_MODELS.get(m, m) for m in job_models}) if ok and len(job_models) > 1 else None
+                for model in job_models:
+                    add(batch, model, *(acks or {}).get(DISPATCH_MODELS.get(model, model), (ok, error)))
+
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+
+        if any(r["ok"] and not r["skipped"] for r in results):
+            # Нові скани -> наступне читання довантажить їх у кеш аналітики
+            mark_project_stale(project_id)
+        return results
+    finally:
+        # Зарезервоване, але не підтверджене (помилка, виняток, rerun) — знімаємо з журналу
+        if claimed:
+            sent = {keys[(r["keyword"], r["model"])] for r in results if r["ok"] and not r["skipped"]}
+            _settle_dispatches(claimed & sent, claimed - sent)
+
+
+def _clean_official_assets(project_id):
+    """Whitelist проекту у форматі для n8n (без протоколу, www. та кінцевого слешу)."""
+    clean_assets = []
+    try:
+        assets_resp = supabase.table("official_assets")\
+            .select("domain_or_url")\
+            .eq("project_id", project_id)\
+            .execute()
+
+        if assets_resp.data:
+            for item in assets_resp.data:
+                raw_url = (item.get("domain_or_url") or "").lower().strip()
+                clean = raw_url.replace("https://", "").replace("http://", "").replace("www.", "").rstrip("/")
+                if clean:
+                    clean_assets.append(clean)
+    except Exception as e:
+        print(f"Error fetching assets: {e}")
+    return clean_assets
+
+
+def _project_keywords(project_id):
+    """Усі запити проекту (id, keyword_text) сторінками .range() — PostgREST віддає не більше 1000 рядків за раз."""
+    rows = []
+    offset = 0
+    while True:
+        page = supabase.table("keywords")\
+            .select("id, keyword_text")\
+            .eq("project_id", project_id)\
+            .order("id")\
+            .range(offset, offset + FETCH_PAGE_SIZE - 1)\
+            .execute().data or []
+        rows.extend(page)
+        if len(page) < FETCH_PAGE_SIZE:
+            return rows
+        offset += FETCH_PAGE_SIZE
+
+
+def _scanned_keyword_ids(keyword_ids, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Які з keyword_ids мають хоча б один скан. Перевірка порціями .in_(): знайдені запити
+    виключаються з наступного запиту порції, тож читається сторінка на раунд, а не вся історія сканів.
+    """
+    found = set()
+    for i in range(0, len(keyword_ids), chunk_size):
+        remaining = keyword_ids[i:i + chunk_size]
+        while remaining:
+            page = supabase.table("scan_results")\
+                .select("keyword_id")\
+                .in_("keyword_id", remaining)\
+                .limit(FETCH_PAGE_SIZE)\
+                .execute().data or []
+            hits = {row["keyword_id"] for row in page}
+            found |= hits
+            # Неповна сторінка — інших сканів у цих запитів немає
+            if len(page) < FETCH_PAGE_SIZE:
+                break
+            remaining = [k for k in remaining if k not in hits]
+    return found
+
+
+def _trial_scanned_keywords(project_id, keywords_list):
+    """Які з запитів вже мають хоча б один скан (Trial: 1 сканування на запит)."""
+    wanted = set(keywords_list)
+    kw_ids = {item['id']: item['keyword_text'] for item in _project_keywords(project_id) if item['keyword_text'] in wanted}
+    if not kw_ids:
+        return set()
+    return {kw_ids[kw_id] for kw_id in _scanned_keyword_ids(list(kw_ids)) if kw_id in kw_ids}
+
+
+def n8n_dispatch_batch(project_id, keywords, brand_name, models=None, on_progress=None):
+    """
+    Запуск сканування багатьох запитів одразу (статус проекту, Trial-ліміт, пакетна відправка).
+    Повертає статус по кожному (запит, модель) — див. dispatch_scans. Порожній список = нічого не запущено.
     """
     # URL для аналізу (може бути перезаписаний з secrets)
     target_url = st.secrets.get("N8N_ANALYZE_URL", N8N_ANALYZE_URL)
 
-    MODEL_MAPPING = {
-        "Perplexity": "perplexity",
-        "OpenAI GPT": "gpt-4o",
-        "Google Gemini": "gemini-1.5-pro"
-    }
-
     # Отримання статусу проекту
     current_proj = st.session_state.get("current_project")
     status = "trial"
@@ -58,7 +386,7 @@ def n8n_trigger_analysis(project_id, keywords, brand_name, models=None):
     
     if status == "blocked":
         st.error("⛔ Проект заблоковано. Зверніться до адміністратора.")
-        return False
+        return []
 
     if not models:
         models = ["Perplexity"] # Default
@@ -66,117 +394,68 @@ def n8n_trigger_analysis(project_id, keywords, brand_name, models=None):
     if isinstance(keywords, str):
         keywords_list = [keywords]
     else:
-        keywords_list = keywords
+        keywords_list = list(keywords)
 
     # 🔥 ЛОГІКА ТРІАЛУ
     if status == "trial":
         try:
-            # 1. Знаходимо ID для слів
-            kw_resp = supabase.table("keywords")\
-                .select("id, keyword_text")\
-                .eq("project_id", project_id)\
-                .in_("keyword_text", keywords_list)\
-                .execute()
-            
-            kw_map = {item['keyword_text']: item['id'] for item in kw_resp.data} if kw_resp.data else {}
-            
-            allowed_keywords = []
-            blocked_keywords = []
-
-            for kw_text in keywords_list:
-                kw_id = kw_map.get(kw_text)
-                if kw_id:
-                    # 2. Перевірка наявності сканів
-                    existing_scan = supabase.table("scan_results")\
-                        .select("id", count="exact")\
-                        .eq("keyword_id", kw_id)\
-                        .limit(1)\
-                        .execute()
-                    
-                    if existing_scan.count and existing_scan.count > 0:
-                        blocked_keywords.append(kw_text)
-                    else:
-                        allowed_keywords.append(kw_text)
-                else:
-                    allowed_keywords.append(kw_text)
+            scanned = _trial_scanned_keywords(project_id, keywords_list)
+
+            allowed_keywords = [kw for kw in keywords_list if kw not in scanned]
+            blocked_keywords = [kw for kw in keywords_list if kw in scanned]
 
             if blocked_keywords:
                 st.warning(f"🔒 Наступні запити вже були проскановані (Trial ліміт 1 раз): {', '.join(blocked_keywords[:3])}...")
             
             if not allowed_keywords:
                 st.error("⛔ Всі обрані запити вже були проскановані. У статусі Trial повторне сканування заборонено.")
-                return False
+                return []
             
             keywords_list = allowed_keywords
 
         except Exception as e:
             print(f"Trial check error: {e}")
             st.warning("⚠️ Не вдалося перевірити ліміти Trial. Спробуйте пізніше.")
-            return False
+            return []
+
+    if not keywords_list:
+        return []
 
     try:
         user = st.session_state.get("user")
         user_email = user.email if user else "no-reply@virshi.ai"
-        
-        success_count = 0
 
-        # Отримання Whitelist
-        clean_assets = []
-        try:
-            assets_resp = supabase.table("official_assets")\
-                .select("domain_or_url")\
-                .eq("project_id", project_id)\
-                .execute()
-            
-            if assets_resp.data:
-                for item in assets_resp.data:
-                    raw_url = item.get("domain_or_url", "").lower().strip()
-                    clean = raw_url.replace("https://", "").replace("http://", "").replace("www.", "").rstrip("/")
-                    if clean:
-                        clean_assets.append(clean)
-        except Exception as e:
-            print(f"Error fetching assets: {e}")
-            clean_assets = []
-
-        headers = {"virshi-auth": "hi@virshi.ai2025"}
+        results = dispatch_scans(
+            project_id, keywords_list, brand_name, models, user_email,
+            _clean_official_assets(project_id), target_url=target_url, on_progress=on_progress,
+            multi_model=multi_model_enabled(target_url)
+        )
 
-        if not keywords_list:
-             return False
+        skipped = sum(1 for r in results if r.get("skipped"))
+        if skipped:
+            st.info(f"ℹ️ {skipped} запит(ів) вже запущено щойно — повторно не відправляємо.")
 
-        for ui_model_name in models:
-            tech_model_id = MODEL_MAPPING.get(ui_model_name, ui_model_name)
+        # Одне повідомлення на модель замість повідомлення на кожен запит
+        failed = {}
+        for r in results:
+            if not r["ok"]:
+                failed.setdefault(r["model"], []).append(r)
+        for model, items in failed.items():
+            st.error(f"Помилка n8n ({model}): {len(items)} запит(ів) не запущено. {items[0]['error']}")
 
-            payload = {
-                "project_id": project_id,
-                "keywords": keywords_list,
-                "brand_name": brand_name,
-                "user_email": user_email,
-                "provider": tech_model_id,
-                "models": [tech_model_id],
-                "official_assets": clean_assets 
-            }
-            
-            try:
-                response = requests.post(
-                    target_url, 
-                    json=payload, 
-                    headers=headers, 
-                    timeout=60
-                )
-                
-                if response.status_code == 200:
-                    success_count += 1
-                else:
-                    st.error(f"Помилка n8n ({ui_model_name}): {response.text}")
-                    
-            except Exception as inner_e:
-                st.error(f"Не вдалося запустити {ui_model_name}: {inner_e}")
-
-        return success_count > 0
+        return results
             
     except Exception as e:
         st.error(f"Критична помилка запуску: {e}")
-        return False
+        return []
+
+def n8n_trigger_analysis(project_id, keywords, brand_name, models=None):
+    """
+    Відправляє запит на n8n для аналізу.
+    ВЕРСІЯ: TRIAL LOGIC UPDATE + BATCH DISPATCH.
+    """
+    results = n8n_dispatch_batch(project_id, keywords, brand_name, models=models)
+    return any(r["ok"] for r in results)
 
 def trigger_ai_recommendation(user, project, category, context_text):
     """
@@ -0,0 +1,69 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# РЕЄСТР ПРОВАЙДЕРІВ (LLM): одне місце для назв, ID моделей та кольорів
+# Сирий provider зі scan_results -> провайдер за входженням будь-якого з patterns.
+# ==============================================================================
+
+PROVIDERS = [
+    {
+        "key": "perplexity", "label": "Perplexity", "short": "Perplexity", "model": "perplexity",
+        "patterns": ("perplexity", "sonar"),
+        "color": "#00C896", "dispatch": True,
+    },
+    {
+        "key": "openai", "label": "OpenAI GPT", "short": "Chat GPT", "model": "gpt-4o",
+        "patterns": ("gpt", "openai"),
+        "color": "#FF4B4B", "dispatch": True,
+    },
+    {
+        "key": "gemini", "label": "Google Gemini", "short": "Gemini", "model": "gemini-1.5-pro",
+        "patterns": ("gemini", "google"),
+        "color": "#3B82F6", "dispatch": True,
+    },
+    {
+        "key": "claude", "label": "Anthropic Claude", "short": "Claude", "model": "claude",
+        "patterns": ("claude", "anthropic"),
+        "color": "#D97757", "dispatch": False,
+    },
+]
+
+_BY_KEY = {p["key"]: p for p in PROVIDERS}
+
+# UI-назва -> ID моделі для n8n (лише моделі, які вміє запускати воркфлоу)
+DISPATCH_MODELS = {p["label"]: p["model"] for p in PROVIDERS if p["dispatch"]}
+PROVIDER_COLORS = {p["short"]: p["color"] for p in PROVIDERS}
+
+
+@lru_cache(maxsize=1024)
+def provider_key(raw):
+    """Ключ провайдера для сирого значення ('gpt-4o-2024' -> 'openai') або None."""
+    s = str(raw or "").lower()
+    for p in PROVIDERS:
+        if any(pattern in s for pattern in p["patterns"]):
+            return p["key"]
+    return None
+
+
+def provider_label(raw, short=False):
+    """UI-назва провайдера; невідомий провайдер показується як є."""
+    key = provider_key(raw)
+    if key is None:
+        return str(raw)
+    return _BY_KEY[key]["short" if short else "label"]
+
+
+def provider_labels(series, short=False):
+    """Векторизовано: UI-назви для Series сирих значень (кожне унікальне значення розпізнається один раз)."""
+    codes, uniques = pd.factorize(series.fillna("").astype(str))
+    labels = np.array([provider_label(u, short) for u in uniques], dtype=object)
+    return pd.Series(labels[codes] if len(uniques) else [], index=series.index, dtype=object)
+
+
+def providers_matching(raw_values, labels, short=False):
+    """Які з сирих значень належать обраним UI-назвам."""
+    labels = set(labels)
+    return [r for r in raw_values if provider_label(r, short) in labels]
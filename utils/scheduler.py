@@ -0,0 +1,324 @@
+import heapq
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import streamlit as st
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокування процесу недоступне (планувальник не захищений від другого процесу)
+    fcntl = None
+
+from utils.db import supabase, fetch_in_chunks
+from utils.data import iter_scan_pages
+from utils.local_store import local_db, local_db_path
+from utils.n8n import dispatch_scans, _clean_official_assets, N8N_ANALYZE_URL
+from utils.providers import DISPATCH_MODELS
+
+# ==============================================================================
+# АВТОЗАПУСК: планувальник повторних сканувань
+# Черга з пріоритетом (heapq) за часом наступного запуску кожної пари (запит, модель).
+# Відправка через utils/n8n.py пакетами, з лімітами на кожного провайдера:
+# одночасні виклики + token bucket (сканувань на хвилину).
+#
+# Налаштування в таблиці keywords: is_auto_scan (bool), frequency (ключ FREQUENCY_HOURS),
+# auto_models (список UI-назв моделей). Працює лише для проектів status = active та allow_cron.
+#
+# Час останньої відправки кожної пари зберігається в локальній SQLite (scheduler_runs): наступний
+# запуск рахується від max(останній скан, остання відправка), навіть якщо скан ще не записано
+# або n8n його так і не записав. Працює лише в одному процесі на сервері (flock на SCHEDULER_LOCK_SUFFIX).
+# ==============================================================================
+
+FREQUENCY_HOURS = {"daily": 24, "every_3_days": 72, "weekly": 168, "monthly": 720}
+FREQUENCY_UI = {"daily": "Щодня", "every_3_days": "Раз на 3 дні", "weekly": "Щотижня", "monthly": "Щомісяця"}
+DEFAULT_FREQUENCY = "weekly"
+DEFAULT_AUTO_MODELS = ["Perplexity"]
+
+SCHEDULER_TICK_SECONDS = 60        # Як часто перевіряти чергу
+SCHEDULER_RELOAD_SECONDS = 600     # Як часто перечитувати налаштування з БД
+SCHEDULER_RETRY_SECONDS = 900      # Повтор після невдалої відправки
+SCHEDULER_USER_EMAIL = ""              # Порожній = "🤖 Автосканування" в історії (views/history.py)
+SCHEDULER_LOCK_SUFFIX = ".scheduler.lock"   # Файл блокування поруч з локальною базою
+
+_RUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduler_runs (
+    keyword_id TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    dispatched_at REAL NOT NULL,
+    ok INTEGER NOT NULL,
+    PRIMARY KEY (keyword_id, provider)
+);
+"""
+
+# Ліміти на провайдера (технічна назва моделі). Токен = одне сканування (запит x модель).
+PROVIDER_LIMITS = {
+    "perplexity": {"concurrency": 2, "per_minute": 30, "burst": 40},
+    "gpt-4o": {"concurrency": 2, "per_minute": 20, "burst": 20},
+    "gemini-1.5-pro": {"concurrency": 2, "per_minute": 20, "burst": 20},
+}
+DEFAULT_PROVIDER_LIMIT = {"concurrency": 1, "per_minute": 10, "burst": 10}
+
+
+def _limit(provider):
+    return PROVIDER_LIMITS.get(provider, DEFAULT_PROVIDER_LIMIT)
+
+
+def _take_tokens(bucket, provider, wanted, now):
+    """Token bucket: поповнює запас за час, що минув, і забирає до `wanted` токенів. Повертає скільки видано."""
+    limit = _limit(provider)
+    bucket["tokens"] = min(limit["burst"], bucket["tokens"] + (now - bucket["updated"]) * limit["per_minute"] / 60)
+    bucket["updated"] = now
+    granted = min(wanted, int(bucket["tokens"]))
+    bucket["tokens"] -= granted
+    return granted
+
+
+@st.cache_resource
+def _scheduler_state():
+    return {
+        "lock": threading.Lock(),
+        "heap": [],          # (next_run_ts, keyword_id, provider)
+        "keywords": {},      # keyword_id -> {"project_id", "text", "interval"}
+        "projects": {},      # project_id -> {"brand_name", "assets"}
+        "buckets": {},       # provider -> {"tokens", "updated"}
+        "loaded_at": float("-inf"),
+    }
+
+
+def _interval_seconds(frequency):
+    return FREQUENCY_HOURS.get(frequency or DEFAULT_FREQUENCY, FREQUENCY_HOURS[DEFAULT_FREQUENCY]) * 3600
+
+
+def _auto_providers(kw):
+    models = kw.get("auto_models") or DEFAULT_AUTO_MODELS
+    return {DISPATCH_MODELS.get(m, m) for m in models}
+
+
+def _record_runs(items, ok, dispatched_at):
+    """Запам'ятовує відправку пар [(keyword_id, provider)] (переживає перезавантаження черги та перезапуск)."""
+    with local_db(_RUNS_SCHEMA) as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO scheduler_runs (keyword_id, provider, dispatched_at, ok) VALUES (?, ?, ?, ?)",
+            [(kw_id, provider, dispatched_at, int(ok)) for kw_id, provider in items]
+        )
+
+
+def _load_runs():
+    """Остання відправка кожної пари: {(keyword_id, provider): (dispatched_at, ok)}."""
+    with local_db(_RUNS_SCHEMA) as conn:
+        rows = conn.execute("SELECT keyword_id, provider, dispatched_at, ok FROM scheduler_runs").fetchall()
+    return {(r["keyword_id"], r["provider"]): (r["dispatched_at"], bool(r["ok"])) for r in rows}
+
+
+def _next_run(last_scan, last_dispatch, interval, now):
+    """Наступний запуск пари: від пізнішого з останнього скану та останньої відправки (невдала — повтор за SCHEDULER_RETRY_SECONDS)."""
+    candidates = []
+    if last_scan:
+        candidates.append(last_scan + interval)
+    if last_dispatch:
+        dispatched_at, ok = last_dispatch
+        candidates.append(dispatched_at + (interval if ok else SCHEDULER_RETRY_SECONDS))
+    return max(candidates) if candidates else now
+
+
+def _load_schedule(now):
+    """Будує чергу з БД: налаштування запитів + час останнього скану та останньої відправки кожної пари (запит, модель)."""
+    projects = supabase.table("projects")\
+        .select("id, brand_name")\
+        .eq("allow_cron", True)\
+        .eq("status", "active")\
+        .execute().data or []
+    if not projects:
+        return [], {}, {}
+
+    kw_rows = fetch_in_chunks(
+        "keywords", "project_id", [p["id"] for p in projects],
+        columns="id, project_id, keyword_text, is_active, is_auto_scan, frequency, auto_models"
+    )
+    keywords = {
+        k["id"]: {"project_id": k["project_id"], "text": k["keyword_text"],
+                  "interval": _interval_seconds(k.get("frequency")), "providers": _auto_providers(k)}
+        for k in kw_rows if k.get("is_active", True) and k.get("is_auto_scan")
+    }
+
+    # Останній скан пари (запит, модель): лише за вікно найдовшої частоти проекту
+    last_run = {}
+    for project in projects:
+        window = max((k["interval"] for k in keywords.values() if k["project_id"] == project["id"]), default=0)
+        if not window:
+            continue
+        since = datetime.fromtimestamp(now - window, timezone.utc).isoformat()
+        for page in iter_scan_pages(project["id"], "id, keyword_id, provider, created_at", start=since):
+            for row in page:
+                ts = datetime.fromisoformat(row["created_at"].replace("Z", "+00:00")).timestamp()
+                key = (row["keyword_id"], row["provider"])
+                if ts > last_run.get(key, 0):
+                    last_run[key] = ts
+
+    runs = _load_runs()
+    heap = []
+    for kw_id, kw in keywords.items():
+        for provider in kw.pop("providers"):
+            key = (kw_id, provider)
+            heap.append((_next_run(last_run.get(key), runs.get(key), kw["interval"], now), kw_id, provider))
+    heapq.heapify(heap)
+
+    project_info = {p["id"]: {"brand_name": p.get("brand_name") or "", "assets": None} for p in projects}
+    return heap, keywords, project_info
+
+
+def _pop_due(state, now):
+    """Всі пари з настав часом запуску, згруповані по провайдеру, а в ньому — по проекту."""
+    due = {}
+    heap = state["heap"]
+    while heap and heap[0][0] <= now:
+        next_run, kw_id, provider = heapq.heappop(heap)
+        kw = state["keywords"].get(kw_id)
+        if kw is None:
+            continue
+        due.setdefault(provider, {}).setdefault(kw["project_id"], []).append((next_run, kw_id))
+    return due
+
+
+def _dispatch_provider(state, provider, by_project, now):
+    """Відправка всіх готових запитів одного провайдера (послідовно по проектах, concurrency — всередині пакету)."""
+    limit = _limit(provider)
+    requeue = []
+    bucket = state["buckets"].setdefault(provider, {"tokens": limit["burst"], "updated": now})
+
+    for project_id, items in by_project.items():
+        with state["lock"]:
+            granted = _take_tokens(bucket, provider, len(items), time.time())
+        # Решта залишається в черзі з тим самим часом — піде, коли з'являться токени
+        requeue.extend((next_run, kw_id, provider) for next_run, kw_id in items[granted:])
+        items = items[:granted]
+        if not items:
+            continue
+
+        project = state["projects"][project_id]
+        if project["assets"] is None:
+            project["assets"] = _clean_official_assets(project_id)
+
+        ids_by_text = {}
+        for _, kw_id in items:
+            ids_by_text.setdefault(state["keywords"][kw_id]["text"], []).append(kw_id)
+        try:
+            results = dispatch_scans(
+                project_id, list(ids_by_text), project["brand_name"], [provider], SCHEDULER_USER_EMAIL,
+                project["assets"], target_url=st.secrets.get("N8N_ANALYZE_URL", N8N_ANALYZE_URL),
+                max_workers=limit["concurrency"]
+            )
+        except Exception as e:
+            print(f"Scheduler dispatch error ({provider}, {project_id}): {e}")
+            results = [{"keyword": text, "ok": False} for text in ids_by_text]
+
+        sent_at = time.time()
+        for ok in (True, False):
+            pairs = [(kw_id, provider) for r in results if r["ok"] == ok for kw_id in ids_by_text.get(r["keyword"], [])]
+            if pairs:
+                _record_runs(pairs, ok, sent_at)
+            for kw_id, _ in pairs:
+                delay = state["keywords"][kw_id]["interval"] if ok else SCHEDULER_RETRY_SECONDS
+                requeue.append((sent_at + delay, kw_id, provider))
+    return requeue
+
+
+def run_scheduler_tick(now=None):
+    """Один крок: (пере)завантаження черги за потреби, відправка всього, що настав час сканувати."""
+    state = _scheduler_state()
+    now = now or time.time()
+
+    if now - state["loaded_at"] > SCHEDULER_RELOAD_SECONDS:
+        heap, keywords, projects = _load_schedule(now)
+        with state["lock"]:
+            state["heap"], state["keywords"], state["projects"] = heap, keywords, projects
+            state["loaded_at"] = now
+
+    with state["lock"]:
+        due = _pop_due(state, now)
+    if not due:
+        return 0
+
+    # Провайдери паралельно (у кожного свої ліміти), всередині провайдера — по черзі
+    with ThreadPoolExecutor(max_workers=len(due)) as pool:
+        requeues = list(pool.map(lambda p: _dispatch_provider(state, p, due[p], now), due))
+
+    with state["lock"]:
+        for items in requeues:
+            for item in items:
+                heapq.heappush(state["heap"], item)
+    return sum(len(items) for projects in due.values() for items in projects.values())
+
+
+def reload_schedule():
+    """Перечитати налаштування на наступному кроці (після зміни частоти / моделей)."""
+    _scheduler_state()["loaded_at"] = float("-inf")
+
+
+def project_schedule(project_id, limit=10):
+    """Найближчі запуски проекту: [(next_run_ts, keyword_text, provider)]."""
+    state = _scheduler_state()
+    with state["lock"]:
+        items = [
+            (next_run, state["keywords"][kw_id]["text"], provider)
+            for next_run, kw_id, provider in state["heap"]
+            if state["keywords"].get(kw_id, {}).get("project_id") == project_id
+        ]
+    return heapq.nsmallest(limit, items)
+
+
+def _acquire_scheduler_lock():
+    """
+    Ексклюзивне блокування планувальника (flock). Повертає відкритий файл-власник або None, якщо
+    планувальник вже працює: в іншому процесі (python -m utils.scheduler) чи в іншому потоці цього
+    (після "Clear cache"). Блокування знімається ОС разом із процесом.
+    """
+    lock_file = open(os.path.abspath(local_db_path()) + SCHEDULER_LOCK_SUFFIX, "a")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _scheduler_loop():
+    # Поки блокування тримає інший планувальник, цей лише чекає (і перехоплює роботу, якщо той зупиниться)
+    lock = None
+    while True:
+        if lock is None:
+            lock = _acquire_scheduler_lock()
+        if lock is not None:
+            try:
+                run_scheduler_tick()
+            except Exception:
+                print(f"Scheduler error: {traceback.format_exc()}")
+        time.sleep(SCHEDULER_TICK_SECONDS)
+
+
+@st.cache_resource
+def start_scheduler():
+    """
+    Запускає планувальник у фоновому потоці, лише якщо в secrets SCHEDULER_ENABLED = true
+    (за замовчуванням вимкнено: планувальник запускає платні сканування). Потрібні колонки
+    keywords.is_auto_scan / frequency / auto_models — sql/001_keywords_auto_scan.sql.
+    Альтернатива потоку — окремий процес: python -m utils.scheduler.
+    Навіть увімкнений, відправляє лише один планувальник на сервер (_acquire_scheduler_lock).
+    """
+    if not st.secrets.get("SCHEDULER_ENABLED", False):
+        return None
+    thread = threading.Thread(target=_scheduler_loop, name="virshi-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # Окремий процес замість потоку в Streamlit: python -m utils.scheduler
+    _scheduler_loop()
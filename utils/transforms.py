@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# СПІЛЬНІ ПЕРЕТВОРЕННЯ ЗГАДОК (векторизовані, однакові для всіх сторінок)
+# ==============================================================================
+
+# Значення прапорця is_my_brand, які вважаються "так" (n8n пише по-різному)
+TRUE_VALUES = ["true", "1", "t", "yes", "on"]
+
+SENTIMENT_SCORES = {"Позитивна": 100, "Нейтральна": 50, "Негативна": 0}
+
+
+def flag_mask(series):
+    """Булевий прапорець з будь-якого представлення (True, 'true', 1, 't' ...)."""
+    return series.astype(str).str.strip().str.lower().isin(TRUE_VALUES)
+
+
+def brand_target_mask(mentions, brand_name):
+    """
+    Чи є згадка нашим брендом:
+    1. Прапорець is_my_brand від n8n, або
+    2. Назви входять одна в одну (без урахування регістру).
+    """
+    if mentions.empty:
+        return pd.Series(False, index=mentions.index, dtype=bool)
+
+    is_flag = flag_mask(mentions["is_my_brand"]) if "is_my_brand" in mentions.columns \
+        else pd.Series(False, index=mentions.index)
+    target = str(brand_name or "").strip().lower()
+    if not target or "brand_name" not in mentions.columns:
+        return is_flag
+
+    names = mentions["brand_name"].fillna("").astype(str).str.strip().str.lower()
+    # Порівнюємо лише унікальні назви, а не кожен рядок
+    uniq = pd.Series(names.unique())
+    matched = set(uniq[uniq.map(lambda n: bool(n) and (target in n or n in target))])
+    return is_flag | names.isin(matched)
+
+
+def normalize_sentiment(series):
+    """Тональність -> Позитивна / Нейтральна / Негативна (невідоме = Нейтральна)."""
+    s = series.fillna("").astype(str).str.lower()
+    is_pos = s.str.contains("поз|pos", regex=True)
+    is_neg = s.str.contains("нег|neg", regex=True)
+    labels = np.select([is_pos, is_neg], ["Позитивна", "Негативна"], default="Нейтральна")
+    return pd.Series(labels, index=series.index, dtype=object)
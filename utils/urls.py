@@ -0,0 +1,113 @@
+import hashlib
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import pandas as pd
+
+from utils.db import supabase, fetch_in_chunks
+
+try:
+    import tldextract
+    # Вбудований знімок Public Suffix List, без мережі та без кешу на диску
+    _TLD_EXTRACT = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+except ImportError:
+    _TLD_EXTRACT = None
+
+# ==============================================================================
+# ЗБАГАЧЕННЯ ДЖЕРЕЛ: канонічний URL, хост, реєстрований домен (eTLD+1), хеш URL
+# Рахується один раз на URL (при завантаженні даних або фоновою задачею backfill_source_urls),
+# сторінки групують за готовими колонками замість розбору рядків.
+# ==============================================================================
+
+URL_COLUMNS = ["canonical_url", "host", "registrable_domain", "url_hash"]
+ENRICH_BATCH_SIZE = 200   # id в одному update
+
+# Багаторівневі публічні суфікси, якщо tldextract не встановлено
+FALLBACK_SUFFIXES = {
+    "com.ua", "org.ua", "net.ua", "gov.ua", "edu.ua", "in.ua", "kiev.ua", "kyiv.ua", "lviv.ua", "od.ua",
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "co.jp", "com.br", "com.tr", "com.pl", "co.il",
+    "com.cn", "co.in", "com.mx", "co.za",
+}
+# Параметри відстеження, які не змінюють сторінку
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|yclid|mc_cid|mc_eid|ref_src)$")
+
+
+def _registrable(host):
+    if not host or host.replace(".", "").isdigit():
+        return host
+    if _TLD_EXTRACT is not None:
+        parts = _TLD_EXTRACT(host)
+        return f"{parts.domain}.{parts.suffix}" if parts.domain and parts.suffix else host
+    labels = host.split(".")
+    if len(labels) > 2 and ".".join(labels[-2:]) in FALLBACK_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+@lru_cache(maxsize=100_000)
+def enrich_url(url):
+    """
+    URL -> (канонічний URL, хост, реєстрований домен, хеш).
+    'Https://WWW.Rozetka.com.ua/phones/?utm_source=x#top)' -> ('https://rozetka.com.ua/phones', 'rozetka.com.ua', 'rozetka.com.ua', ...).
+    Хвости Markdown (')' / ']'), www., фрагмент, параметри відстеження та кінцевий слеш відкидаються.
+    """
+    s = re.split(r"[)\]\s]", str(url or "").strip(), maxsplit=1)[0]
+    if not s:
+        return "", "", "", ""
+    if "://" not in s:
+        s = "https://" + s
+    try:
+        parts = urlsplit(s)
+        host = (parts.hostname or "").rstrip(".")
+        port = parts.port
+    except ValueError:
+        return s, "", "", hashlib.blake2b(s.encode("utf-8"), digest_size=8).hexdigest()
+    host = host[4:] if host.startswith("www.") else host
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(k)])
+    netloc = f"{host}:{port}" if port and port not in (80, 443) else host
+    canonical = urlunsplit(("https", netloc, parts.path.rstrip("/"), query, ""))
+    return canonical, host, _registrable(host), hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def enrich_sources(df, url_col="url"):
+    """
+    Додає / дозаповнює колонки URL_COLUMNS. Рахуються лише рядки без url_hash, кожен унікальний URL — один раз.
+    """
+    for col in URL_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    missing = df["url_hash"].isna() | (df["url_hash"].astype(str) == "")
+    if missing.any():
+        urls = df.loc[missing, url_col].fillna("").astype(str)
+        parts = pd.DataFrame([enrich_url(u) for u in urls.unique()], columns=URL_COLUMNS, index=urls.unique())
+        df.loc[missing, URL_COLUMNS] = parts.reindex(urls.to_numpy()).to_numpy()
+    return df
+
+
+def backfill_source_urls(project_id, batch_size=ENRICH_BATCH_SIZE):
+    """
+    Фонова задача: записує URL_COLUMNS у extracted_sources проекту для рядків, де їх ще немає.
+    Потребує колонок canonical_url, host, registrable_domain, url_hash (sql/002_extracted_sources_url_columns.sql).
+    Повертає {"checked", "updated"}.
+    """
+    from utils.data import iter_scan_pages, invalidate_project_data  # utils.data імпортує цей модуль
+
+    scan_ids = [row["id"] for page in iter_scan_pages(project_id, "id, created_at") for row in page]
+    rows = fetch_in_chunks("extracted_sources", "scan_result_id", scan_ids, columns="id, url, url_hash")
+    todo = [r for r in rows if not r.get("url_hash")]
+
+    # Однакові значення (варіанти одного канонічного URL) — один update на batch_size id
+    ids_by_values = {}
+    for r in todo:
+        ids_by_values.setdefault(enrich_url(str(r.get("url") or "")), []).append(r["id"])
+    for values, ids in ids_by_values.items():
+        for i in range(0, len(ids), batch_size):
+            supabase.table("extracted_sources")\
+                .update(dict(zip(URL_COLUMNS, values)))\
+                .in_("id", ids[i:i + batch_size])\
+                .execute()
+
+    if todo:
+        invalidate_project_data(project_id)
+    return {"checked": len(rows), "updated": len(todo)}
@@ -0,0 +1,121 @@
+import pandas as pd
+
+from utils.db import supabase, fetch_in_chunks
+from utils.data import iter_scan_pages, invalidate_project_data
+from utils.domains import normalize_asset, compile_whitelist, match_official
+from utils.transforms import flag_mask
+
+# ==============================================================================
+# WHITELIST: збереження змін (diff замість delete + insert) та перерахунок
+# збереженого прапорця extracted_sources.is_official у фоні (utils/jobs.py)
+# ==============================================================================
+
+RECLASSIFY_BATCH_SIZE = 200   # id в одному update
+
+
+def asset_key(entry):
+    """Ключ запису Whitelist: 'https://www.Rozetka.com.ua/' і 'rozetka.com.ua' — один запис."""
+    host, path = normalize_asset(entry)
+    return f"{host}/{path}" if path else host
+
+
+def whitelist_diff(old_rows, new_rows):
+    """
+    Різниця між збереженим і новим списком ({"domain_or_url", "type"}):
+    {"add": [рядки], "remove": [domain_or_url], "retype": {type: [domain_or_url]}}.
+    Порожні записи та дублікати (за asset_key) нового списку відкидаються.
+    """
+    old = {asset_key(r["domain_or_url"]): r for r in old_rows if asset_key(r["domain_or_url"])}
+    new = {}
+    for r in new_rows:
+        key = asset_key(r["domain_or_url"])
+        if key:
+            new.setdefault(key, r)
+
+    diff = {
+        "add": [new[k] for k in new if k not in old],
+        "remove": [old[k]["domain_or_url"] for k in old if k not in new],
+        "retype": {},
+    }
+    for key in new.keys() & old.keys():
+        if new[key]["type"] != old[key]["type"]:
+            diff["retype"].setdefault(new[key]["type"], []).append(old[key]["domain_or_url"])
+    return diff
+
+
+def save_whitelist(project_id, rows):
+    """
+    Застосовує зміни Whitelist проекту: insert нових, update типу, delete видалених.
+    Спершу додавання, потім видалення — збій посередині не залишає проект без Whitelist.
+    Повертає diff (див. whitelist_diff) з ключем "changed" — записи, що змінюють офіційність джерел.
+    """
+    current = supabase.table("official_assets")\
+        .select("domain_or_url, type")\
+        .eq("project_id", project_id)\
+        .execute().data or []
+    diff = whitelist_diff(current, rows)
+
+    if diff["add"]:
+        supabase.table("official_assets").insert([
+            {"project_id": project_id, "domain_or_url": str(r["domain_or_url"]).strip(), "type": r["type"]}
+            for r in diff["add"]
+        ]).execute()
+    for asset_type, entries in diff["retype"].items():
+        supabase.table("official_assets")\
+            .update({"type": asset_type})\
+            .eq("project_id", project_id)\
+            .in_("domain_or_url", entries)\
+            .execute()
+    if diff["remove"]:
+        supabase.table("official_assets")\
+            .delete()\
+            .eq("project_id", project_id)\
+            .in_("domain_or_url", diff["remove"])\
+            .execute()
+
+    diff["changed"] = [str(r["domain_or_url"]).strip() for r in diff["add"]] + diff["remove"]
+    return diff
+
+
+def reclassify_sources(project_id, changed=None, batch_size=RECLASSIFY_BATCH_SIZE):
+    """
+    Фонова задача: перераховує extracted_sources.is_official за поточним Whitelist.
+    changed — записи, що змінились (перевіряються лише URL, які під них підпадають); None — всі джерела.
+    Оновлює лише рядки, де прапорець відрізняється. Повертає {"checked", "updated"}.
+    """
+    assets = supabase.table("official_assets")\
+        .select("domain_or_url")\
+        .eq("project_id", project_id)\
+        .execute().data or []
+    index = compile_whitelist([a["domain_or_url"] for a in assets])
+    changed_index = compile_whitelist(changed) if changed is not None else None
+
+    scan_ids = [row["id"] for page in iter_scan_pages(project_id, "id, created_at") for row in page]
+    rows = fetch_in_chunks("extracted_sources", "scan_result_id", scan_ids, columns="id, url, is_official")
+    if not rows:
+        return {"checked": 0, "updated": 0}
+
+    sources = pd.DataFrame(rows, columns=["id", "url", "is_official"])
+    urls = sources["url"].fillna("").astype(str)
+    unique_urls = urls.unique()
+    if changed_index is not None:
+        unique_urls = [u for u in unique_urls if match_official(u, changed_index) is not None]
+    flags = {u: match_official(u, index) is not None for u in unique_urls}
+
+    affected = urls.isin(flags.keys())
+    sources = sources[affected]
+    new_flag = urls[affected].map(flags).astype(bool)
+    stale = sources[new_flag != flag_mask(sources["is_official"])]
+    new_flag = new_flag[stale.index]
+
+    for flag in (True, False):
+        ids = stale.loc[new_flag == flag, "id"].tolist()
+        for i in range(0, len(ids), batch_size):
+            supabase.table("extracted_sources")\
+                .update({"is_official": flag})\
+                .in_("id", ids[i:i + batch_size])\
+                .execute()
+
+    if len(stale):
+        invalidate_project_data(project_id)
+    return {"checked": int(affected.sum()), "updated": len(stale)}
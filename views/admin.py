@@ -6,6 +6,7 @@ import plotly.express as px
 
 # 🔥 ВАЖЛИВО: Імпортуємо підключення до БД з утиліт
 from utils.db import supabase
+from utils.data import invalidate_project_data
 
 def show_admin_page():
     """
@@ -238,6 +239,7 @@ def show_admin_page():
                         if st.button("✅", key=f"yes_{p_id}"):
                             try:
                                 supabase.table("projects").delete().eq("id", p_id).execute()
+                                invalidate_project_data(p_id)
                                 st.success("Видалено!")
                                 time.sleep(0.5)
                                 st.rerun()
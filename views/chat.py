@@ -2,6 +2,7 @@ import requests
 import streamlit as st
 import time
 from utils.db import supabase # Імпортуємо підключення до БД
+from utils.jobs import enqueue_job, get_job
 
 def show_chat_page():
     """
@@ -197,56 +198,85 @@ def show_chat_page():
         st.session_state["chat_messages"].append({"role": "user", "content": prompt})
         st.rerun() # Оновлюємо, щоб показати повідомлення користувача одразу
 
-    # Логіка відповіді (спрацьовує після rerun, якщо останнє повідомлення - від user)
+    # Логіка відповіді (спрацьовує після rerun, якщо останнє повідомлення - від user).
+    # Запит до AI (до 4 хв) іде фоновою задачею, сторінка лише опитує її статус.
     if st.session_state["chat_messages"] and st.session_state["chat_messages"][-1]["role"] == "user":
         
-        last_user_msg = st.session_state["chat_messages"][-1]["content"]
-        
-        # Показуємо спінер над інпутом (або під карткою)
-        with st.spinner("AI Assistant is typing..."):
-            try:
-                # Payload
-                payload = {
-                    "query": last_user_msg,
-                    "user_id": user.id if user else "guest",
-                    "user_email": user.email if user else None,
-                    "user_name": user_name,
-                    "role": role,
-                    "project_id": proj.get("id"),
-                    "project_name": proj.get("brand_name"),
-                    "target_brand": proj.get("brand_name"),
-                    "domain": proj.get("domain"),
-                    "status": proj.get("status"),
-                    "official_sources": official_sources_list
-                }
-
-                response = requests.post(
-                    target_url, 
-                    json=payload, 
-                    headers=headers, 
-                    timeout=240
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    bot_reply = data.get("output") or data.get("answer") or data.get("text")
-                    
-                    if isinstance(bot_reply, dict):
-                        bot_reply = str(bot_reply)
-                    
-                    if not bot_reply:
-                        bot_reply = "⚠️ I received an empty response from the AI."
-                        
-                elif response.status_code == 403:
-                    bot_reply = "⛔ Error 403: Access denied. Check API keys."
-                elif response.status_code == 404:
-                    bot_reply = "⚠️ Error 404: Endpoint not found."
-                else:
-                    bot_reply = f"⚠️ Server Error: {response.status_code}"
-
-            except Exception as e:
-                bot_reply = f"⚠️ Connection Error: {e}"
-
-            # Додаємо відповідь бота в історію
-            st.session_state["chat_messages"].append({"role": "assistant", "content": bot_reply})
-            st.rerun()
+        if not st.session_state.get("chat_job_id"):
+            last_user_msg = st.session_state["chat_messages"][-1]["content"]
+
+            # Payload
+            payload = {
+                "query": last_user_msg,
+                "user_id": user.id if user else "guest",
+                "user_email": user.email if user else None,
+                "user_name": user_name,
+                "role": role,
+                "project_id": proj.get("id"),
+                "project_name": proj.get("brand_name"),
+                "target_brand": proj.get("brand_name"),
+                "domain": proj.get("domain"),
+                "status": proj.get("status"),
+                "official_sources": official_sources_list
+            }
+            st.session_state["chat_job_id"] = enqueue_job(
+                "chat", ask_assistant, target_url, headers, payload,
+                project_id=proj.get("id"), user_id=user.id if user else None, title="🤖 Чат"
+            )
+
+        render_chat_reply()
+
+
+@st.fragment(run_every=2)
+def render_chat_reply():
+    """Чекає на відповідь фонової задачі чату і додає її в історію."""
+    job = get_job(st.session_state.get("chat_job_id"))
+
+    if job and job["status"] in ("queued", "running"):
+        st.caption("⏳ AI Assistant is typing...")
+        return
+
+    if job and job["status"] == "done":
+        bot_reply = job["result"]
+    elif job:
+        bot_reply = f"⚠️ Connection Error: {job['error']}"
+    else:
+        bot_reply = "⚠️ Відповідь втрачено (сервер перезапущено). Надішліть питання ще раз."
+
+    # Додаємо відповідь бота в історію
+    st.session_state["chat_messages"].append({"role": "assistant", "content": bot_reply})
+    st.session_state["chat_job_id"] = None
+    st.rerun()
+
+
+def ask_assistant(target_url, headers, payload):
+    """Запит до n8n чат-бота. Виконується у фоновій задачі (utils/jobs.py)."""
+    try:
+        response = requests.post(
+            target_url, 
+            json=payload, 
+            headers=headers, 
+            timeout=240
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            bot_reply = data.get("output") or data.get("answer") or data.get("text")
+            
+            if isinstance(bot_reply, dict):
+                bot_reply = str(bot_reply)
+            
+            if not bot_reply:
+                bot_reply = "⚠️ I received an empty response from the AI."
+                
+        elif response.status_code == 403:
+            bot_reply = "⛔ Error 403: Access denied. Check API keys."
+        elif response.status_code == 404:
+            bot_reply = "⚠️ Error 404: Endpoint not found."
+        else:
+            bot_reply = f"⚠️ Server Error: {response.status_code}"
+
+    except Exception as e:
+        bot_reply = f"⚠️ Connection Error: {e}"
+
+    return bot_reply
@@ -1,9 +1,13 @@
+import math
+
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 
-# 🔥 Імпорт підключення до БД (важливо!)
+# 🔥 Спільний шар даних (кеш замість прямих запитів до БД)
 from utils.db import supabase
+from utils.data import load_project_data, load_competitor_summary, invalidate_project_data
+from utils.providers import DISPATCH_MODELS
 
 def show_competitors_page():
     """
@@ -19,12 +23,6 @@ def show_competitors_page():
     
     OFFICIAL_BRAND_NAME = proj.get("brand_name", "My Brand")
 
-    MODEL_MAPPING = {
-        "Perplexity": "perplexity",
-        "OpenAI GPT": "gpt-4o",
-        "Google Gemini": "gemini-1.5-pro"
-    }
-
     # --- Ініціалізація станів пагінації ---
     if 'cp_page_list' not in st.session_state: st.session_state.cp_page_list = 1
     if 'cp_page_freq' not in st.session_state: st.session_state.cp_page_freq = 1
@@ -41,39 +39,25 @@ def show_competitors_page():
 
     # --- 1. ЗАВАНТАЖЕННЯ ДАНИХ ---
     try:
-        # Отримуємо результати сканування для проекту
-        scans_resp = supabase.table("scan_results")\
-            .select("id, provider, keyword_id, created_at")\
-            .eq("project_id", proj["id"])\
-            .execute()
-        
-        if not scans_resp.data:
+        # Спільний кеш даних проекту (utils/data.py)
+        data = load_project_data(proj["id"])
+        df_scans = data["scans"]
+
+        if df_scans.empty:
             st.info("Даних немає. Запустіть сканування.")
             return
-            
-        df_scans = pd.DataFrame(scans_resp.data)
-        
-        # Отримуємо слова для мапінгу
-        kw_resp = supabase.table("keywords").select("id, keyword_text").eq("project_id", proj["id"]).execute()
-        kw_map = {k['id']: k['keyword_text'] for k in kw_resp.data}
-        df_scans['keyword_text'] = df_scans['keyword_id'].map(kw_map)
 
-        scan_ids = df_scans['id'].tolist()
-        
-        # Завантажуємо згадки
-        mentions_resp = supabase.table("brand_mentions")\
-            .select("*")\
-            .in_("scan_result_id", scan_ids)\
-            .execute()
-        
-        if not mentions_resp.data:
+        if data["mentions"].empty:
             st.info("Брендів не знайдено.")
             return
 
-        df_mentions = pd.DataFrame(mentions_resp.data)
-        
-        # Об'єднуємо таблиці
-        df_full = pd.merge(df_mentions, df_scans, left_on='scan_result_id', right_on='id', how='left')
+        # Запити, по яких є згадки брендів (текст -> ID; однаковий текст може мати кілька ID)
+        kw_map = dict(zip(data["keywords"]["id"], data["keywords"]["keyword_text"]))
+        scans_with_mentions = df_scans[df_scans["id"].isin(data["mentions"]["scan_result_id"].unique())]
+        kw_ids_by_text = {}
+        for kw_id in scans_with_mentions["keyword_id"].unique():
+            if kw_map.get(kw_id) is not None:
+                kw_ids_by_text.setdefault(kw_map[kw_id], []).append(kw_id)
 
     except Exception as e:
         st.error(f"Помилка обробки даних: {e}")
@@ -83,76 +67,53 @@ def show_competitors_page():
     with st.container(border=True):
         c1, c2 = st.columns(2)
         with c1:
-            all_models = list(MODEL_MAPPING.keys())
+            all_models = list(DISPATCH_MODELS)
             sel_models = st.multiselect("🤖 Фільтр по LLM:", all_models, default=all_models)
-            sel_tech_models = [MODEL_MAPPING[m] for m in sel_models]
 
         with c2:
-            all_kws = df_full['keyword_text'].dropna().unique().tolist()
+            all_kws = list(kw_ids_by_text)
             sel_kws = st.multiselect("🔎 Фільтр по Запитах:", all_kws, default=all_kws)
 
-    # Застосування фільтрів
-    if sel_tech_models:
-        mask_model = df_full['provider'].apply(lambda x: any(t in str(x) for t in sel_tech_models))
-    else:
-        mask_model = df_full['provider'].apply(lambda x: False)
-
-    if sel_kws:
-        mask_kw = df_full['keyword_text'].isin(sel_kws)
-    else:
-        mask_kw = df_full['keyword_text'].apply(lambda x: False)
+    # --- СИНОНІМИ БРЕНДІВ ---
+    with st.expander("🏷️ Синоніми брендів", expanded=False):
+        st.caption("Різні написання одного бренду (напр. 'rozetka.ua' → 'Rozetka'). Регістр, пунктуація та домен (.ua, .com) враховуються автоматично.")
+        aliases_df = data["aliases"][["alias", "canonical_name"]].reset_index(drop=True)
+        edited_aliases = st.data_editor(
+            aliases_df, num_rows="dynamic", use_container_width=True, key="brand_aliases_editor",
+            column_config={
+                "alias": st.column_config.TextColumn("Написання"),
+                "canonical_name": st.column_config.TextColumn("Канонічна назва"),
+            }
+        )
+        if st.button("💾 Зберегти синоніми", key="save_brand_aliases"):
+            old_pairs = {(str(a).strip(), str(c).strip()) for a, c in aliases_df.itertuples(index=False)}
+            new_pairs = {
+                (str(a).strip(), str(c).strip()) for a, c in edited_aliases.itertuples(index=False)
+                if pd.notna(a) and pd.notna(c) and str(a).strip() and str(c).strip()
+            }
+            try:
+                for alias, canonical in old_pairs - new_pairs:
+                    supabase.table("brand_aliases").delete().eq("project_id", proj["id"]).eq("alias", alias).eq("canonical_name", canonical).execute()
+                added = new_pairs - old_pairs
+                if added:
+                    supabase.table("brand_aliases").insert([
+                        {"project_id": proj["id"], "alias": alias, "canonical_name": canonical} for alias, canonical in added
+                    ]).execute()
+                invalidate_project_data(proj["id"])
+                st.success("Збережено!")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Помилка збереження: {e}")
 
-    df_filtered = df_full[mask_model & mask_kw].copy()
+    # --- 3. АГРЕГАЦІЯ ---
+    # Один векторизований прохід, кеш на комбінацію фільтрів (пагінація вкладок не перераховує)
+    sel_kw_ids = None if len(sel_kws) == len(all_kws) else [i for kw in sel_kws for i in kw_ids_by_text[kw]]
+    stats = load_competitor_summary(proj["id"], OFFICIAL_BRAND_NAME, sel_models, sel_kw_ids)
 
-    if df_filtered.empty:
+    if stats.empty:
         st.warning("За обраними фільтрами даних немає.")
         return
 
-    # --- 3. АГРЕГАЦІЯ ---
-    # Уніфікація назви нашого бренду
-    mask_target = df_filtered['is_my_brand'] == True
-    if mask_target.any():
-        df_filtered.loc[mask_target, 'brand_name'] = OFFICIAL_BRAND_NAME
-
-    # Числова оцінка тональності для середнього
-    def sentiment_to_score(s):
-        if s == 'Позитивна': return 100
-        if s == 'Негативна': return 0
-        return 50
-    
-    df_filtered['sent_score_num'] = df_filtered['sentiment_score'].apply(sentiment_to_score)
-
-    # Основна статистика по брендах
-    stats = df_filtered.groupby('brand_name').agg(
-        Mentions=('id_x', 'count'), # id_x - це id згадки
-        Avg_Rank=('rank_position', 'mean'),
-        Avg_Sentiment_Num=('sent_score_num', 'mean'),
-        Is_My_Brand=('is_my_brand', 'max')
-    ).reset_index()
-
-    # Детальна тональність (Pivot)
-    sent_counts = df_filtered.groupby(['brand_name', 'sentiment_score']).size().unstack(fill_value=0)
-    for col in ['Негативна', 'Нейтральна', 'Позитивна']:
-        if col not in sent_counts.columns: sent_counts[col] = 0
-            
-    sent_counts['Total'] = sent_counts.sum(axis=1)
-    
-    # Відсотки
-    import math # Для floor/ceil якщо треба, тут int
-    sent_counts['Neg_Pct'] = (sent_counts['Негативна'] / sent_counts['Total'] * 100).fillna(0).astype(int)
-    sent_counts['Neu_Pct'] = (sent_counts['Нейтральна'] / sent_counts['Total'] * 100).fillna(0).astype(int)
-    sent_counts['Pos_Pct'] = (sent_counts['Позитивна'] / sent_counts['Total'] * 100).fillna(0).astype(int)
-
-    # Строка для таблиці
-    sent_counts['Тональність_Str'] = sent_counts.apply(
-        lambda x: f"🔴 {x['Neg_Pct']}%   ⚪ {x['Neu_Pct']}%   🟢 {x['Pos_Pct']}%", axis=1
-    )
-
-    # Зливаємо все разом
-    stats = stats.merge(sent_counts[['Тональність_Str', 'Neg_Pct', 'Neu_Pct', 'Pos_Pct']], on='brand_name', how='left')
-    stats['Тональність_Str'] = stats['Тональність_Str'].fillna("🔴 0% ⚪ 0% 🟢 0%")
-    stats[['Neg_Pct', 'Neu_Pct', 'Pos_Pct']] = stats[['Neg_Pct', 'Neu_Pct', 'Pos_Pct']].fillna(0)
-
     # --- ЛОГІКА TOP-N (Helper Function) ---
     def set_top_n_flag(df, sort_col, n=15, ascending=False):
         """
@@ -225,7 +186,7 @@ def show_competitors_page():
                 return ['background-color: #d4edda; color: #155724; font-weight: bold'] * len(row)
             return [''] * len(row)
 
-        cols_to_show = ['brand_name', 'Mentions', 'Сер. Позиція', 'Тональність_Str']
+        cols_to_show = ['brand_name', 'Mentions', 'Сер. Позиція', 'Тональність_Str', 'Presence_Pct']
         
         styled_df = df_page[cols_to_show].style.apply(highlight_target_row, axis=1)
 
@@ -238,7 +199,8 @@ def show_competitors_page():
                 "brand_name": "Бренд",
                 "Mentions": st.column_config.ProgressColumn("Згадок", format="%d", min_value=0, max_value=int(stats['Mentions'].max())),
                 "Сер. Позиція": st.column_config.TextColumn("Сер. Позиція", width="small"),
-                "Тональність_Str": st.column_config.TextColumn("Тональність", width="medium")
+                "Тональність_Str": st.column_config.TextColumn("Тональність", width="medium"),
+                "Presence_Pct": st.column_config.NumberColumn("Присутність", format="%.0f%%", help="Частка сканувань, у яких згадано бренд")
             }
         )
 
@@ -259,9 +221,6 @@ def show_competitors_page():
         with c_rows: rows_freq = st.selectbox("Рядків", [20, 50, 100, 200], key="r_freq", on_change=reset_p_freq)
         
         df_for_freq = stats.copy()
-        df_for_freq['Display_Name'] = df_for_freq.apply(
-            lambda x: f"🟢 {x['brand_name']}" if x['brand_name'] == OFFICIAL_BRAND_NAME else x['brand_name'], axis=1
-        )
         # Топ-15
         df_for_freq = set_top_n_flag(df_for_freq, 'Mentions', n=15, ascending=False)
         
@@ -338,9 +297,6 @@ def show_competitors_page():
         with c_rows: rows_sent = st.selectbox("Рядків", [20, 50, 100, 200], key="r_sent", on_change=reset_p_sent)
         
         df_for_sent = stats.copy()
-        df_for_sent['Display_Name'] = df_for_sent.apply(
-            lambda x: f"🟢 {x['brand_name']}" if x['brand_name'] == OFFICIAL_BRAND_NAME else x['brand_name'], axis=1
-        )
         df_for_sent = set_top_n_flag(df_for_sent, 'Mentions', n=15, ascending=False)
 
         if search_sent:
@@ -450,9 +406,6 @@ def show_competitors_page():
 
         with col_table:
             df_for_rank = stats.copy()
-            df_for_rank['Display_Name'] = df_for_rank.apply(
-                lambda x: f"🟢 {x['brand_name']}" if x['brand_name'] == OFFICIAL_BRAND_NAME else x['brand_name'], axis=1
-            )
             df_for_rank = set_top_n_flag(df_for_rank, 'Avg_Rank', n=10, ascending=True)
 
             if search_rank:
@@ -5,15 +5,18 @@ import pytz
 import math
 
 # 🔥 Імпорт підключення до БД (замість globals)
-from utils.db import supabase
+from utils.db import supabase, fetch_tables_in_chunks
+from utils.data import load_project_data, load_providers, fetch_scan_page, count_scans, SCAN_COLUMNS
+from utils.providers import provider_label, provider_labels, providers_matching
 
 def show_history_page():
     """
     Сторінка історії сканувань.
-    ВЕРСІЯ: MODULAR + PROFILES MAPPING.
+    ВЕРСІЯ: MODULAR + PROFILES MAPPING + KEYSET PAGINATION.
     1. Бере user_email з scan_results.
     2. Шукає власника в таблиці 'profiles'.
     3. Формує ПІБ (first_name + last_name).
+    4. Хронологічні сортування читають з БД лише поточну сторінку (курсор created_at, id).
     """
 
     # Налаштування часового поясу
@@ -34,160 +37,41 @@ def show_history_page():
 
     st.title("📜 Історія сканувань")
 
-    # --- 2. ОТРИМАННЯ ДАНИХ ---
-    with st.spinner("Завантаження історії..."):
-        try:
-            # 1. Keywords
-            kw_resp = supabase.table("keywords").select("id, keyword_text").eq("project_id", proj["id"]).execute()
-            kw_map = {k['id']: k['keyword_text'] for k in kw_resp.data} if kw_resp.data else {}
+    CHRONO_SORTS = {"Найновіші": False, "Найстаріші": True}
 
-            # 2. Scans (Беремо user_email)
-            scans_resp = supabase.table("scan_results")\
-                .select("id, created_at, provider, keyword_id, user_email")\
-                .eq("project_id", proj["id"])\
-                .order("created_at", desc=True)\
-                .limit(1000)\
-                .execute()
-            
-            scans_data = scans_resp.data if scans_resp.data else []
-            
-            if not scans_data:
-                st.info("Історія сканувань порожня.")
-                return
-
-            scan_ids = [s['id'] for s in scans_data]
-
-            # 🔥 3. ОТРИМАННЯ ПІБ З ТАБЛИЦІ PROFILES
-            unique_emails = list(set([s['user_email'] for s in scans_data if s.get('user_email')]))
-            email_to_name_map = {}
-
-            if unique_emails:
-                try:
-                    # ⚠️ Змінено таблицю на 'profiles'
-                    p_resp = supabase.table("profiles")\
-                        .select("email, first_name, last_name")\
-                        .in_("email", unique_emails)\
-                        .execute()
-                    
-                    if p_resp.data:
-                        for p in p_resp.data:
-                            f_n = p.get('first_name', '') or ''
-                            l_n = p.get('last_name', '') or ''
-                            full_n = f"{f_n} {l_n}".strip()
-                            
-                            # Якщо ім'я знайдене, записуємо його в мапу
-                            if full_n and p.get('email'):
-                                email_to_name_map[p['email']] = full_n
-                except Exception:
-                    # Якщо таблиці profiles немає або помилка доступу
-                    pass
-
-            # 4. Mentions
-            # Розбиваємо на чанки, якщо ID дуже багато
-            chunk_size = 200
-            all_mentions = []
-            all_sources = []
-            
-            for i in range(0, len(scan_ids), chunk_size):
-                chunk = scan_ids[i:i + chunk_size]
-                m_resp = supabase.table("brand_mentions").select("scan_result_id, is_my_brand, mention_count").in_("scan_result_id", chunk).execute()
-                if m_resp.data: all_mentions.extend(m_resp.data)
-                
-                s_resp = supabase.table("extracted_sources").select("scan_result_id, is_official").in_("scan_result_id", chunk).execute()
-                if s_resp.data: all_sources.extend(s_resp.data)
-
-            mentions_df = pd.DataFrame(all_mentions)
-            sources_df = pd.DataFrame(all_sources)
-
-        except Exception as e:
-            if "column scan_results.user_email does not exist" in str(e):
-                st.error("⚠️ Відсутня колонка `user_email` у таблиці scan_results.")
-            else:
-                st.error(f"Помилка завантаження даних: {e}")
-            return
+    # --- 2. ФІЛЬТРИ ---
+    st.markdown("### 🔍 Фільтрація")
 
-    # --- 3. ОБРОБКА ДАНИХ ---
-    df_scans = pd.DataFrame(scans_data)
+    now_kyiv = datetime.now(KYIV_TZ).date()
 
-    # 🔥 ЛОГІКА ІНІЦІАТОРА
-    def resolve_initiator(email_val):
-        # 1. Якщо емейл пустий -> Авто
-        if pd.isna(email_val) or str(email_val).strip() == "" or str(email_val).lower() == "none":
-            return "🤖 Автосканування"
-        
-        # 2. Якщо ми знайшли ім'я у profiles -> Виводимо ПІБ
-        if email_val in email_to_name_map:
-            return f"👤 {email_to_name_map[email_val]}"
-        
-        # 3. Якщо імені не знайшли (профіль не заповнений) -> Виводимо Email
-        return f"👤 {email_val}"
-    
-    # Застосовуємо, якщо колонка є
-    if 'user_email' in df_scans.columns:
-        df_scans['initiator'] = df_scans['user_email'].apply(resolve_initiator)
-    else:
-        df_scans['initiator'] = "🤖 Автосканування"
+    try:
+        # Найстаріший скан — лише для меж календаря
+        first_resp = supabase.table("scan_results")\
+            .select("created_at")\
+            .eq("project_id", proj["id"])\
+            .order("created_at")\
+            .limit(1)\
+            .execute()
+    except Exception as e:
+        st.error(f"Помилка завантаження даних: {e}")
+        return
 
-    # Провайдери
-    PROVIDER_MAP = {"gpt-4o": "OpenAI", "gpt-4-turbo": "OpenAI", "gemini-1.5-pro": "Gemini", "perplexity": "Perplexity"}
-    df_scans['provider'] = df_scans['provider'].replace(PROVIDER_MAP)
-    
-    # Ключові слова
-    df_scans['keyword'] = df_scans['keyword_id'].map(kw_map).fillna("Видалений запит")
-    
-    # Timezone Fix
-    df_scans['created_at_dt'] = pd.to_datetime(df_scans['created_at'])
-    if df_scans['created_at_dt'].dt.tz is None:
-        df_scans['created_at_dt'] = df_scans['created_at_dt'].dt.tz_localize('UTC')
-    df_scans['created_at_dt'] = df_scans['created_at_dt'].dt.tz_convert(KYIV_TZ)
-    
-    # Merge (Безпечне злиття)
-    if not mentions_df.empty:
-        brands_count = mentions_df.groupby('scan_result_id').size().reset_index(name='total_brands')
-        my_mentions = mentions_df[mentions_df['is_my_brand'] == True].groupby('scan_result_id')['mention_count'].sum().reset_index(name='my_mentions_count')
-        
-        df_scans = df_scans.merge(brands_count, left_on='id', right_on='scan_result_id', how='left')
-        if 'scan_result_id' in df_scans.columns: df_scans = df_scans.drop(columns=['scan_result_id'])
-        
-        df_scans = df_scans.merge(my_mentions, left_on='id', right_on='scan_result_id', how='left')
-        if 'scan_result_id' in df_scans.columns: df_scans = df_scans.drop(columns=['scan_result_id'])
-    else:
-        df_scans['total_brands'] = 0
-        df_scans['my_mentions_count'] = 0
+    if not first_resp.data:
+        st.info("Історія сканувань порожня.")
+        return
 
-    if not sources_df.empty:
-        links_count = sources_df.groupby('scan_result_id').size().reset_index(name='total_links')
-        off_count = sources_df[sources_df['is_official'] == True].groupby('scan_result_id').size().reset_index(name='official_links')
-        
-        df_scans = df_scans.merge(links_count, left_on='id', right_on='scan_result_id', how='left')
-        if 'scan_result_id' in df_scans.columns: df_scans = df_scans.drop(columns=['scan_result_id'])
-        
-        df_scans = df_scans.merge(off_count, left_on='id', right_on='scan_result_id', how='left')
-        if 'scan_result_id' in df_scans.columns: df_scans = df_scans.drop(columns=['scan_result_id'])
-    else:
-        df_scans['total_links'] = 0
-        df_scans['official_links'] = 0
+    min_date_avail = pd.to_datetime(first_resp.data[0]['created_at'], utc=True).tz_convert(KYIV_TZ).date()
+    max_date_avail = now_kyiv + timedelta(days=1)
 
-    df_scans = df_scans.fillna(0)
+    c1, c2, c3, c4 = st.columns([1, 1.2, 1, 0.8])
 
-    # --- 4. ФІЛЬТРИ ---
-    st.markdown("### 🔍 Фільтрація")
-    
-    now_kyiv = datetime.now(KYIV_TZ).date()
-    
-    if not df_scans.empty:
-        min_date_avail = df_scans['created_at_dt'].min().date()
-        max_date_avail = max(df_scans['created_at_dt'].max().date(), now_kyiv) + timedelta(days=1)
-    else:
-        min_date_avail = now_kyiv
-        max_date_avail = now_kyiv + timedelta(days=1)
+    # Сирі назви моделей проекту (gpt-4o, gpt-4o-2024-08-06 ...) та їхні UI-назви
+    project_providers = load_providers(proj["id"])
 
-    c1, c2, c3, c4 = st.columns([1, 1.2, 1, 0.8])
-    
     with c1:
-        all_providers = df_scans['provider'].unique().tolist()
+        all_providers = list(dict.fromkeys(provider_label(p) for p in project_providers))
         sel_providers = st.multiselect("Модель", all_providers, default=all_providers, on_change=reset_page)
-    
+
     with c2:
         default_start = now_kyiv - timedelta(days=30)
         sel_dates = st.date_input(
@@ -196,7 +80,7 @@ def show_history_page():
             min_value=min_date_avail - timedelta(days=365),
             max_value=max_date_avail
         )
-        
+
     with c3:
         sort_opts = ["Найновіші", "Найстаріші", "Більше згадок", "Офіц. джерела"]
         sel_sort = st.selectbox("Сортування", sort_opts, on_change=reset_page)
@@ -204,37 +88,169 @@ def show_history_page():
     with c4:
         rows_per_page = st.selectbox("Рядків на стор.", [10, 20, 50, 100, 200], index=0, on_change=reset_page)
 
-    # --- ЗАСТОСУВАННЯ ФІЛЬТРІВ ---
-    mask = df_scans['provider'].isin(sel_providers)
-    
+    # Межі періоду (дні за Києвом) -> UTC для запиту
+    start_d = end_d = None
     if isinstance(sel_dates, tuple):
         if len(sel_dates) == 2:
             start_d, end_d = sel_dates
-            mask &= (df_scans['created_at_dt'].dt.date >= start_d)
-            mask &= (df_scans['created_at_dt'].dt.date <= end_d)
         elif len(sel_dates) == 1:
-            mask &= (df_scans['created_at_dt'].dt.date == sel_dates[0])
-        
-    df_filtered = df_scans[mask].copy()
+            start_d = end_d = sel_dates[0]
+
+    def kyiv_day_start(d):
+        return KYIV_TZ.localize(datetime.combine(d, datetime.min.time())).astimezone(pytz.utc).isoformat()
+
+    # Сирі назви моделей для вибраних (OpenAI GPT -> gpt-4o, gpt-4-turbo, gpt-4o-2024-08-06 ...)
+    raw_providers = providers_matching(project_providers, sel_providers)
+    scan_filters = {
+        "providers": raw_providers,
+        "start": kyiv_day_start(start_d) if start_d else None,
+        "end": kyiv_day_start(end_d + timedelta(days=1)) if end_d else None,
+    }
+
+    # Курсори keyset-пагінації: cursors[i] — початок сторінки i+1. Скидаються при зміні фільтрів.
+    filter_sig = (tuple(raw_providers), scan_filters["start"], scan_filters["end"], sel_sort, rows_per_page)
+    if st.session_state.get("history_cursor_sig") != filter_sig:
+        st.session_state.history_cursor_sig = filter_sig
+        st.session_state.history_cursors = [None]
+        st.session_state.history_page_number = 1
 
-    # Сортування
-    if sel_sort == "Найновіші": df_filtered = df_filtered.sort_values('created_at_dt', ascending=False)
-    elif sel_sort == "Найстаріші": df_filtered = df_filtered.sort_values('created_at_dt', ascending=True)
-    elif sel_sort == "Більше згадок": df_filtered = df_filtered.sort_values('my_mentions_count', ascending=False)
-    elif sel_sort == "Офіц. джерела": df_filtered = df_filtered.sort_values('official_links', ascending=False)
+    # --- 3. ОТРИМАННЯ ДАНИХ (лише поточна сторінка) ---
+    with st.spinner("Завантаження історії..."):
+        try:
+            kw_resp = supabase.table("keywords").select("id, keyword_text").eq("project_id", proj["id"]).execute()
+            kw_map = {k['id']: k['keyword_text'] for k in kw_resp.data} if kw_resp.data else {}
+
+            if sel_sort in CHRONO_SORTS:
+                # Хронологічне сортування: сторінка прямо з БД по курсору (created_at, id)
+                total_rows = count_scans(proj["id"], **scan_filters)
+                total_pages = math.ceil(total_rows / rows_per_page)
+                if st.session_state.history_page_number > max(1, total_pages):
+                    st.session_state.history_page_number = max(1, total_pages)
+
+                cursors = st.session_state.history_cursors
+                page_idx = min(st.session_state.history_page_number, len(cursors)) - 1
+                st.session_state.history_page_number = page_idx + 1
+
+                page_rows, next_cursor = fetch_scan_page(
+                    proj["id"], cursor=cursors[page_idx], page_size=rows_per_page,
+                    ascending=CHRONO_SORTS[sel_sort], **scan_filters
+                )
+                if next_cursor and len(cursors) == page_idx + 1:
+                    cursors.append(next_cursor)
+
+                page_ids = [r['id'] for r in page_rows]
+                rows = fetch_tables_in_chunks(
+                    {"brand_mentions": "id, scan_result_id, is_my_brand, mention_count",
+                     "extracted_sources": "id, scan_result_id, is_official"},
+                    "scan_result_id", page_ids
+                )
+                df_scans = pd.DataFrame(page_rows, columns=SCAN_COLUMNS) if page_rows else pd.DataFrame(columns=SCAN_COLUMNS)
+                mentions_df = pd.DataFrame(rows["brand_mentions"], columns=["scan_result_id", "is_my_brand", "mention_count"])
+                sources_df = pd.DataFrame(rows["extracted_sources"], columns=["scan_result_id", "is_official"])
+            else:
+                # Сортування за метриками потребує всіх сканів — беремо спільний кеш проекту
+                data = load_project_data(proj["id"])
+                df_scans = data["scans"]
+                df_scans = df_scans[df_scans['provider'].isin(raw_providers)]
+                if scan_filters["start"]:
+                    df_scans = df_scans[df_scans['created_at'] >= pd.Timestamp(scan_filters["start"])]
+                if scan_filters["end"]:
+                    df_scans = df_scans[df_scans['created_at'] < pd.Timestamp(scan_filters["end"])]
+                mentions_df = data["mentions"][["scan_result_id", "is_my_brand", "mention_count"]]
+                sources_df = data["sources"][["scan_result_id", "is_official"]]
+
+        except Exception as e:
+            st.error(f"Помилка завантаження даних: {e}")
+            return
+
+    # --- 4. ОБРОБКА ДАНИХ ---
+    df_scans = df_scans.copy()
+    df_scans['provider'] = provider_labels(df_scans['provider'])
+
+    # Ключові слова
+    df_scans['keyword'] = df_scans['keyword_id'].map(kw_map).fillna("Видалений запит")
+
+    # Timezone Fix
+    df_scans['created_at_dt'] = pd.to_datetime(df_scans['created_at'], utc=True).dt.tz_convert(KYIV_TZ)
+
+    # Merge (Безпечне злиття)
+    if not mentions_df.empty:
+        brands_count = mentions_df.groupby('scan_result_id').size().rename('total_brands')
+        my_mentions = mentions_df[mentions_df['is_my_brand'] == True].groupby('scan_result_id')['mention_count'].sum().rename('my_mentions_count')
+        df_scans = df_scans.merge(brands_count, left_on='id', right_index=True, how='left')
+        df_scans = df_scans.merge(my_mentions, left_on='id', right_index=True, how='left')
+    else:
+        df_scans['total_brands'] = 0
+        df_scans['my_mentions_count'] = 0
+
+    if not sources_df.empty:
+        links_count = sources_df.groupby('scan_result_id').size().rename('total_links')
+        off_count = sources_df[sources_df['is_official'] == True].groupby('scan_result_id').size().rename('official_links')
+        df_scans = df_scans.merge(links_count, left_on='id', right_index=True, how='left')
+        df_scans = df_scans.merge(off_count, left_on='id', right_index=True, how='left')
+    else:
+        df_scans['total_links'] = 0
+        df_scans['official_links'] = 0
+
+    num_cols = ['total_brands', 'my_mentions_count', 'total_links', 'official_links']
+    df_scans[num_cols] = df_scans[num_cols].fillna(0)
 
     # --- 5. ПАГІНАЦІЯ ---
-    total_rows = len(df_filtered)
-    total_pages = math.ceil(total_rows / rows_per_page)
-    
-    if st.session_state.history_page_number > total_pages:
-        st.session_state.history_page_number = max(1, total_pages)
-    
+    if sel_sort in CHRONO_SORTS:
+        df_display_page = df_scans
+    else:
+        sort_col = 'my_mentions_count' if sel_sort == "Більше згадок" else 'official_links'
+        df_filtered = df_scans.sort_values(sort_col, ascending=False)
+
+        total_rows = len(df_filtered)
+        total_pages = math.ceil(total_rows / rows_per_page)
+        if st.session_state.history_page_number > total_pages:
+            st.session_state.history_page_number = max(1, total_pages)
+
+        start_idx = (st.session_state.history_page_number - 1) * rows_per_page
+        df_display_page = df_filtered.iloc[start_idx:start_idx + rows_per_page].copy()
+
     current_page = st.session_state.history_page_number
-    start_idx = (current_page - 1) * rows_per_page
-    end_idx = start_idx + rows_per_page
-    
-    df_display_page = df_filtered.iloc[start_idx:end_idx].copy()
+
+    # 🔥 ПІБ З ТАБЛИЦІ PROFILES (лише для рядків сторінки)
+    unique_emails = [e for e in df_display_page['user_email'].dropna().unique().tolist() if str(e).strip()]
+    email_to_name_map = {}
+
+    if unique_emails:
+        try:
+            # ⚠️ Змінено таблицю на 'profiles'
+            p_resp = supabase.table("profiles")\
+                .select("email, first_name, last_name")\
+                .in_("email", unique_emails)\
+                .execute()
+
+            if p_resp.data:
+                for p in p_resp.data:
+                    f_n = p.get('first_name', '') or ''
+                    l_n = p.get('last_name', '') or ''
+                    full_n = f"{f_n} {l_n}".strip()
+
+                    # Якщо ім'я знайдене, записуємо його в мапу
+                    if full_n and p.get('email'):
+                        email_to_name_map[p['email']] = full_n
+        except Exception:
+            # Якщо таблиці profiles немає або помилка доступу
+            pass
+
+    # 🔥 ЛОГІКА ІНІЦІАТОРА
+    def resolve_initiator(email_val):
+        # 1. Якщо емейл пустий -> Авто
+        if pd.isna(email_val) or str(email_val).strip() == "" or str(email_val).lower() == "none":
+            return "🤖 Автосканування"
+
+        # 2. Якщо ми знайшли ім'я у profiles -> Виводимо ПІБ
+        if email_val in email_to_name_map:
+            return f"👤 {email_to_name_map[email_val]}"
+
+        # 3. Якщо імені не знайшли (профіль не заповнений) -> Виводимо Email
+        return f"👤 {email_val}"
+
+    df_display_page['initiator'] = df_display_page['user_email'].apply(resolve_initiator)
 
     # --- 6. ВІДОБРАЖЕННЯ (AUTO HEIGHT) ---
     st.divider()
@@ -9,35 +9,21 @@ import re
 import uuid
 
 # 🔥 Імпорт залежностей з утиліт
-from utils.db import supabase
-from utils.n8n import n8n_trigger_analysis
+from utils.db import supabase, fetch_in_chunks
+from utils.n8n import n8n_trigger_analysis, n8n_dispatch_batch
+from utils.data import invalidate_project_data, mark_project_stale, get_scan_response, load_last_scans, REFRESH_OVERLAP
+from utils.transforms import brand_target_mask, normalize_sentiment
+from utils.importer import import_keywords, iter_file_keywords, iter_url_keywords
+from utils.urls import enrich_sources
+from utils.providers import DISPATCH_MODELS, provider_label, provider_labels
+from utils.scheduler import FREQUENCY_UI, DEFAULT_FREQUENCY, DEFAULT_AUTO_MODELS, reload_schedule, project_schedule
 
 # --- CONSTANTS & HELPERS ---
-MODEL_CONFIG = {
-    "Perplexity": "perplexity",
-    "OpenAI GPT": "gpt-4o",
-    "Google Gemini": "gemini-1.5-pro"
-}
-ALL_MODELS_UI = list(MODEL_CONFIG.keys())
-
-def get_ui_model_name(db_name):
-    for ui, db in MODEL_CONFIG.items():
-        if db == db_name: return ui
-    lower = str(db_name).lower()
-    if "perplexity" in lower: return "Perplexity"
-    if "gpt" in lower or "openai" in lower: return "OpenAI GPT"
-    if "gemini" in lower or "google" in lower: return "Google Gemini"
-    return db_name 
+ALL_MODELS_UI = list(DISPATCH_MODELS)
 
 def tooltip(text):
     return f'<span title="{text}" style="cursor:help; font-size:14px; color:#333; margin-left:4px;">ℹ️</span>'
 
-def normalize_url(u):
-    u = str(u).strip()
-    u = re.split(r'[)\]]', u)[0] 
-    if not u.startswith(('http://', 'https://')): return f"https://{u}"
-    return u
-
 def format_llm_text(text):
     if not text: return "Текст відповіді відсутній."
     txt = str(text)
@@ -50,6 +36,75 @@ def safe_int(val):
     try: return int(float(val))
     except: return 0
 
+# Як часто список запитів оновлює дати останніх сканів
+KEYWORD_LIST_REFRESH_SECONDS = 10
+
+# Live-оновлення деталей запиту: дешева перевірка змін + експоненційна пауза
+LIVE_POLL_MIN_SECONDS = 5
+LIVE_POLL_MAX_SECONDS = 60
+
+def _probe_keyword_scans(kw_id):
+    """Версія даних запиту одним легким запитом: (час останнього скану, кількість сканів)."""
+    resp = supabase.table("scan_results")\
+        .select("created_at", count="exact")\
+        .eq("keyword_id", kw_id)\
+        .order("created_at", desc=True)\
+        .limit(1)\
+        .execute()
+    last = resp.data[0]["created_at"] if resp.data else None
+    return last, resp.count or 0
+
+def _recent_scan_ids(scans):
+    """Скани, молодші за REFRESH_OVERLAP: n8n ще може дописувати до них згадки та джерела."""
+    cutoff = pd.Timestamp.now(tz="UTC") - REFRESH_OVERLAP
+    return {s["id"] for s in scans if pd.to_datetime(s["created_at"], utc=True) >= cutoff}
+
+def _live_keyword_data(kw_id):
+    """
+    Скани та згадки запиту для live-фрагменту (кеш у session_state).
+    Повне перечитування — лише коли змінилась версія (_probe_keyword_scans).
+    Версія не бачить згадок, дописаних після скану, тому свіжі скани (_recent_scan_ids) перечитуються окремо.
+    Поки змін немає, перевірки рідшають: 5 -> 10 -> 20 ... -> 60 секунд.
+    """
+    key = f"kw_live_{kw_id}"
+    live = st.session_state.get(key)
+    now = time.monotonic()
+
+    if live is not None and now < live["next_probe"]:
+        return live
+
+    version = _probe_keyword_scans(kw_id)
+    if live is not None and version == live["version"]:
+        recent = _recent_scan_ids(live["scans"])
+        if recent:
+            # Згадки свіжих сканів — заново, їхні джерела — при наступному показі
+            fresh = fetch_in_chunks("brand_mentions", "scan_result_id", list(recent))
+            live["mentions"] = [m for m in live["mentions"] if m["scan_result_id"] not in recent] + fresh
+            for scan_id in recent:
+                live["sources"].pop(scan_id, None)
+            live["interval"] = LIVE_POLL_MIN_SECONDS
+        else:
+            live["interval"] = min(live["interval"] * 2, LIVE_POLL_MAX_SECONDS)
+        live["next_probe"] = now + live["interval"]
+        return live
+
+    scans_resp = supabase.table("scan_results").select("id, created_at, provider").eq("keyword_id", kw_id).order("created_at", desc=False).execute()
+    scans_data = scans_resp.data if scans_resp.data else []
+    scan_ids = [row["id"] for row in scans_data]
+    mentions_data = fetch_in_chunks("brand_mentions", "scan_result_id", scan_ids) if scan_ids else []
+
+    live = {
+        "version": version,
+        "scans": scans_data,
+        "mentions": mentions_data,
+        "sources": {},
+        "interval": LIVE_POLL_MIN_SECONDS,
+        "next_probe": now + LIVE_POLL_MIN_SECONDS,
+    }
+    st.session_state[key] = live
+    return live
+
+
 # ========================================================
 # 1. ДЕТАЛЬНА СТОРІНКА (Function Definition)
 # ========================================================
@@ -107,6 +162,7 @@ def show_keyword_details(kw_id):
                 if st.button("💾 Зберегти", key="save_kw_btn"):
                     if new_text and new_text != keyword_text:
                         supabase.table("keywords").update({"keyword_text": new_text}).eq("id", kw_id).execute()
+                        mark_project_stale(project_id)
                         st.success("Збережено!")
                     st.session_state[edit_key] = False
                     st.rerun()
@@ -132,6 +188,8 @@ def show_keyword_details(kw_id):
                         
                         n8n_trigger_analysis(project_id, [new_text], proj.get("brand_name"), models=selected_models_to_run)
                         st.success("Задачу відправлено!")
+                        # Нові скани очікуються — live-фрагмент одразу повертається до частих перевірок
+                        st.session_state.pop(f"kw_live_{kw_id}", None)
                         time.sleep(2)
                         st.session_state[confirm_run_key] = False
                         st.rerun()
@@ -141,11 +199,11 @@ def show_keyword_details(kw_id):
                         st.rerun()
 
     # Live Fragment
-    @st.fragment(run_every=5)
+    @st.fragment(run_every=LIVE_POLL_MIN_SECONDS)
     def render_live_analytics():
         try:
-            scans_resp = supabase.table("scan_results").select("id, created_at, provider, raw_response").eq("keyword_id", kw_id).order("created_at", desc=False).execute()
-            scans_data = scans_resp.data if scans_resp.data else []
+            live = _live_keyword_data(kw_id)
+            scans_data = live["scans"]
             df_scans = pd.DataFrame(scans_data)
             
             if not df_scans.empty:
@@ -157,7 +215,7 @@ def show_keyword_details(kw_id):
                 except: pass
                 
                 df_scans['date_str'] = df_scans['created_at'].dt.strftime('%Y-%m-%d %H:%M')
-                df_scans['provider_ui'] = df_scans['provider'].apply(get_ui_model_name)
+                df_scans['provider_ui'] = provider_labels(df_scans['provider'])
             else:
                 st.info("Даних ще немає.")
                 return
@@ -165,31 +223,13 @@ def show_keyword_details(kw_id):
             scan_ids = df_scans['scan_id'].tolist()
             if not scan_ids: return
 
-            mentions_resp = supabase.table("brand_mentions").select("*").in_("scan_result_id", scan_ids).execute()
-            mentions_data = mentions_resp.data if mentions_resp.data else []
-            df_mentions = pd.DataFrame(mentions_data)
+            df_mentions = pd.DataFrame(live["mentions"])
 
             # --- PREP MENTIONS ---
             if not df_mentions.empty:
-                 # Check Target
-                 target_norm = target_brand_name.lower().split(' ')[0] if target_brand_name else ""
-                 
-                 def check_target(row):
-                     is_db = str(row.get('is_my_brand','')).lower() in ['true', '1', 't', 'yes', 'on']
-                     b_clean = str(row.get('brand_name','')).lower().strip()
-                     is_match = (target_norm in b_clean) if target_norm else False
-                     return is_db or is_match
-                 
-                 df_mentions['is_real_target'] = df_mentions.apply(check_target, axis=1)
-                 
-                 # Sentiment
-                 def norm_sent(s):
-                     s = str(s).lower()
-                     if 'поз' in s or 'pos' in s: return 'Позитивна'
-                     if 'нег' in s or 'neg' in s: return 'Негативна'
-                     if 'ней' in s or 'neu' in s: return 'Нейтральна'
-                     return 'Не визначено'
-                 df_mentions['sentiment_score'] = df_mentions['sentiment_score'].apply(norm_sent)
+                 # Цільовий бренд та тональність (спільні правила, utils.transforms)
+                 df_mentions['is_real_target'] = brand_target_mask(df_mentions, target_brand_name)
+                 df_mentions['sentiment_score'] = normalize_sentiment(df_mentions['sentiment_score'])
 
             # --- RENDER TABS ---
             st.markdown("##### 📝 Детальний аналіз відповідей")
@@ -216,11 +256,11 @@ def show_keyword_details(kw_id):
                         st.write("")
                         if st.button("🗑️", key=f"del_s_{selected_scan_id}"):
                             supabase.table("scan_results").delete().eq("id", selected_scan_id).execute()
+                            invalidate_project_data(project_id)
+                            st.session_state.pop(f"kw_live_{kw_id}", None)
                             st.rerun()
 
                     # Data for selected scan
-                    current_scan_row = model_scans[model_scans['scan_id'] == selected_scan_id].iloc[0]
-                    
                     loc_mentions = pd.DataFrame()
                     if not df_mentions.empty:
                         loc_mentions = df_mentions[df_mentions['scan_result_id'] == selected_scan_id]
@@ -266,7 +306,8 @@ def show_keyword_details(kw_id):
                     """, unsafe_allow_html=True)
                     
                     # Text
-                    raw_t = format_llm_text(current_scan_row.get('raw_response', ''))
+                    # Текст відповіді — лише для обраного скану (LRU-кеш utils.data)
+                    raw_t = format_llm_text(get_scan_response(selected_scan_id))
                     st.markdown(f"""<div style="background:#f9fffb; border:1px solid #bbf7d0; border-radius:8px; padding:20px; margin-bottom:20px; color:#374151;">{raw_t}</div>""", unsafe_allow_html=True)
 
                     # Charts & Tables
@@ -283,10 +324,13 @@ def show_keyword_details(kw_id):
                     
                     # Sources
                     try:
-                        src_resp = supabase.table("extracted_sources").select("*").eq("scan_result_id", selected_scan_id).execute()
-                        if src_resp.data:
-                            df_s = pd.DataFrame(src_resp.data)
-                            df_s['url'] = df_s['url'].apply(normalize_url)
+                        # Джерела кешуються на час життя live-даних (для свіжих сканів кеш скидає _live_keyword_data)
+                        if selected_scan_id not in live["sources"]:
+                            src_resp = supabase.table("extracted_sources").select("*").eq("scan_result_id", selected_scan_id).execute()
+                            live["sources"][selected_scan_id] = src_resp.data or []
+                        if live["sources"][selected_scan_id]:
+                            df_s = pd.DataFrame(live["sources"][selected_scan_id])
+                            df_s['url'] = enrich_sources(df_s)['canonical_url']
                             st.markdown("**Джерела:**")
                             st.dataframe(df_s[['url', 'is_official']], use_container_width=True, hide_index=True)
                     except: pass
@@ -313,7 +357,6 @@ def show_keywords_page():
     # Styles
     st.markdown("""
     <style>
-        .green-number { background-color: #00C896; color: white; width: 28px; height: 28px; border-radius: 50%; display: flex; align-items: center; justify-content: center; font-weight: bold; font-size: 14px; margin-top: 5px; }
         button[kind="secondary"] { border: none; background: transparent; font-weight: 600; color: #31333F; box-shadow: none; }
         button[kind="secondary"]:hover { color: #00C896; }
     </style>
@@ -375,10 +418,9 @@ def show_keywords_page():
                     if kws:
                         try:
                             supabase.table("keywords").insert([{"project_id": proj["id"], "keyword_text": k, "is_active": True} for k in kws]).execute()
+                            mark_project_stale(proj["id"])
                             with st.spinner("Запуск..."):
-                                for k in kws:
-                                    n8n_trigger_analysis(proj["id"], [k], proj.get("brand_name"), models=sel_models)
-                                    time.sleep(0.5)
+                                n8n_dispatch_batch(proj["id"], kws, proj.get("brand_name"), models=sel_models)
                             st.success("Додано!"); time.sleep(1); st.rerun()
                         except Exception as e: st.error(f"Error: {e}")
 
@@ -392,25 +434,87 @@ def show_keywords_page():
                     lines = [l.strip() for l in txt.split('\n') if l.strip()]
                     if lines:
                          supabase.table("keywords").insert([{"project_id": proj["id"], "keyword_text": k, "is_active": True} for k in lines]).execute()
+                         mark_project_stale(proj["id"])
                          with st.spinner("Запуск..."):
-                             # Batch run optimization could go here, but loop is safer for now
-                             total = len(lines)
+                             # Пакетний запуск: паралельно, з повторами та прогресом
                              bar = st.progress(0)
-                             for i, k in enumerate(lines):
-                                 n8n_trigger_analysis(proj["id"], [k], proj.get("brand_name"), models=sel_m_p)
-                                 bar.progress((i+1)/total)
-                                 time.sleep(0.2)
-                         st.success("Готово!"); time.sleep(1); st.rerun()
-
-        # TAB: IMPORT (Simulated for brevity, logic same as before)
+                             results = n8n_dispatch_batch(
+                                 proj["id"], lines, proj.get("brand_name"), models=sel_m_p,
+                                 on_progress=lambda done, total: bar.progress(done / total)
+                             )
+                         ok_count = sum(1 for r in results if r["ok"])
+                         st.success(f"Готово! Запущено {ok_count} з {len(lines) * len(sel_m_p)}."); time.sleep(1); st.rerun()
+
+        # TAB: IMPORT (потоково: великі файли, дедуплікація, пакетний запис)
         with tab_import:
-            st.info("Підтримується .xlsx та Google Sheets.")
-            # ... Import logic identical to previous code ...
+            st.info("Підтримується .xlsx, .csv та Google Sheets. Колонка з запитами — 'keyword' / 'запит' або перша.")
+            imp_src = st.radio("Джерело:", ["Файл", "Посилання (URL)"], horizontal=True, key="kw_imp_src")
+            imp_file, imp_url = None, ""
+            if imp_src == "Файл":
+                imp_file = st.file_uploader("Оберіть файл", type=["xlsx", "csv"], key="kw_imp_file")
+            else:
+                imp_url = st.text_input("Посилання (Google Sheets / CSV / XLSX):", key="kw_imp_url")
+
+            if st.button("📥 Імпортувати", type="primary", key="btn_kw_import", disabled=not (imp_file or imp_url.strip())):
+                status = st.empty()
+
+                def show_import_progress(read, inserted):
+                    status.caption(f"Прочитано {read} рядків, додано {inserted}...")
+
+                try:
+                    values = iter_file_keywords(imp_file) if imp_file else iter_url_keywords(imp_url)
+                    with st.spinner("Імпорт..."):
+                        res = import_keywords(proj["id"], values, on_progress=show_import_progress)
+                    if res["inserted"]:
+                        mark_project_stale(proj["id"])
+                    st.success(f"Додано {res['inserted']} запитів (дублікатів пропущено: {res['duplicates']}).")
+                    time.sleep(1); st.rerun()
+                except Exception as e:
+                    st.error(f"Помилка імпорту: {e}")
         
         # TAB: AUTO
         with tab_auto:
-            st.info("Масове налаштування частоти.")
-            # ... Auto logic identical to previous code ...
+            st.info("Масове налаштування частоти. Планувальник сам запускає сканування, коли настає час.")
+            if proj.get("status") != "active" or not proj.get("allow_cron"):
+                st.warning("⚠️ Автозапуск працює лише для активних проектів, яким його дозволив адміністратор.")
+
+            try:
+                auto_kws = supabase.table("keywords").select("id, keyword_text, is_auto_scan, frequency, auto_models")\
+                    .eq("project_id", proj["id"]).execute().data or []
+            except Exception:
+                auto_kws = []
+            auto_text = {k["id"]: k["keyword_text"] for k in auto_kws}
+
+            all_auto = st.checkbox("Всі запити проекту", value=True, key="auto_all")
+            auto_ids = list(auto_text) if all_auto else st.multiselect(
+                "Запити:", list(auto_text), format_func=lambda i: auto_text.get(i, i), key="auto_ids"
+            )
+            c_f, c_m, c_on = st.columns([1, 2, 1])
+            auto_freq = c_f.selectbox("Частота:", list(FREQUENCY_UI), format_func=FREQUENCY_UI.get,
+                                      index=list(FREQUENCY_UI).index(DEFAULT_FREQUENCY), key="auto_freq")
+            auto_models = c_m.multiselect("LLM:", ALL_MODELS_UI, default=DEFAULT_AUTO_MODELS, key="auto_models")
+            with c_on:
+                st.write("")
+                auto_on = st.toggle("Увімкнено", value=True, key="auto_on")
+
+            if st.button("💾 Зберегти налаштування", type="primary", key="btn_auto_save", disabled=not auto_ids or not auto_models):
+                try:
+                    upd = {"is_auto_scan": auto_on, "frequency": auto_freq, "auto_models": auto_models}
+                    for i in range(0, len(auto_ids), 200):
+                        supabase.table("keywords").update(upd).in_("id", auto_ids[i:i + 200]).execute()
+                    reload_schedule()
+                    st.success(f"Збережено для {len(auto_ids)} запитів.")
+                except Exception as e:
+                    st.error(f"Помилка збереження: {e}")
+
+            on_count = sum(1 for k in auto_kws if k.get("is_auto_scan"))
+            st.caption(f"Автозапуск увімкнено для {on_count} з {len(auto_kws)} запитів.")
+            upcoming = project_schedule(proj["id"])
+            if upcoming:
+                st.dataframe(pd.DataFrame([
+                    {"Наступний запуск": datetime.fromtimestamp(ts, kyiv_tz).strftime("%d.%m %H:%M"), "Запит": text, "LLM": provider_label(provider)}
+                    for ts, text, provider in upcoming
+                ]), hide_index=True, use_container_width=True)
 
     st.divider()
     
@@ -419,8 +523,6 @@ def show_keywords_page():
     # ========================================================
     try:
         keywords = supabase.table("keywords").select("*").eq("project_id", proj["id"]).order("created_at", desc=True).execute().data
-        # Last scans fetching logic...
-        # For brevity, let's assume keywords list is ready
         if not keywords:
              st.info("Список порожній.")
              return
@@ -430,32 +532,61 @@ def show_keywords_page():
 
     update_suffix = st.session_state.get("bulk_update_counter", 0)
 
-    @st.fragment(run_every=10)
+    @st.fragment(run_every=KEYWORD_LIST_REFRESH_SECONDS)
     def render_list(kws_data, p_data, suffix):
-        # Fetch fresh scan dates...
-        # ...
-        
-        # Header
-        c1, c2, c3, c4 = st.columns([0.5, 3, 2, 1])
-        c2.markdown("**Запит**")
-        c3.markdown("**Останній скан**")
-        
-        for idx, k in enumerate(kws_data):
-            with st.container(border=True):
-                cc1, cc2, cc3, cc4 = st.columns([0.5, 3, 2, 1])
-                cc1.markdown(f"<div class='green-number'>{idx+1}</div>", unsafe_allow_html=True)
-                
-                # 🔥 LINK TO DETAILS
-                if cc2.button(k['keyword_text'], key=f"lnk_{k['id']}"):
-                    st.session_state["focus_keyword_id"] = k["id"]
+        # Останні скани всіх запитів: легкий кеш (keyword_id, provider, created_at), довантажує лише нові скани
+        last = load_last_scans(p_data["id"], ttl=KEYWORD_LIST_REFRESH_SECONDS)
+        last["model"] = provider_labels(last["provider"])
+        per_model = last.pivot_table(index="keyword_id", columns="model", values="last_scan_at", aggfunc="max")
+
+        kw_ids = [k["id"] for k in kws_data]
+        table = pd.DataFrame({
+            "№": range(1, len(kws_data) + 1),
+            "Запит": [k["keyword_text"] for k in kws_data],
+        })
+        table["Останній скан"] = pd.Series(kw_ids).map(per_model.max(axis=1)).values
+        for m in ALL_MODELS_UI:
+            table[m] = pd.Series(kw_ids).map(per_model[m]).values if m in per_model.columns else pd.NaT
+        for col in ["Останній скан"] + ALL_MODELS_UI:
+            table[col] = pd.to_datetime(table[col], utc=True).dt.tz_convert(kyiv_tz or "UTC")
+
+        date_cfg = {col: st.column_config.DatetimeColumn(col, format="DD.MM HH:mm") for col in ["Останній скан"] + ALL_MODELS_UI}
+
+        # Одна таблиця (віртуалізована браузером) замість контейнера з кнопками на кожен запит
+        event = st.dataframe(
+            table, hide_index=True, use_container_width=True,
+            column_config={"№": st.column_config.NumberColumn("№", width="small"), **date_cfg},
+            on_select="rerun", selection_mode="multi-row", key=f"kw_table_{suffix}"
+        )
+        selected = [kw_ids[i] for i in event.selection.rows]
+
+        c_open, c_del, c_info = st.columns([1, 1, 3])
+        # 🔥 LINK TO DETAILS
+        if c_open.button("🔍 Деталі", disabled=len(selected) != 1, key=f"kw_open_{suffix}"):
+            st.session_state["focus_keyword_id"] = selected[0]
+            st.rerun()
+
+        confirm_del_key = f"confirm_kw_del_{suffix}"
+        if not selected:
+            st.session_state[confirm_del_key] = False
+
+        if not st.session_state.get(confirm_del_key):
+            if c_del.button(f"🗑️ Видалити ({len(selected)})", disabled=not selected, key=f"kw_del_{suffix}"):
+                st.session_state[confirm_del_key] = True
+                st.rerun()
+            c_info.caption("Оберіть рядок, щоб відкрити деталі, або кілька — щоб видалити.")
+        else:
+            c_info.warning(f"Видалити {len(selected)} запит(ів) разом з історією сканувань?")
+            with c_del:
+                col_yes, col_no = st.columns(2)
+                if col_yes.button("✅", key=f"kw_del_yes_{suffix}"):
+                    supabase.table("keywords").delete().in_("id", selected).execute()
+                    invalidate_project_data(p_data["id"])
+                    st.session_state[confirm_del_key] = False
+                    st.session_state["bulk_update_counter"] = suffix + 1
                     st.rerun()
-                
-                # Date placeholder
-                cc3.caption("—") 
-                
-                # Delete
-                if cc4.button("🗑️", key=f"del_{k['id']}"):
-                    supabase.table("keywords").delete().eq("id", k['id']).execute()
+                if col_no.button("❌", key=f"kw_del_no_{suffix}"):
+                    st.session_state[confirm_del_key] = False
                     st.rerun()
 
     render_list(keywords, proj, update_suffix)
@@ -1,15 +1,15 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
 import requests
-import re
 import time
 import uuid
 
 # 🔥 ВАЖЛИВО: Імпортуємо залежності з наших утиліт
 # Це замінює перевірки globals(), які не працюють між файлами
 from utils.db import supabase
-from utils.n8n import n8n_trigger_analysis
+from utils.n8n import n8n_dispatch_batch
+from utils.importer import insert_keywords, iter_file_keywords, iter_url_keywords, iter_new_keywords, keyword_hash
+from utils.providers import DISPATCH_MODELS
 
 def show_my_projects_page():
     """
@@ -271,38 +271,24 @@ def show_my_projects_page():
         with kw_tabs[1]:
             st.caption("Завантажте файл або посилання.")
             import_source = st.radio("Джерело:", ["Файл (.xlsx)", "Посилання (URL)"], horizontal=True, key=f"mp_imp_src_{rk}")
-            df_upload = None
+            values = None
             if import_source == "Файл (.xlsx)":
                 uploaded_file = st.file_uploader("Оберіть файл", type=["xlsx", "csv"], key=f"mp_file_{rk}")
-                if uploaded_file:
-                    try: 
-                        if uploaded_file.name.endswith('.csv'): df_upload = pd.read_csv(uploaded_file)
-                        else: df_upload = pd.read_excel(uploaded_file)
-                    except Exception as e: st.error(f"Помилка файлу: {e}")
+                if uploaded_file: values = lambda: iter_file_keywords(uploaded_file)
             else:
                 import_url = st.text_input("Посилання (CSV/Google Sheet):", key=f"mp_url_{rk}")
-                if import_url:
+                if import_url: values = lambda: iter_url_keywords(import_url)
+
+            if values is not None:
+                if st.button("📥 Імпортувати запити", key=f"mp_add_imp_{rk}"):
                     try:
-                        if "docs.google.com" in import_url:
-                            match = re.search(r'/d/([a-zA-Z0-9-_]+)', import_url)
-                            if match:
-                                sheet_id = match.group(1)
-                                csv_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
-                                df_upload = pd.read_csv(csv_url)
-                        elif import_url.endswith(".csv"): df_upload = pd.read_csv(import_url)
-                        elif import_url.endswith(".xlsx"): df_upload = pd.read_excel(import_url)
-                    except: st.error("Помилка URL")
-
-            if df_upload is not None:
-                target_col = df_upload.columns[0]
-                cols_lower = [str(c).lower().strip() for c in df_upload.columns]
-                if "keyword" in cols_lower: target_col = df_upload.columns[cols_lower.index("keyword")]
-                imp_kws = df_upload[target_col].dropna().astype(str).tolist()
-                if st.button(f"📥 Імпортувати {len(imp_kws)} запитів", key=f"mp_add_imp_{rk}"):
-                    for kw in imp_kws:
-                        st.session_state["new_proj_keywords"].append({"id": str(uuid.uuid4()), "keyword": kw})
-                    st.success("Імпортовано!")
-                    st.rerun()
+                        # Потокове читання + відсів дублікатів (у файлі та вже доданих у список)
+                        seen = {keyword_hash(k['keyword']) for k in st.session_state["new_proj_keywords"]}
+                        new_items = [{"id": str(uuid.uuid4()), "keyword": kw} for kw, is_new in iter_new_keywords(values(), seen) if is_new]
+                        st.session_state["new_proj_keywords"].extend(new_items)
+                        st.success(f"Імпортовано {len(new_items)} запитів!")
+                        st.rerun()
+                    except Exception as e: st.error(f"Помилка імпорту: {e}")
 
         # --- TAB C: СПИСОК ---
         with kw_tabs[2]:
@@ -358,7 +344,7 @@ def show_my_projects_page():
         # --- ДІЇ ---
         col_llm, col_act = st.columns(2)
         with col_llm:
-            ui_llm_options = ["OpenAI GPT", "Google Gemini", "Perplexity"]
+            ui_llm_options = list(DISPATCH_MODELS)
             selected_llms = st.multiselect("Активувати LLM", ui_llm_options, default=["OpenAI GPT", "Google Gemini"], key=f"mp_llms_{rk}")
         
         with col_act:
@@ -395,34 +381,25 @@ def show_my_projects_page():
                         # 3. Keywords
                         final_kws_clean = [k['keyword'].strip() for k in keywords_list if k['keyword'].strip()]
                         if final_kws_clean:
-                            kws_data = [{"project_id": new_proj_id, "keyword_text": kw, "is_active": True} for kw in final_kws_clean]
-                            supabase.table("keywords").insert(kws_data).execute()
+                            insert_keywords(new_proj_id, final_kws_clean)
 
                         # 4. Встановлюємо проект в сесію
                         st.session_state["current_project"] = res_proj.data[0]
 
-                        # 5. ЗАПУСК АНАЛІЗУ (ПОШТУЧНО)
+                        # 5. ЗАПУСК АНАЛІЗУ (ПАКЕТНО)
                         if save_run:
-                            # Прямий виклик імпортованої функції
                             my_bar = st.progress(0, text="Ініціалізація...")
-                            
-                            total_ops = len(final_kws_clean) * len(selected_llms)
-                            if total_ops == 0: total_ops = 1 
-                            current_op = 0
-                            
-                            for kw_item in final_kws_clean:
-                                for model_item in selected_llms:
-                                    current_op += 1
-                                    prog_val = min(current_op / total_ops, 1.0)
-                                    my_bar.progress(prog_val, text=f"Аналіз: {kw_item} ({model_item})...")
-                                    
-                                    n8n_trigger_analysis(
-                                        project_id=new_proj_id, 
-                                        keywords=[kw_item], 
-                                        brand_name=new_brand_val, 
-                                        models=[model_item]
-                                    )
-                                    time.sleep(0.2) 
+
+                            def show_progress(done, total):
+                                my_bar.progress(min(done / total, 1.0), text=f"Запуск аналізу: {done} / {total} пакетів...")
+
+                            n8n_dispatch_batch(
+                                project_id=new_proj_id,
+                                keywords=final_kws_clean,
+                                brand_name=new_brand_val,
+                                models=selected_llms,
+                                on_progress=show_progress
+                            )
                             
                             my_bar.progress(1.0, text="Готово!")
                             st.toast(f"✅ Проект '{new_brand_val}' створено! Аналіз запущено.", icon="🚀")
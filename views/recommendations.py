@@ -6,6 +6,34 @@ from datetime import datetime, timedelta
 # 🔥 Імпорт залежностей з утиліт (важливо для модульності)
 from utils.db import supabase
 from utils.n8n import trigger_ai_recommendation
+from utils.jobs import enqueue_job, render_jobs_panel
+
+def build_and_save_recommendation(user, project, cat_key, category_title, prompt_context):
+    """
+    Викликає AI (utils/n8n.py) та зберігає результат у strategy_reports.
+    Виконується у фоновій задачі (utils/jobs.py), тому без st.* викликів.
+    Якщо зберегти не вдалося, HTML повертається в результаті задачі (резервне завантаження в панелі задач).
+    """
+    html_res = trigger_ai_recommendation(
+        user=user, project=project, category=category_title, context_text=prompt_context
+    )
+    try:
+        resp = supabase.table("strategy_reports").insert({
+            "project_id": project["id"], 
+            "category": cat_key, 
+            "html_content": html_res, 
+            "created_at": datetime.now().isoformat()
+        }).execute()
+    except Exception as e:
+        safe_brand_name = project.get('brand_name', 'Brand').replace(" ", "_")
+        return {
+            "report_id": None,
+            "save_error": str(e),
+            "html": html_res,
+            "file_name": f"Recommendations_{cat_key}_{safe_brand_name}.html",
+        }
+    return {"report_id": resp.data[0].get("id") if resp.data else None}
+
 
 def show_recommendations_page():
     """
@@ -84,39 +112,17 @@ def show_recommendations_page():
                         if proj.get('status') == 'blocked':
                             st.error("Проект заблоковано.")
                         else:
-                            st.warning("⏳ Розпочато формування рекомендацій. Будь ласка, не закривайте сторінку і дочекайтеся завершення (це може зайняти до 60 секунд).")
-                            
-                            with st.spinner("Аналіз даних та генерація звіту..."):
-                                # Виклик функції з utils/n8n.py
-                                html_res = trigger_ai_recommendation(
-                                    user=user, project=proj, category=info["title"], context_text=info["prompt_context"]
-                                )
-                                try:
-                                    supabase.table("strategy_reports").insert({
-                                        "project_id": proj["id"], 
-                                        "category": cat_key, 
-                                        "html_content": html_res, 
-                                        "created_at": datetime.now().isoformat()
-                                    }).execute()
-                                    
-                                    st.success("✅ Рекомендації успішно сформовано!")
-                                    st.markdown(f"""
-                                    <div style="padding:15px; border:1px solid #00C896; border-radius:5px; background-color:#f0fff4;">
-                                        <p>Ваш звіт збережено. Перейдіть у вкладку <b>"Історія рекомендацій"</b>, щоб переглянути його.</p>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                                    
-                                except Exception as e:
-                                    st.error(f"Помилка збереження в БД: {e}")
-                                    with st.expander("Резервний перегляд", expanded=True):
-                                        components.html(html_res, height=600, scrolling=True)
-                                        # Кнопка скачування (Резервна)
-                                        st.download_button(
-                                            "📥 Завантажити Рекомендації", 
-                                            html_res, 
-                                            file_name=f"Recommendations_{cat_key}_{safe_brand_name}.html", 
-                                            mime="text/html"
-                                        )
+                            # Генерація у фоні (до 2 хв) — сторінку можна закрити або перейти в інший розділ
+                            enqueue_job(
+                                "recommendation", build_and_save_recommendation,
+                                user, proj, cat_key, info["title"], info["prompt_context"],
+                                project_id=proj["id"], user_id=getattr(user, "id", None),
+                                title=f"💡 {info['title']}"
+                            )
+                            st.success("✅ Запит прийнято. Готові рекомендації з'являться у вкладці \"Історія рекомендацій\".")
+
+        st.write("")
+        render_jobs_panel(proj["id"], kinds=["recommendation"])
 
     # ========================================================
     # TAB 2: ІСТОРІЯ
@@ -4,10 +4,15 @@ from datetime import datetime
 import streamlit.components.v1 as components
 import pytz 
 import re
-from urllib.parse import urlparse
 
 # 🔥 Імпорт залежностей з утиліт (для стабільної роботи)
-from utils.db import supabase
+from utils.db import supabase, fetch_in_chunks
+from utils.data import iter_scan_pages, CHUNK_SIZE
+from utils.transforms import brand_target_mask, normalize_sentiment
+from utils.domains import compile_whitelist, match_official
+from utils.jobs import enqueue_job, render_jobs_panel
+from utils.providers import provider_label
+from utils.urls import enrich_url
 
 # --- ФУНКЦІЯ ГЕНЕРАЦІЇ HTML ЗВІТУ (Вбудована сюди для надійності) ---
 def generate_html_report_content(project_name, scans_data, whitelist_domains):
@@ -22,19 +27,6 @@ def generate_html_report_content(project_name, scans_data, whitelist_domains):
         try: return int(float(val))
         except: return 0
 
-    def get_domain(url):
-        try: return urlparse(str(url)).netloc.replace('www.', '').lower()
-        except: return ""
-
-    def is_url_official(url, domains_list):
-        if not url or not domains_list: return False
-        try:
-            url_lower = str(url).lower()
-            for domain in domains_list:
-                clean_d = str(domain).lower().replace('https://', '').replace('http://', '').replace('www.', '').strip()
-                if clean_d and clean_d in url_lower: return True
-            return False
-        except: return False
 
     def format_llm_text(text):
         if not text: return "Текст відповіді відсутній."
@@ -52,58 +44,36 @@ def generate_html_report_content(project_name, scans_data, whitelist_domains):
         if kw and (kw not in query_time_map or t > query_time_map[kw]):
             query_time_map[kw] = t
 
-    # --- UI Mapping ---
-    PROVIDER_MAPPING = {
-        "perplexity": "Perplexity",
-        "gpt-4o": "Chat GPT",         
-        "gpt-4": "Chat GPT",          
-        "gemini-1.5-pro": "Gemini",   
-        "gemini": "Gemini"            
-    }
-    
-    def get_ui_provider(p):
-        p_str = str(p).lower()
-        for k, v in PROVIDER_MAPPING.items():
-            if k in p_str: return v
-        return str(p).capitalize()
+    # --- Mentions Processing (векторизовано, ті ж правила, що й на дашборді) ---
+    all_mentions_raw = [m for scan in scans_data for m in scan.get('brand_mentions', [])]
+    if all_mentions_raw:
+        df_all_m = pd.DataFrame(all_mentions_raw)
+        for col in ['brand_name', 'is_my_brand', 'sentiment_score', 'mention_count', 'rank_position']:
+            if col not in df_all_m.columns: df_all_m[col] = None
+        df_all_m['is_real_target'] = brand_target_mask(df_all_m, project_name)
+        df_all_m['sentiment_score'] = normalize_sentiment(df_all_m['sentiment_score'])
+        for col in ['mention_count', 'rank_position']:
+            df_all_m[col] = pd.to_numeric(df_all_m[col], errors='coerce').fillna(0).astype(int)
+
+        cols = ['is_real_target', 'sentiment_score', 'mention_count', 'rank_position']
+        for m, vals in zip(all_mentions_raw, df_all_m[cols].to_dict('records')):
+            m.update(vals)
 
     # --- Group Data ---
+    whitelist_index = compile_whitelist(whitelist_domains)
     data_by_provider = {}
-    target_norm = str(project_name).lower().strip().split(' ')[0] if project_name else ""
-
     for scan in scans_data:
-        prov_ui = get_ui_provider(scan.get('provider', 'Other'))
+        prov_ui = provider_label(scan.get('provider', 'Other'), short=True)
         if prov_ui not in data_by_provider:
             data_by_provider[prov_ui] = []
-        
-        # Mentions Processing
-        mentions = scan.get('brand_mentions', [])
-        processed_mentions = []
-        for m in mentions:
-            b_name = str(m.get('brand_name', '')).lower().strip()
-            is_db_flag = str(m.get('is_my_brand', '')).lower() in ['true', '1', 't', 'yes', 'on']
-            is_text_match = (target_norm in b_name) if target_norm else False
-            
-            m['is_real_target'] = is_db_flag or is_text_match
-            m['mention_count'] = safe_int(m.get('mention_count', 0))
-            m['rank_position'] = safe_int(m.get('rank_position', 0))
-            
-            raw_sent = str(m.get('sentiment_score', '')).lower()
-            if 'поз' in raw_sent or 'pos' in raw_sent: m['sentiment_score'] = 'Позитивна'
-            elif 'нег' in raw_sent or 'neg' in raw_sent: m['sentiment_score'] = 'Негативна'
-            elif 'ней' in raw_sent or 'neu' in raw_sent: m['sentiment_score'] = 'Нейтральна'
-            else: m['sentiment_score'] = 'Не визначено'
-
-            processed_mentions.append(m)
-        scan['brand_mentions'] = processed_mentions
 
         # Sources Processing
         sources = scan.get('extracted_sources', [])
         processed_sources = []
         for s in sources:
             url = s.get('url', '')
-            s['is_official_calc'] = is_url_official(url, whitelist_domains)
-            s['domain_clean'] = get_domain(url)
+            s['is_official_calc'] = match_official(url, whitelist_index) is not None
+            s['domain_clean'] = enrich_url(url)[1]
             processed_sources.append(s)
         scan['extracted_sources'] = processed_sources
         
@@ -541,6 +511,73 @@ __JS_BLOCK__
 
     return final_html
 
+# Колонки для звіту (без raw_response та зайвих полів згадок / джерел)
+REPORT_SCAN_COLUMNS = (
+    "id, keyword_id, provider, created_at, "
+    "brand_mentions(brand_name, is_my_brand, mention_count, rank_position, sentiment_score), "
+    "extracted_sources(url)"
+)
+
+
+def build_and_save_report(project_id, brand_name, report_name):
+    """
+    Збирає дані, генерує HTML та зберігає звіт зі статусом pending.
+    Виконується у фоновій задачі (utils/jobs.py), тому без st.* викликів.
+    """
+    # 1. Whitelist + 2. Keywords (лише ці дві невеликі таблиці, без завантаження всього проекту)
+    assets = supabase.table("official_assets")\
+        .select("domain_or_url")\
+        .eq("project_id", project_id)\
+        .execute().data or []
+    whitelist_domains = [str(a["domain_or_url"]) for a in assets if str(a.get("domain_or_url") or "").strip()]
+    keywords = supabase.table("keywords")\
+        .select("id, keyword_text")\
+        .eq("project_id", project_id)\
+        .execute().data or []
+    kw_map = {k["id"]: k["keyword_text"] for k in keywords}
+
+    if not kw_map:
+        raise ValueError("У проекті немає ключових слів.")
+
+    # 3. Останній скан для кожної пари (запит, модель).
+    # Історію читаємо потоково сторінками (легкі колонки), тож розмір історії не обмежений.
+    latest_ids = {}
+    for page in iter_scan_pages(project_id, "id, keyword_id, provider, created_at"):
+        for s in page:
+            latest_ids.setdefault((s['keyword_id'], s['provider']), s['id'])
+
+    if not latest_ids:
+        raise ValueError("Історія сканувань пуста.")
+
+    # 4. Snapshot: лише потрібні колонки для останніх сканів, тексти відповідей — окремим запитом,
+    # повз спільний LRU-кеш відповідей (звіт не витісняє тексти, які показують сторінки)
+    final_scans_data = fetch_in_chunks(
+        "scan_results", "id", list(latest_ids.values()),
+        columns=REPORT_SCAN_COLUMNS
+    )
+    responses = {
+        row['id']: row.get('raw_response') or ""
+        for row in fetch_in_chunks("scan_results", "id", [s['id'] for s in final_scans_data],
+                                   columns="id, raw_response", chunk_size=CHUNK_SIZE)
+    }
+    for s in final_scans_data:
+        s['keyword_text'] = kw_map.get(s['keyword_id'], "Unknown Query")
+        s['raw_response'] = responses.get(s['id'], "")
+    final_scans_data.sort(key=lambda s: s['created_at'], reverse=True)
+
+    # 5. Generate HTML
+    html_code = generate_html_report_content(brand_name, final_scans_data, whitelist_domains)
+
+    # 6. Save
+    resp = supabase.table("reports").insert({
+        "project_id": project_id,
+        "report_name": report_name,
+        "html_content": html_code,
+        "status": "pending"
+    }).execute()
+    return {"report_id": resp.data[0].get("id") if resp.data else None}
+
+
 def show_reports_page():
     """
     Сторінка Звітів (Фінальна версія).
@@ -597,63 +634,18 @@ def show_reports_page():
         rep_name = st.text_input("Назва звіту", value=f"Звіт {proj.get('brand_name')} - {datetime.now().strftime('%d.%m.%Y')}")
         
         if st.button("✨ Сформувати звіт", type="primary"):
-            with st.spinner("Аналіз даних, розрахунок метрик та генерація HTML..."):
-                try:
-                    # 1. Whitelist
-                    wl_resp = supabase.table("official_assets").select("domain_or_url").eq("project_id", proj["id"]).execute()
-                    whitelist_domains = [w['domain_or_url'] for w in wl_resp.data] if wl_resp.data else []
-
-                    # 2. Keywords
-                    kw_resp = supabase.table("keywords").select("id, keyword_text").eq("project_id", proj["id"]).execute()
-                    kw_map = {k['id']: k['keyword_text'] for k in kw_resp.data} if kw_resp.data else {}
-                    
-                    if not kw_map:
-                        st.error("У проекті немає ключових слів.")
-                        st.stop()
-
-                    # 3. Scans + Data
-                    scans_resp = supabase.table("scan_results")\
-                        .select("*, brand_mentions(*), extracted_sources(*)")\
-                        .eq("project_id", proj["id"])\
-                        .order("created_at", desc=True)\
-                        .limit(2000)\
-                        .execute()
-                    
-                    raw_scans = scans_resp.data if scans_resp.data else []
-                    if not raw_scans:
-                        st.error("Історія сканувань пуста.")
-                        st.stop()
-
-                    # 4. Snapshot Logic
-                    processed_scans = []
-                    for s in raw_scans:
-                        s['keyword_text'] = kw_map.get(s['keyword_id'], "Unknown Query")
-                        processed_scans.append(s)
-                    
-                    df_raw = pd.DataFrame(processed_scans)
-                    if not df_raw.empty:
-                        df_raw = df_raw.sort_values('created_at', ascending=False)
-                        df_latest = df_raw.drop_duplicates(subset=['keyword_id', 'provider'], keep='first')
-                        final_scans_data = df_latest.to_dict('records')
-                    else:
-                        final_scans_data = []
-
-                    # 5. Generate HTML
-                    html_code = generate_html_report_content(proj.get('brand_name'), final_scans_data, whitelist_domains)
-                    
-                    # 6. Save
-                    supabase.table("reports").insert({
-                        "project_id": proj["id"],
-                        "report_name": rep_name,
-                        "html_content": html_code,
-                        "status": "pending"
-                    }).execute()
-                    
-                    st.balloons()
-                    st.success("✅ Звіт успішно сформовано! Очікуйте на модерацію.")
-                    
-                except Exception as e:
-                    st.error(f"Помилка генерації: {e}")
+            if proj.get('status') == 'blocked':
+                st.error("Проект заблоковано.")
+            else:
+                # Генерація у фоні: сторінку можна закрити, статус — у панелі задач нижче
+                enqueue_job(
+                    "report", build_and_save_report, proj["id"], proj.get('brand_name'), rep_name,
+                    project_id=proj["id"], user_id=getattr(st.session_state.get("user"), "id", None),
+                    title=f"📄 {rep_name}"
+                )
+                st.success("✅ Звіт поставлено в чергу. Після генерації він з'явиться на модерації.")
+
+        render_jobs_panel(proj["id"], kinds=["report"])
 
     # =========================================================
     # ТАБ 2: ГОТОВІ ЗВІТИ (Перегляд)
@@ -2,10 +2,14 @@ import pandas as pd
 import plotly.express as px
 import streamlit as st
 import time
-from urllib.parse import urlparse
 
-# 🔥 Імпорт підключення до БД (важливо!)
-from utils.db import supabase
+from utils.data import load_project_data, load_source_counters, load_link_counters, invalidate_project_data, LINK_TOP_N
+from utils.domains import official_entries
+from utils.jobs import enqueue_job, list_jobs, render_jobs_panel
+from utils.transforms import flag_mask
+from utils.whitelist import save_whitelist, reclassify_sources
+from utils.urls import backfill_source_urls
+from utils.providers import provider_labels
 
 def show_sources_page():
     """
@@ -54,66 +58,48 @@ def show_sources_page():
     # 1. ОТРИМАННЯ ДАНИХ (Скан результати)
     # ==============================================================================
     try:
-        # Keywords
-        kw_resp = supabase.table("keywords").select("id, keyword_text").eq("project_id", proj["id"]).execute()
-        kw_map = {k['id']: k['keyword_text'] for k in kw_resp.data} if kw_resp.data else {}
-
-        # Scan Results
-        scan_resp = supabase.table("scan_results")\
-            .select("id, provider, created_at, keyword_id")\
-            .eq("project_id", proj["id"])\
-            .execute()
-        
-        scan_meta = {} 
-        scan_ids = []
-        
-        PROVIDER_MAP = {
-            "perplexity": "Perplexity",
-            "gpt-4o": "OpenAI GPT", "gpt-4": "OpenAI GPT",
-            "gemini-1.5-pro": "Google Gemini", "gemini": "Google Gemini"
-        }
-
-        if scan_resp.data:
-            for s in scan_resp.data:
-                scan_ids.append(s['id'])
-                raw_p = s.get('provider', '').lower()
-                clean_p = "Інше"
-                for k, v in PROVIDER_MAP.items():
-                    if k in raw_p:
-                        clean_p = v
-                        break
-                
-                scan_meta[s['id']] = {
-                    'provider': clean_p,
-                    'date': s['created_at'],
-                    'keyword_text': kw_map.get(s['keyword_id'], "Невідомий запит")
-                }
+        # Спільний кеш даних проекту (utils/data.py)
+        data = load_project_data(proj["id"])
+        kw_map = dict(zip(data["keywords"]["id"], data["keywords"]["keyword_text"]))
+        df_scans = data["scans"]
+
+        # Метадані скану (провайдер, дата, запит) — одна таблиця, приєднується до джерел за scan_result_id
+        scan_meta = pd.DataFrame({
+            'provider': provider_labels(df_scans['provider']).to_numpy(),
+            'keyword_text': df_scans['keyword_id'].map(kw_map).fillna("Невідомий запит").to_numpy(),
+            'scan_date': df_scans['created_at'].to_numpy(),
+        }, index=df_scans['id'])
         
         # Extracted Sources
-        df_master = pd.DataFrame()
-        if scan_ids:
-            # Читаємо батчами, якщо ID багато, але для простоти тут один запит (можна оптимізувати пізніше)
-            sources_resp = supabase.table("extracted_sources").select("*").in_("scan_result_id", scan_ids).execute()
-            if sources_resp.data:
-                df_master = pd.DataFrame(sources_resp.data)
-                df_master['provider'] = df_master['scan_result_id'].map(lambda x: scan_meta.get(x, {}).get('provider', 'Інше'))
-                df_master['keyword_text'] = df_master['scan_result_id'].map(lambda x: scan_meta.get(x, {}).get('keyword_text', ''))
-                df_master['scan_date'] = df_master['scan_result_id'].map(lambda x: scan_meta.get(x, {}).get('date'))
-                
-                if 'domain' not in df_master.columns:
-                    df_master['domain'] = df_master['url'].apply(lambda x: urlparse(x).netloc if x else "unknown")
+        df_master = data["sources"]
+        if not df_master.empty:
+            meta = scan_meta.reindex(df_master['scan_result_id'])
+            df_master['provider'] = meta['provider'].fillna('Інше').to_numpy()
+            df_master['keyword_text'] = meta['keyword_text'].fillna('').to_numpy()
+            df_master['scan_date'] = meta['scan_date'].to_numpy()
+            
+            # Домен, якщо n8n його не заповнив — готовий хост з шару даних (utils.urls)
+            missing_domain = df_master['domain'].isna() | (df_master['domain'].astype(str).str.strip() == "")
+            df_master.loc[missing_domain, 'domain'] = df_master.loc[missing_domain, 'host'].replace("", "unknown")
+
+        # Лічильники доменів (домен, тип, провайдер, запит) для вкладки ренкінгу
+        counters = load_source_counters(proj["id"]).copy()
+        counters['provider'] = provider_labels(counters['provider'])
+        kw_ids_by_text = data["keywords"].groupby('keyword_text')['id'].apply(list).to_dict()
 
     except Exception as e:
         st.error(f"Помилка завантаження даних: {e}")
         df_master = pd.DataFrame()
 
+    def kw_ids_for(texts):
+        return [kw_id for t in texts for kw_id in kw_ids_by_text.get(t, [])]
+
     # ==============================================================================
     # 2. WHITELIST LOGIC (ПРАВИЛЬНЕ ЧИТАННЯ)
     # ==============================================================================
     try:
-        # 🔥 FIX: Читаємо з таблиці official_assets
-        oa_resp = supabase.table("official_assets").select("domain_or_url, type").eq("project_id", proj["id"]).execute()
-        raw_assets = oa_resp.data if oa_resp.data else []
+        # 🔥 FIX: Читаємо з таблиці official_assets (через кеш проекту)
+        raw_assets = data["assets"].to_dict('records')
     except Exception as e:
         raw_assets = []
 
@@ -131,16 +117,29 @@ def show_sources_page():
     
     OFFICIAL_DOMAINS = [d["Домен"].lower().strip() for d in assets_list_dicts if d["Домен"]]
 
-    # Функція перевірки
-    def check_is_official(url):
-        if not url: return False
-        u_str = str(url).lower()
-        for od in OFFICIAL_DOMAINS:
-            if od in u_str: return True
-        return False
-
+    # Збережений прапорець is_official (перераховується у фоні після зміни Whitelist, utils/whitelist.py).
+    # Запис Whitelist шукаємо лише для офіційних джерел.
     if not df_master.empty:
-        df_master['is_official_dynamic'] = df_master['url'].apply(check_is_official)
+        df_master['is_official_dynamic'] = flag_mask(df_master['is_official'])
+        df_master['official_entry'] = None
+        df_master.loc[df_master['is_official_dynamic'], 'official_entry'] = \
+            official_entries(df_master.loc[df_master['is_official_dynamic'], 'url'], OFFICIAL_DOMAINS)
+
+    def enqueue_reclassify(changed=None):
+        # Повний перерахунок (changed=None) — окремий тип задачі: за ним видно, чи проект уже перераховано
+        enqueue_job(
+            "reclassify_sources" if changed is not None else "reclassify_all_sources",
+            reclassify_sources, proj["id"], changed,
+            project_id=proj["id"], user_id=getattr(st.session_state.get("user"), "id", None),
+            title="🔄 Перерахунок офіційних джерел"
+        )
+
+    # Джерела, збережені до появи фонового перерахунку, мають застарілий прапорець:
+    # один повний перерахунок на проект (далі — лише після змін Whitelist або кнопкою).
+    # Задача, що завершилась помилкою, ставиться знову при наступному відкритті сторінки.
+    last_full = list_jobs(proj["id"], kinds=["reclassify_all_sources"], limit=1)
+    if not df_master.empty and (not last_full or last_full[0]["status"] == "error"):
+        enqueue_reclassify()
 
     # ==============================================================================
     # 3. ВКЛАДКИ
@@ -233,10 +232,8 @@ def show_sources_page():
 
             # Рахуємо статистику
             if not df_master.empty:
-                def get_stat_whitelist(dom):
-                    matches = df_master[df_master['url'].astype(str).str.contains(dom.lower(), case=False, na=False)]
-                    return len(matches)
-                df_assets['Згадок'] = df_assets['Домен'].apply(get_stat_whitelist)
+                entry_counts = df_master['official_entry'].value_counts()
+                df_assets['Згадок'] = df_assets['Домен'].str.lower().str.strip().map(entry_counts).fillna(0).astype(int)
             else:
                 df_assets['Згадок'] = 0
 
@@ -251,11 +248,27 @@ def show_sources_page():
                 }
             )
             
-            if st.button("✏️ Редагувати список"):
-                st.session_state["edit_whitelist_mode"] = True
-                # Завантажуємо поточні дані в temp_assets для редагування
-                st.session_state["temp_assets"] = assets_list_dicts.copy()
-                st.rerun()
+            c_edit, c_recalc, c_urls = st.columns([1, 1, 1])
+            with c_edit:
+                if st.button("✏️ Редагувати список"):
+                    st.session_state["edit_whitelist_mode"] = True
+                    # Завантажуємо поточні дані в temp_assets для редагування
+                    st.session_state["temp_assets"] = assets_list_dicts.copy()
+                    st.rerun()
+            with c_recalc:
+                if st.button("🔄 Перерахувати всі джерела", help="Оновити позначку 'офіційне' для всіх знайдених джерел за поточним списком"):
+                    enqueue_reclassify()
+                    st.rerun()
+            with c_urls:
+                if st.button("🧩 Зберегти канонічні URL", help="Записати канонічний URL, хост і домен для джерел, де їх ще немає"):
+                    enqueue_job(
+                        "backfill_source_urls", backfill_source_urls, proj["id"],
+                        project_id=proj["id"], user_id=getattr(st.session_state.get("user"), "id", None),
+                        title="🧩 Канонічні URL джерел"
+                    )
+                    st.rerun()
+
+            render_jobs_panel(proj["id"], kinds=["reclassify_sources", "reclassify_all_sources", "backfill_source_urls"])
         
         # --- РЕЖИМ РЕДАГУВАННЯ ---
         else:
@@ -310,26 +323,17 @@ def show_sources_page():
             with c1:
                 if st.button("💾 Зберегти", type="primary"):
                     try:
-                        # 1. Видаляємо старі записи
-                        supabase.table("official_assets").delete().eq("project_id", proj["id"]).execute()
-                        
-                        # 2. Формуємо нові дані (конвертуємо UI -> DB)
-                        insert_data = []
-                        for item in st.session_state["temp_assets"]:
-                            d_val = str(item["Домен"]).strip()
-                            if d_val:
-                                db_type_val = TYPE_UI_TO_DB.get(item["Мітка"], "website")
-                                
-                                insert_data.append({
-                                    "project_id": proj["id"],
-                                    "domain_or_url": d_val,
-                                    "type": db_type_val
-                                })
-                        
-                        # 3. Вставляємо
-                        if insert_data:
-                            supabase.table("official_assets").insert(insert_data).execute()
-                            
+                        # Лише різниця зі збереженим списком (utils/whitelist.py)
+                        new_rows = [
+                            {"domain_or_url": str(item["Домен"]).strip(), "type": TYPE_UI_TO_DB.get(item["Мітка"], "website")}
+                            for item in st.session_state["temp_assets"] if str(item["Домен"]).strip()
+                        ]
+                        diff = save_whitelist(proj["id"], new_rows)
+                        invalidate_project_data(proj["id"])
+
+                        # Збережений прапорець is_official джерел — перераховується у фоні
+                        if diff["changed"]:
+                            enqueue_reclassify(diff["changed"])
                         st.success("Список оновлено!")
                         st.session_state["edit_whitelist_mode"] = False
                         time.sleep(1)
@@ -348,31 +352,27 @@ def show_sources_page():
             all_kws = sorted(df_master['keyword_text'].unique())
             sel_kws_rank = st.multiselect("🔍 Фільтр по запитах:", all_kws, key="rank_kw_filter")
             
-            df_rank_view = df_master.copy()
+            # Зріз готових лічильників (utils/data.py) замість pivot по всіх джерелах
+            df_rank_view = counters
             if sel_kws_rank:
-                df_rank_view = df_rank_view[df_rank_view['keyword_text'].isin(sel_kws_rank)]
+                df_rank_view = df_rank_view[df_rank_view['keyword_id'].isin(kw_ids_for(sel_kws_rank))]
             
             if not df_rank_view.empty:
                 pivot_df = df_rank_view.pivot_table(
-                    index='domain', columns='provider', values='mention_count', aggfunc='sum', fill_value=0
+                    index='domain', columns='provider', values='mentions', aggfunc='sum', fill_value=0
                 ).reset_index()
                 
                 pivot_df['Всього'] = pivot_df.sum(axis=1, numeric_only=True)
                 for col in ["Perplexity", "OpenAI GPT", "Google Gemini"]:
                     if col not in pivot_df.columns: pivot_df[col] = 0
                 
-                def get_meta(dom):
-                    is_off = "Зовнішній"
-                    for od in OFFICIAL_DOMAINS:
-                        if od in dom.lower():
-                            is_off = "Офіційний"
-                            break
-                    dates = df_rank_view[df_rank_view['domain'] == dom]['scan_date']
-                    first = dates.min() if not dates.empty else None
-                    first_str = pd.to_datetime(first).strftime("%Y-%m-%d") if first else "-"
-                    return is_off, first_str
-
-                pivot_df[['Тип', 'Вперше знайдено']] = pivot_df['domain'].apply(lambda x: pd.Series(get_meta(x)))
+                # Тип (збережений прапорець is_official: офіційний, якщо є хоч одне офіційне посилання домену)
+                # та дата першої появи (first_seen з лічильників)
+                first_seen = pd.to_datetime(df_rank_view.groupby('domain')['first_seen'].min(), utc=True)
+                is_official_domain = df_rank_view.groupby('domain')['is_official'].any()
+                pivot_df['Тип'] = pivot_df['domain'].map(is_official_domain).fillna(False)\
+                    .map({True: "Офіційний", False: "Зовнішній"})
+                pivot_df['Вперше знайдено'] = pivot_df['domain'].map(first_seen.dt.strftime("%Y-%m-%d")).fillna("-")
                 pivot_df = pivot_df.sort_values("Всього", ascending=False).reset_index(drop=True)
                 
                 cols_order = ["domain", "Тип", "Всього", "Perplexity", "OpenAI GPT", "Google Gemini", "Вперше знайдено"]
@@ -406,25 +406,31 @@ def show_sources_page():
             c_f3, c_f4 = st.columns(2)
             with c_f3: type_filter = st.selectbox("Тип ресурсу:", ["Всі", "Офіційні", "Зовнішні"], key="links_type_filter")
             
-            df_links_view = df_master.copy()
-            if sel_kws_links: df_links_view = df_links_view[df_links_view['keyword_text'].isin(sel_kws_links)]
-            if search_url: df_links_view = df_links_view[df_links_view['url'].astype(str).str.contains(search_url, case=False)]
-            if type_filter == "Офіційні": df_links_view = df_links_view[df_links_view['is_official_dynamic'] == True]
-            elif type_filter == "Зовнішні": df_links_view = df_links_view[df_links_view['is_official_dynamic'] == False]
+            # Топ посилань для обраних фільтрів (utils/data.py) замість pivot по всіх джерелах
+            df_links_view = load_link_counters(
+                proj["id"],
+                keyword_ids=kw_ids_for(sel_kws_links) if sel_kws_links else None,
+                official={"Офіційні": True, "Зовнішні": False}.get(type_filter),
+                search=search_url,
+            )
+            df_links_view['provider'] = provider_labels(df_links_view['provider'])
 
             if not df_links_view.empty:
+                # Варіанти одного посилання (www., utm_*, слеш у кінці) вже зведені за канонічним URL
                 pivot_links = df_links_view.pivot_table(
-                    index=['url', 'domain', 'is_official_dynamic'],
-                    columns='provider', values='mention_count', aggfunc='sum', fill_value=0
+                    index=['url', 'domain', 'is_official'],
+                    columns='provider', values='mentions', aggfunc='sum', fill_value=0
                 ).reset_index()
                 
                 pivot_links['Всього'] = pivot_links.sum(axis=1, numeric_only=True)
                 for col in ["Perplexity", "OpenAI GPT", "Google Gemini"]:
                     if col not in pivot_links.columns: pivot_links[col] = 0
                 
-                pivot_links['Тип'] = pivot_links['is_official_dynamic'].apply(lambda x: "Офіційні" if x else "Зовнішні")
+                pivot_links['Тип'] = pivot_links['is_official'].map({True: "Офіційні", False: "Зовнішні"})
                 pivot_links = pivot_links.sort_values("Всього", ascending=False).reset_index(drop=True)
-                
+                if len(pivot_links) >= LINK_TOP_N:
+                    st.caption(f"Показано топ {LINK_TOP_N} посилань за кількістю згадок. Решту можна знайти пошуком URL.")
+
                 cols_order = ["url", "domain", "Тип", "Всього", "Perplexity", "OpenAI GPT", "Google Gemini"]
                 final_cols = [c for c in cols_order if c in pivot_links.columns]
                 